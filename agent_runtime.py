@@ -0,0 +1,159 @@
+# agent_runtime.py
+"""
+进程级共享的 Agent 运行时
+
+编译后的 LangGraph 工作流、MCP 工具列表和检查点存储器在每个进程中只构建一次，
+所有 Chainlit 会话共享同一个实例，会话之间的隔离完全依赖 config 中的 thread_id。
+
+构建函数和会话管理器类可以由调用方传入：以脚本方式运行的 main.py 传入自身（__main__）中的定义，
+避免 main 被再次作为模块导入、出现两份 SimpleSessionManager 等定义；
+未传入时（Chainlit）在首次构建运行时才从 main 导入。
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class AgentRuntime:
+    """进程内共享的 Agent 组件集合"""
+
+    def __init__(self, app, registry, persistence_config: Dict[str, Any], build_seconds: float,
+                 session_manager_factory: Callable[..., Any]):
+        self.app = app
+        self.session_manager_factory = session_manager_factory
+        self.registry = registry
+        self.persistence_config = persistence_config
+        self.build_seconds = build_seconds
+        self.background_jobs: List[Any] = []
+        self.session_index = self._create_session_index()
+        self.thread_catalog = self._create_thread_catalog()
+        self._evictions: set = set()
+
+    @property
+    def tools(self) -> List[Any]:
+        """当前可用的工具列表（延迟就绪的 MCP 服务器会追加到其中）"""
+        return self.registry.tools
+
+    @property
+    def checkpointer(self):
+        """编译图时绑定的检查点存储器"""
+        return self.app.checkpointer
+
+    @property
+    def store(self):
+        """编译图时绑定的长期记忆存储，未启用时为 None"""
+        return self.app.store
+
+    def new_session_manager(self):
+        """为单个会话创建独立的会话管理器（会话管理器持有当前 thread_id，不能共享）"""
+        return self.session_manager_factory(self.persistence_config, session_index=self.session_index)
+
+    def _create_thread_catalog(self):
+        from thread_catalog import ThreadCatalog
+        return ThreadCatalog.from_checkpointer(self.checkpointer)
+
+    def _create_session_index(self):
+        from session_quota import UserSessionIndex
+
+        session_config = self.persistence_config.get("session_management", {})
+        delete = session_config.get("quota_policy", "archive") == "delete"
+        return UserSessionIndex(session_config.get("max_sessions_per_user"),
+                                on_evict=self._delete_session if delete else self._archive_session)
+
+    def _track_eviction(self, coro):
+        # 后台执行，不阻塞新会话的创建；关闭运行时前等待完成
+        task = asyncio.create_task(coro)
+        self._evictions.add(task)
+        task.add_done_callback(self._evictions.discard)
+
+    def _delete_session(self, thread_id: str):
+        """删除被配额淘汰的会话的检查点"""
+        self._track_eviction(self.checkpointer.adelete_thread(thread_id))
+
+    def _archive_session(self, thread_id: str):
+        """把被配额淘汰的会话记为已归档（不支持的存储器只从索引中移除）"""
+        from session_quota import archive_sessions
+
+        self.session_index.mark_archived(thread_id)
+        self._track_eviction(archive_sessions(self.checkpointer, [thread_id]))
+
+    def start_background_jobs(self):
+        """启动按配置启用的后台维护任务"""
+        from checkpoint_retention import CheckpointRetention
+        from database_backup import DatabaseBackup
+        from memory_store import MemoryExpiry
+        from session_reaper import SessionReaper
+
+        jobs = [
+            CheckpointRetention.from_config(self.checkpointer, self.persistence_config),
+            MemoryExpiry.from_config(self.store, self.persistence_config),
+            DatabaseBackup.from_config(self.persistence_config),
+            SessionReaper.from_config(self.checkpointer, self.persistence_config,
+                                      on_reaped=self.session_index.discard),
+        ]
+        for job in jobs:
+            if job is not None:
+                job.start()
+                self.background_jobs.append(job)
+
+    async def aclose(self):
+        """关闭运行时持有的资源"""
+        for job in reversed(self.background_jobs):
+            await job.aclose()
+        self.background_jobs.clear()
+        if self._evictions:
+            await asyncio.gather(*self._evictions, return_exceptions=True)
+        await self.registry.aclose()
+        if self.store is not None:
+            await self.store.aclose()
+        # SQLite 存储器通过 aclose 关闭共享连接
+        aclose_checkpointer = getattr(self.checkpointer, "aclose", None)
+        if aclose_checkpointer is not None:
+            await aclose_checkpointer()
+
+
+_runtime: Optional[AgentRuntime] = None
+_runtime_lock = asyncio.Lock()
+
+
+async def get_agent_runtime(build_agent: Optional[Callable[[], Awaitable[Tuple[Any, Any, Dict[str, Any]]]]] = None,
+                            session_manager_factory: Optional[Callable[..., Any]] = None) -> AgentRuntime:
+    """
+    获取进程级共享的 Agent 运行时，首次调用时构建
+
+    build_agent 和 session_manager_factory 只在首次构建时使用，未传入时使用 main 中的
+    build_agent 和 SimpleSessionManager
+    """
+    global _runtime
+    if _runtime is not None:
+        return _runtime
+
+    async with _runtime_lock:
+        if _runtime is None:
+            from startup_profiler import print_startup_profile
+
+            if build_agent is None or session_manager_factory is None:
+                import main
+                build_agent = build_agent or main.build_agent
+                session_manager_factory = session_manager_factory or main.SimpleSessionManager
+
+            start = time.perf_counter()
+            app, registry, persistence_config = await build_agent()
+            build_seconds = time.perf_counter() - start
+            _runtime = AgentRuntime(app, registry, persistence_config, build_seconds, session_manager_factory)
+            await _runtime.session_index.load(_runtime.checkpointer, _runtime.thread_catalog)
+            _runtime.start_background_jobs()
+            print(f"✅ 共享 Agent 运行时已就绪，构建耗时 {build_seconds:.2f}s")
+            print_startup_profile()
+
+    return _runtime
+
+
+async def shutdown_agent_runtime():
+    """关闭共享运行时（进程退出时调用）"""
+    global _runtime
+    async with _runtime_lock:
+        if _runtime is not None:
+            await _runtime.aclose()
+            _runtime = None
@@ -4,6 +4,7 @@ Chainlit Web 前端集成 - 符合官方最佳实践，支持历史会话恢复
 """
 
 import os
+import time
 import asyncio
 import logging
 from typing import Optional, Dict, Any, List
@@ -107,8 +108,7 @@ async def update_thread_name_if_needed(session_id: str, message_content: str, cu
         # 获取数据层实例
         data_layer = cl.user_session.get("data_layer")
         if not data_layer:
-            from sqlite_data_layer import SQLiteDataLayer
-            data_layer = SQLiteDataLayer()
+            data_layer = get_data_layer()
             cl.user_session.set("data_layer", data_layer)
 
         # 获取当前线程信息
@@ -142,24 +142,51 @@ os.environ["LANGCHAIN_API_KEY"] = ""
 os.environ["LANGCHAIN_PROJECT"] = ""
 os.environ["LANGSMITH_TRACING"] = "false"
 
-import chainlit as cl
-from langchain_core.messages import HumanMessage, AIMessage
-from chainlit.types import ThreadDict
+# 启动耗时分析：python chainlit_app.py --profile-startup 或 AGENT_PROFILE_STARTUP=1 chainlit run chainlit_app.py
+from startup_profiler import enable_startup_profiling, profile_phase
 
-# 导入主程序的初始化函数
-from main import initialize_agent
+enable_startup_profiling()
 
-# 配置 Chainlit 数据层（用于历史会话显示）
-from sqlite_data_layer import SQLiteDataLayer
-import asyncio
+with profile_phase("imports (chainlit_app)"):
+    import chainlit as cl
+    from langchain_core.messages import HumanMessage, AIMessage
+    from chainlit.types import ThreadDict
+
+    # 进程级共享的 Agent 运行时（所有会话共用同一个编译图、工具列表和检查点存储器）
+    # main 及其依赖在首个会话构建运行时时才导入
+    from agent_runtime import get_agent_runtime, shutdown_agent_runtime
+    from message_history import message_count
+
+    # 配置 Chainlit 数据层（用于历史会话显示）
+    from sqlite_connection_pool import close_all_connection_pools
+    from sqlite_data_layer import SQLiteDataLayer
+    import asyncio
 
 # 数据库初始化现在由 SQLiteDataLayer 处理
 
+_data_layer: Optional[SQLiteDataLayer] = None
+
+
 @cl.data_layer
-def get_data_layer():
-    """配置 Chainlit 数据层以支持历史会话显示"""
-    # 使用自定义的 SQLite 数据层，解决数组类型兼容性问题
-    return SQLiteDataLayer(db_path="./data/chainlit_history.db")
+def get_data_layer() -> SQLiteDataLayer:
+    """配置 Chainlit 数据层以支持历史会话显示（进程内只创建一个，会话中的回退也使用这个实例）"""
+    global _data_layer
+    if _data_layer is None:
+        # 使用自定义的 SQLite 数据层，解决数组类型兼容性问题；按 session_management 限制每个用户的线程数
+        try:
+            with open("config/persistence_config.json", "r", encoding="utf-8") as f:
+                persistence_config = json.load(f)
+        except FileNotFoundError:
+            persistence_config = {}
+        _data_layer = SQLiteDataLayer.from_config(persistence_config)
+    return _data_layer
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    """进程退出时释放共享运行时资源"""
+    await shutdown_agent_runtime()
+    close_all_connection_pools()
+
 
 # 配置简单的密码身份验证
 @cl.password_auth_callback
@@ -215,8 +242,7 @@ async def on_chat_start():
             data_layer = cl.user_session.get("data_layer")
             if not data_layer:
                 # 如果没有数据层实例，创建一个新的
-                from sqlite_data_layer import SQLiteDataLayer
-                data_layer = SQLiteDataLayer()
+                data_layer = get_data_layer()
                 cl.user_session.set("data_layer", data_layer)
 
             # 创建线程记录
@@ -225,13 +251,18 @@ async def on_chat_start():
 
         # 数据库初始化由 SQLiteDataLayer 自动处理
 
-        # 初始化 Agent
-        app, tools, session_manager = await initialize_agent()
+        # 获取共享 Agent 运行时（仅进程内首次会话需要构建）
+        start = time.perf_counter()
+        runtime = await get_agent_runtime()
+        session_manager = runtime.new_session_manager()
 
         # 将 Agent 相关对象存储到用户会话中
-        cl.user_session.set("app", app)
-        cl.user_session.set("tools", tools)
+        cl.user_session.set("app", runtime.app)
+        cl.user_session.set("tools", runtime.tools)
         cl.user_session.set("session_manager", session_manager)
+        cl.user_session.set("thread_id", session_id)
+        logger.info(f"⏱️ 会话启动耗时 {(time.perf_counter() - start) * 1000:.1f} ms "
+                    f"(共享运行时首次构建 {runtime.build_seconds:.2f}s)")
 
         # 发送欢迎消息
         await cl.Message(
@@ -261,20 +292,34 @@ async def on_chat_resume(thread: ThreadDict):
         if not current_user:
             logger.warning(f"⚠️ 恢复会话时未找到用户信息！会话ID: {session_id}")
 
-        # 重新初始化 Agent
-        app, tools, session_manager = await initialize_agent()
+        # 复用共享 Agent 运行时
+        start = time.perf_counter()
+        runtime = await get_agent_runtime()
+        app = runtime.app
+        session_manager = runtime.new_session_manager()
 
         # 将 Agent 相关对象存储到用户会话中
         cl.user_session.set("app", app)
-        cl.user_session.set("tools", tools)
+        cl.user_session.set("tools", runtime.tools)
         cl.user_session.set("session_manager", session_manager)
+        # 恢复后的消息继续写入原线程的检查点和步骤，而不是本次连接的 session id
+        cl.user_session.set("thread_id", thread_id)
+        logger.info(f"⏱️ 会话恢复耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        # 检查点是对话上下文的唯一来源：线程已有检查点时图会从中读取历史，不再从步骤重建，
+        # 否则 add_messages 会把重建的消息追加到已有历史后面，每次恢复都复制一遍整个对话
+        user_id = current_user.identifier if current_user else None
+        existing = await message_count(runtime.checkpointer, session_manager.get_session_config(thread_id, user_id))
+        if existing is not None:
+            cl.user_session.set("restored_state", None)
+            logger.info(f"📜 线程 {thread_id} 已有检查点（{existing} 条消息），跳过从步骤重建上下文")
+            return
 
         # 获取完整的线程信息（包含历史消息）
         data_layer = cl.user_session.get("data_layer")
         if not data_layer:
             # 如果没有数据层，创建一个新的
-            from sqlite_data_layer import SQLiteDataLayer
-            data_layer = SQLiteDataLayer()
+            data_layer = get_data_layer()
             cl.user_session.set("data_layer", data_layer)
 
         # 获取完整的线程数据（包含步骤）
@@ -288,7 +333,7 @@ async def on_chat_resume(thread: ThreadDict):
         steps = full_thread.get("steps", [])
         logger.info(f"📜 找到 {len(steps)} 条历史消息")
 
-        # 恢复LangGraph的对话状态以保持上下文记忆
+        # 没有检查点（如检查点已被清理）时从步骤重建上下文，下一条消息时写入检查点
         await restore_langgraph_context(app, thread_id, steps)
 
         # Chainlit会自动从数据库加载历史消息，我们不需要手动重新发送
@@ -333,9 +378,10 @@ async def on_message(message: cl.Message):
         ).send()
         return
     
-    # 使用 Chainlit session id 作为 thread_id，确保多用户隔离
-    thread_id = cl.context.session.id
-    config = {"configurable": {"thread_id": thread_id}}
+    # 新会话使用 Chainlit session id 作为 thread_id，恢复的会话使用原线程 ID，确保多用户隔离；
+    # user_id 用于长期记忆的命名空间
+    thread_id = cl.user_session.get("thread_id") or session_id
+    config = session_manager.get_session_config(thread_id, current_user.identifier)
     
     # 创建 Chainlit 回调处理器
     cb = cl.LangchainCallbackHandler()
@@ -347,8 +393,7 @@ async def on_message(message: cl.Message):
         # 获取数据层实例
         data_layer = cl.user_session.get("data_layer")
         if not data_layer:
-            from sqlite_data_layer import SQLiteDataLayer
-            data_layer = SQLiteDataLayer()
+            data_layer = get_data_layer()
             cl.user_session.set("data_layer", data_layer)
 
         # 手动保存用户消息到数据库
@@ -360,7 +405,7 @@ async def on_message(message: cl.Message):
             "id": user_step_id,
             "name": current_user.identifier,
             "type": "user_message",
-            "threadId": session_id,
+            "threadId": thread_id,
             "output": message.content,
             "createdAt": datetime.now(timezone.utc).isoformat(),
             "metadata": {},
@@ -417,7 +462,7 @@ async def on_message(message: cl.Message):
                 "id": ai_step_id,
                 "name": "LangGraph Agent",
                 "type": "assistant_message",
-                "threadId": session_id,
+                "threadId": thread_id,
                 "output": ai_response_content,
                 "createdAt": datetime.now(timezone.utc).isoformat(),
                 "metadata": {},
@@ -427,7 +472,7 @@ async def on_message(message: cl.Message):
             logger.info(f"💾 AI回复已保存: {ai_response_content[:50]}...")
 
         # 检查是否需要更新线程名称（仅在第一条消息后）
-        await update_thread_name_if_needed(session_id, message.content, current_user)
+        await update_thread_name_if_needed(thread_id, message.content, current_user)
 
     except Exception as e:
         await cl.Message(
@@ -0,0 +1,88 @@
+# chainlit_schema.py
+"""
+Chainlit 历史数据库的版本化迁移
+
+SQLiteDataLayer 建表时只执行 CREATE TABLE IF NOT EXISTS（以及线程配额的列和触发器），
+之后的结构变更按版本号追加到 SCHEMA_MIGRATIONS，已应用的版本记录在 PRAGMA user_version 中。
+apply_migrations 在一个 BEGIN IMMEDIATE 事务里执行全部未应用的迁移并更新版本号，
+已有数据库在原地升级，多个进程同时启动时只有一个会执行迁移。
+
+数据层初始化和过期会话清理任务（session_reaper）都调用 apply_migrations，
+后者在只运行 CLI、未创建数据层时也能得到所需的索引。
+本模块不依赖 chainlit，可以在任何进程中导入。
+"""
+
+import sqlite3
+from typing import Callable, List, Sequence, Tuple, Union
+
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+def _add_thread_activity_columns(conn: sqlite3.Connection):
+    """线程配额和列表索引使用的 lastActiveAt、archived 列（早期数据库没有，补齐并回填最后活动时间）"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(threads)")}
+    if "lastActiveAt" not in columns:
+        conn.execute("ALTER TABLE threads ADD COLUMN lastActiveAt TEXT")
+        conn.execute("""
+            UPDATE threads SET lastActiveAt = COALESCE(
+                (SELECT MAX(createdAt) FROM steps WHERE steps.threadId = threads.id), createdAt)
+        """)
+    if "archived" not in columns:
+        conn.execute("ALTER TABLE threads ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+
+
+# (版本, 说明, 步骤)，步骤为 SQL 语句或接收连接的函数；只能追加新版本，不要修改已发布的迁移
+SCHEMA_MIGRATIONS: Sequence[Tuple[int, str, Sequence[MigrationStep]]] = (
+    (1, "线程最后活动时间和归档列；按线程读取和删除 steps、elements、feedbacks，按用户分页列出线程", (
+        _add_thread_activity_columns,
+        # get_thread / get_steps 按 createdAt 排序读取步骤，索引顺序即结果顺序
+        "CREATE INDEX IF NOT EXISTS idx_steps_thread ON steps (threadId, createdAt)",
+        "CREATE INDEX IF NOT EXISTS idx_elements_thread ON elements (threadId)",
+        "CREATE INDEX IF NOT EXISTS idx_feedbacks_thread ON feedbacks (threadId)",
+        # list_threads 只列出未归档的线程，按 createdAt 倒序
+        "CREATE INDEX IF NOT EXISTS idx_threads_user_created ON threads (userId, archived, createdAt)",
+    )),
+    (2, "list_threads 按 (createdAt, id) 键集分页", (
+        # 键集比较遇到 NULL 会漏掉线程，没有创建时间的线程取第一个步骤的时间
+        """
+        UPDATE threads SET createdAt = COALESCE(
+            (SELECT MIN(createdAt) FROM steps WHERE steps.threadId = threads.id), '')
+        WHERE createdAt IS NULL
+        """,
+        # 索引包含 id，ORDER BY createdAt DESC, id DESC 和游标比较都在索引上完成
+        "DROP INDEX IF EXISTS idx_threads_user_created",
+        "CREATE INDEX IF NOT EXISTS idx_threads_user_page ON threads (userId, archived, createdAt, id)",
+    )),
+)
+
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection) -> List[int]:
+    """应用数据库尚未执行的迁移，返回本次应用的版本号（调用时连接上不能有未提交的事务）"""
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 取得写锁后重新读取版本，其他进程可能刚刚完成迁移
+        current = schema_version(conn)
+        applied = []
+        for version, _, steps in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            applied.append(version)
+        conn.commit()
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,194 @@
+# checkpoint_retention.py
+"""
+检查点保留策略
+
+AsyncSqliteSaver 每个 superstep 都会写入一个新检查点及其 writes 行，旧版本从不清理。
+保留任务只保留每个 (thread_id, checkpoint_ns) 最新的 K 个检查点，删除更早的检查点
+以及挂在它们上面的 writes 行。
+
+删除按小批次进行，每批单独持有检查点存储器的锁并提交，批次之间让出事件循环，
+因此不会长时间阻塞正在进行的对话。分片存储器的每个分片依次清理。
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# 默认参数，可在 persistence_config.json 的 checkpoint_retention 中覆盖
+DEFAULT_KEEP_LAST = 20
+DEFAULT_INTERVAL_MINUTES = 60
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_PAUSE_SECONDS = 0.05
+
+# 每张表中单行的负载大小，用于统计回收的字节数
+_PAYLOAD_SIZE = {
+    "checkpoints": "LENGTH(checkpoint) + COALESCE(LENGTH(metadata), 0)",
+    "writes": "COALESCE(LENGTH(value), 0)",
+}
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class CheckpointRetention:
+    """按线程保留最新 K 个检查点的后台清理任务"""
+
+    def __init__(self, checkpointer, keep_last: int = DEFAULT_KEEP_LAST,
+                 interval_minutes: float = DEFAULT_INTERVAL_MINUTES,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_pause_seconds: float = DEFAULT_BATCH_PAUSE_SECONDS,
+                 database_path: Optional[str] = None):
+        # 写回缓存只负责最近的检查点，清理直接作用于底层存储器
+        checkpointer = getattr(checkpointer, "inner", checkpointer)
+        self.checkpointer = checkpointer
+        self.savers = list(getattr(checkpointer, "shards", None) or [checkpointer])
+        self.keep_last = max(int(keep_last), 1)
+        self.interval_seconds = float(interval_minutes) * 60
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_pause_seconds = float(batch_pause_seconds)
+        self.database_path = database_path
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, checkpointer, persistence_config: Dict[str, Any]) -> Optional["CheckpointRetention"]:
+        """根据持久化配置创建保留任务；未启用或存储器不是 SQLite 时返回 None"""
+        options = persistence_config.get("checkpoint_retention", {})
+        if not options.get("enabled", False):
+            return None
+        checkpointer = getattr(checkpointer, "inner", checkpointer)
+        savers = getattr(checkpointer, "shards", None) or [checkpointer]
+        if any(getattr(s, "conn", None) is None or getattr(s, "lock", None) is None for s in savers):
+            print(f"⚠️ 检查点保留策略仅支持 SQLite 存储器，当前为 {type(checkpointer).__name__}")
+            return None
+        sqlite_config = persistence_config.get("persistence", {}).get("config", {}).get("sqlite", {})
+        return cls(
+            checkpointer,
+            keep_last=options.get("keep_last", DEFAULT_KEEP_LAST),
+            interval_minutes=options.get("interval_minutes", DEFAULT_INTERVAL_MINUTES),
+            batch_size=options.get("batch_size", DEFAULT_BATCH_SIZE),
+            batch_pause_seconds=options.get("batch_pause_seconds", DEFAULT_BATCH_PAUSE_SECONDS),
+            database_path=sqlite_config.get("database_path"),
+        )
+
+    async def _stale_threads(self, saver) -> List[Tuple[str, str, str]]:
+        """找出检查点数超过 K 的线程，返回 (thread_id, checkpoint_ns, 最旧的保留检查点)"""
+        conn = saver.conn
+        async with saver.lock:
+            async with conn.execute(
+                "SELECT thread_id, checkpoint_ns FROM checkpoints "
+                "GROUP BY thread_id, checkpoint_ns HAVING COUNT(*) > ?",
+                (self.keep_last,),
+            ) as cur:
+                threads = await cur.fetchall()
+
+            stale = []
+            for thread_id, checkpoint_ns in threads:
+                # checkpoint_id 是 uuid6，按字符串排序即按时间排序
+                async with conn.execute(
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+                    (thread_id, checkpoint_ns, self.keep_last - 1),
+                ) as cur:
+                    row = await cur.fetchone()
+                if row is not None:
+                    stale.append((thread_id, checkpoint_ns, row[0]))
+        return stale
+
+    async def _delete_batch(self, saver, table: str, thread_id: str, checkpoint_ns: str,
+                            cutoff: str) -> Tuple[int, int]:
+        """删除一批早于 cutoff 的行，返回 (行数, 负载字节数)"""
+        conn = saver.conn
+        async with saver.lock:
+            async with conn.execute(
+                f"SELECT rowid, {_PAYLOAD_SIZE[table]} FROM {table} "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ? LIMIT ?",
+                (thread_id, checkpoint_ns, cutoff, self.batch_size),
+            ) as cur:
+                rows = await cur.fetchall()
+            if not rows:
+                return 0, 0
+            placeholders = ",".join("?" * len(rows))
+            await conn.execute(f"DELETE FROM {table} WHERE rowid IN ({placeholders})", [r[0] for r in rows])
+            await conn.commit()
+        return len(rows), sum(r[1] or 0 for r in rows)
+
+    async def _prune_table(self, saver, table: str, thread_id: str, checkpoint_ns: str, cutoff: str,
+                           report: Dict[str, Any]):
+        while True:
+            deleted, payload = await self._delete_batch(saver, table, thread_id, checkpoint_ns, cutoff)
+            report[f"{table}_deleted"] += deleted
+            report["bytes_reclaimed"] += payload
+            if deleted < self.batch_size:
+                return
+            await asyncio.sleep(self.batch_pause_seconds)
+
+    def _disk_usage(self) -> int:
+        paths = [getattr(getattr(s, "manager", None), "db_path", None) for s in self.savers]
+        if not all(paths):
+            paths = [self.database_path] if self.database_path else []
+        return sum(_file_size(path) + _file_size(f"{path}-wal") for path in paths)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """执行一轮清理，返回统计报告"""
+        start = time.perf_counter()
+        disk_before = self._disk_usage()
+        report = {"threads": 0, "checkpoints_deleted": 0, "writes_deleted": 0, "messages_deleted": 0,
+                  "bytes_reclaimed": 0}
+
+        for saver in self.savers:
+            await saver.setup()
+            stale = await self._stale_threads(saver)
+            for thread_id, checkpoint_ns, cutoff in stale:
+                report["threads"] += 1
+                await self._prune_table(saver, "writes", thread_id, checkpoint_ns, cutoff, report)
+                await self._prune_table(saver, "checkpoints", thread_id, checkpoint_ns, cutoff, report)
+                if hasattr(saver, "prune_orphan_messages"):
+                    # 消息去重存储：删除已没有检查点引用的消息
+                    deleted, payload = await saver.prune_orphan_messages(thread_id)
+                    report["messages_deleted"] += deleted
+                    report["bytes_reclaimed"] += payload
+                await asyncio.sleep(self.batch_pause_seconds)
+
+            if stale:
+                # 把 WAL 中的内容写回主库并截断 -wal 文件；释放的页留在空闲列表中供后续写入复用
+                async with saver.lock:
+                    await saver.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        report["disk_bytes_freed"] = max(disk_before - self._disk_usage(), 0)
+        report["seconds"] = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+    @staticmethod
+    def print_report(report: Dict[str, Any]):
+        print(f"🧹 检查点保留: 清理 {report['threads']} 个线程, 删除检查点 {report['checkpoints_deleted']} 个, "
+              f"writes {report['writes_deleted']} 行, 消息 {report.get('messages_deleted', 0)} 条, 回收 {report['bytes_reclaimed'] / 1024:.1f} KB 数据 "
+              f"(磁盘文件减少 {report['disk_bytes_freed'] / 1024:.1f} KB), 耗时 {report['seconds']:.2f}s")
+
+    async def _run_forever(self):
+        while True:
+            try:
+                report = await self.run_once()
+                if report["threads"]:
+                    self.print_report(report)
+            except Exception as e:
+                print(f"⚠️ 检查点保留任务出错: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """启动后台清理任务"""
+        if self._task is None:
+            print(f"🧹 检查点保留策略已启用: 每个线程保留最新 {self.keep_last} 个检查点")
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def aclose(self):
+        """停止后台清理任务"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,268 @@
+# checkpoint_serde.py
+"""
+紧凑的检查点存储格式
+
+1. CompressedSerializer：在 JsonPlusSerializer 的结果上做 zlib 压缩，压缩后的类型名带 "+zlib" 后缀，
+   未压缩的旧数据照常读取。
+2. CompactSqliteSaver：每条消息按内容哈希在 checkpoint_messages 表中只存一份，
+   检查点的 messages 通道只保存消息哈希列表，读取时还原为完整的消息列表。
+
+一个 200 轮的会话原本在每个检查点里重复保存全部早期消息，改为引用后每个检查点只多出几 KB 的哈希。
+已有数据库可以用 scripts/migrate_checkpoint_format.py 转换（或转换回原格式）。
+"""
+
+import hashlib
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from message_history import page_bounds
+from sqlite_checkpointer import TunedAsyncSqliteSaver
+
+COMPRESSED_SUFFIX = "+zlib"
+DEFAULT_COMPRESSION_LEVEL = 6
+DEFAULT_MIN_COMPRESS_BYTES = 512
+
+# 检查点中代替消息列表的引用标记
+MESSAGE_REFS_KEY = "__message_refs__"
+MESSAGES_CHANNEL = "messages"
+
+MESSAGES_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS checkpoint_messages (
+    thread_id TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, hash)
+)
+"""
+
+MESSAGES_INSERT = "INSERT OR IGNORE INTO checkpoint_messages (thread_id, hash, type, value) VALUES (?, ?, ?, ?)"
+
+# 记录最近写入过的消息哈希，避免每个检查点都对全部消息重复执行 INSERT
+KNOWN_MESSAGES_CACHE_SIZE = 50000
+
+# 需要的消息不超过这个数量时按哈希逐条查询（如分页读取历史），否则按线程读取全部消息
+HASH_LOOKUP_MAX_MESSAGES = 200
+
+
+class CompressedSerializer(JsonPlusSerializer):
+    """对较大的序列化结果做 zlib 压缩的序列化器，兼容未压缩的旧数据"""
+
+    def __init__(self, level: int = DEFAULT_COMPRESSION_LEVEL,
+                 min_size: int = DEFAULT_MIN_COMPRESS_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.level = level
+        self.min_size = min_size
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        return self.compress_typed(*super().dumps_typed(obj))
+
+    def compress_typed(self, type_: str, data: bytes) -> Tuple[str, bytes]:
+        """压缩已序列化的数据，压缩没有收益时原样返回"""
+        if len(data) >= self.min_size:
+            compressed = zlib.compress(data, self.level)
+            if len(compressed) < len(data):
+                return f"{type_}{COMPRESSED_SUFFIX}", compressed
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(COMPRESSED_SUFFIX):
+            return super().loads_typed((type_[:-len(COMPRESSED_SUFFIX)], zlib.decompress(payload)))
+        return super().loads_typed(data)
+
+
+def compact_saver_options(serialization_config: Dict[str, Any]) -> Dict[str, Any]:
+    """把 persistence_config.json 中的 serialization 配置转换为 CompactSqliteSaver 的参数"""
+    return {
+        "compression": serialization_config.get("compression", "zlib"),
+        "compression_level": int(serialization_config.get("compression_level", DEFAULT_COMPRESSION_LEVEL)),
+        "min_compress_bytes": int(serialization_config.get("min_compress_bytes", DEFAULT_MIN_COMPRESS_BYTES)),
+        "deduplicate_messages": bool(serialization_config.get("deduplicate_messages", True)),
+    }
+
+
+def message_refs(checkpoint: Dict[str, Any]) -> Optional[List[str]]:
+    """检查点中的消息引用列表，未去重的检查点返回 None"""
+    value = checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL)
+    if isinstance(value, dict) and MESSAGE_REFS_KEY in value:
+        return value[MESSAGE_REFS_KEY]
+    return None
+
+
+class CompactSqliteSaver(TunedAsyncSqliteSaver):
+    """压缩检查点并对消息去重的 SQLite 检查点存储器"""
+
+    def __init__(self, conn, manager, compression: str = "zlib",
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                 min_compress_bytes: int = DEFAULT_MIN_COMPRESS_BYTES,
+                 deduplicate_messages: bool = True, **kwargs):
+        # 不压缩时仍使用 CompressedSerializer 读取，以便兼容已压缩的数据
+        level = compression_level if compression == "zlib" else 0
+        min_size = min_compress_bytes if compression == "zlib" else float("inf")
+        super().__init__(conn, manager, serde=CompressedSerializer(level, min_size), **kwargs)
+        self.deduplicate_messages = deduplicate_messages
+        self._messages_table_ready = False
+        self._known_messages: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._batch_messages: Optional[set] = None
+
+    async def setup(self) -> None:
+        await super().setup()
+        if self._messages_table_ready:
+            return
+        async with self.lock:
+            await self.conn.execute(MESSAGES_TABLE_DDL)
+            await self.conn.commit()
+        self._messages_table_ready = True
+
+    def _remember(self, key: Tuple[str, str]):
+        self._known_messages[key] = None
+        self._known_messages.move_to_end(key)
+        while len(self._known_messages) > KNOWN_MESSAGES_CACHE_SIZE:
+            self._known_messages.popitem(last=False)
+
+    def split_messages(self, thread_id: str, checkpoint: Dict[str, Any], queued: Optional[set] = None):
+        """
+        把消息列表替换为哈希引用，返回 (新检查点, 需要写入的消息行)
+
+        queued 为同一批中已生成过的消息，这些消息不再重复生成行，新生成的行会加入其中。
+        """
+        messages = checkpoint.get("channel_values", {}).get(MESSAGES_CHANNEL)
+        if not isinstance(messages, list):
+            return checkpoint, []
+
+        refs, rows = [], []
+        for message in messages:
+            # 按未压缩的序列化结果计算哈希，只有新消息才需要压缩
+            type_, value = JsonPlusSerializer.dumps_typed(self.serde, message)
+            digest = hashlib.sha256(type_.encode("utf-8") + b"\0" + value).hexdigest()[:32]
+            refs.append(digest)
+            key = (thread_id, digest)
+            if key in self._known_messages or (queued is not None and key in queued):
+                continue
+            if queued is not None:
+                queued.add(key)
+            rows.append((thread_id, digest, *self.serde.compress_typed(type_, value)))
+
+        compact = {**checkpoint, "channel_values": {**checkpoint["channel_values"],
+                                                   MESSAGES_CHANNEL: {MESSAGE_REFS_KEY: refs}}}
+        return compact, rows
+
+    async def _store_messages(self, rows: List[Tuple[str, str, str, bytes]]):
+        async with self.lock:
+            await self.conn.executemany(MESSAGES_INSERT, rows)
+            await self.conn.commit()
+        for thread_id, digest, _, _ in rows:
+            self._remember((thread_id, digest))
+
+    def _checkpoint_statements(self, config, checkpoint, metadata):
+        # 会话目录仍按完整的检查点统计消息数和标题，只有检查点行改为消息引用
+        if not self.deduplicate_messages:
+            return super()._checkpoint_statements(config, checkpoint, metadata)
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint, rows = self.split_messages(thread_id, checkpoint, self._batch_messages)
+        return [(MESSAGES_INSERT, rows)] + super()._checkpoint_statements(config, checkpoint, metadata)
+
+    def _batch_statements(self, operations):
+        # 同一批中相邻的检查点共享大部分消息，每条新消息只生成一行
+        self._batch_messages = set()
+        try:
+            return super()._batch_statements(operations)
+        finally:
+            self._batch_messages = None
+
+    async def aput_batch(self, operations):
+        statements = await super().aput_batch(operations)
+        # 提交成功后才记录已写入的消息
+        for query, rows in statements:
+            if query == MESSAGES_INSERT:
+                for thread_id, digest, _, _ in rows:
+                    self._remember((thread_id, digest))
+        return statements
+
+    async def load_messages(self, thread_id: str, refs: List[str]) -> List[Any]:
+        """按哈希读取消息，保持引用顺序"""
+        await self.setup()
+        found: Dict[str, Any] = {}
+        unique = list(dict.fromkeys(refs))
+        if not unique:
+            return []
+        async with self.lock:
+            if len(unique) <= HASH_LOOKUP_MAX_MESSAGES:
+                # 只读取引用到的消息，使用 (thread_id, hash) 主键
+                placeholders = ", ".join("?" * len(unique))
+                query = f"SELECT hash, type, value FROM checkpoint_messages WHERE thread_id = ? AND hash IN ({placeholders})"
+                params = (thread_id, *unique)
+            else:
+                # 最新检查点通常引用线程中的几乎全部消息，直接按线程读取比逐个查询更快
+                query = "SELECT hash, type, value FROM checkpoint_messages WHERE thread_id = ?"
+                params = (thread_id,)
+            async with self.conn.execute(query, params) as cur:
+                async for digest, type_, value in cur:
+                    found[digest] = (type_, value)
+        missing = [ref for ref in unique if ref not in found]
+        if missing:
+            raise ValueError(f"线程 {thread_id} 的检查点引用了 {len(missing)} 条不存在的消息")
+        return [self.serde.loads_typed(found[ref]) for ref in refs]
+
+    async def _message_page(self, thread_id, messages, limit, offset):
+        # 去重的检查点只保存消息哈希，只还原这一页引用的消息
+        if not (isinstance(messages, dict) and MESSAGE_REFS_KEY in messages):
+            return await super()._message_page(thread_id, messages, limit, offset)
+        refs = messages[MESSAGE_REFS_KEY]
+        start, end = page_bounds(len(refs), limit, offset)
+        return await self.load_messages(thread_id, refs[start:end]), len(refs)
+
+    async def _resolve(self, checkpoint_tuple):
+        if checkpoint_tuple is None:
+            return None
+        refs = message_refs(checkpoint_tuple.checkpoint)
+        if refs is not None:
+            thread_id = checkpoint_tuple.config["configurable"]["thread_id"]
+            checkpoint_tuple.checkpoint["channel_values"][MESSAGES_CHANNEL] = await self.load_messages(thread_id, refs)
+        return checkpoint_tuple
+
+    async def aget_tuple(self, config):
+        return await self._resolve(await super().aget_tuple(config))
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        # 父类在迭代期间持有锁，先取出全部结果再还原消息
+        items = [item async for item in super().alist(config, filter=filter, before=before, limit=limit)]
+        for item in items:
+            yield await self._resolve(item)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        await self.setup()
+        async with self.lock:
+            await self.conn.execute("DELETE FROM checkpoint_messages WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+        self._known_messages = OrderedDict((k, None) for k in self._known_messages if k[0] != str(thread_id))
+
+    async def prune_orphan_messages(self, thread_id: str) -> Tuple[int, int]:
+        """删除线程中已没有检查点引用的消息，返回 (行数, 负载字节数)"""
+        await self.setup()
+        async with self.lock:
+            async with self.conn.execute(
+                "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ?", (thread_id,)
+            ) as cur:
+                rows = await cur.fetchall()
+            referenced = set()
+            for type_, blob in rows:
+                referenced.update(message_refs(self.serde.loads_typed((type_, blob))) or [])
+            async with self.conn.execute(
+                "SELECT hash, LENGTH(value) FROM checkpoint_messages WHERE thread_id = ?", (thread_id,)
+            ) as cur:
+                orphans = [(digest, size or 0) for digest, size in await cur.fetchall() if digest not in referenced]
+            if orphans:
+                await self.conn.executemany(
+                    "DELETE FROM checkpoint_messages WHERE thread_id = ? AND hash = ?",
+                    [(thread_id, digest) for digest, _ in orphans],
+                )
+                await self.conn.commit()
+        for digest, _ in orphans:
+            self._known_messages.pop((thread_id, digest), None)
+        return len(orphans), sum(size for _, size in orphans)
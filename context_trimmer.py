@@ -0,0 +1,71 @@
+# context_trimmer.py
+"""
+模型调用前的上下文裁剪
+
+检查点中保存完整的对话历史，但每次调用模型时只发送最近的一段：
+先按消息条数上限（persistence_config.json 的 max_messages_per_session）裁剪，
+再按提供商的 token 预算（llm_config.json 的 max_context_tokens）裁剪。
+
+裁剪后的窗口总是从一条 HumanMessage 开始，因此不会出现 ToolMessage
+与发起调用的 AIMessage 被拆开的情况。
+"""
+
+from typing import List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
+
+
+def _from_last_human(messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+    """保留最后一条 HumanMessage 及之后的消息（当前回合无论多长都必须完整发送）"""
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            system = [m for m in messages[:1] if isinstance(m, SystemMessage)]
+            return system + list(messages[index:])
+    return list(messages)
+
+
+class ContextTrimmer:
+    """按消息条数和 token 预算裁剪发送给模型的消息"""
+
+    def __init__(self, max_tokens: Optional[int] = None, max_messages: Optional[int] = None):
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self.metrics = {"calls": 0, "trimmed_calls": 0, "dropped_messages": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_tokens or self.max_messages)
+
+    def _trim(self, messages: List[BaseMessage], max_tokens: int, token_counter) -> List[BaseMessage]:
+        trimmed = trim_messages(
+            messages,
+            max_tokens=max_tokens,
+            token_counter=token_counter,
+            strategy="last",
+            start_on="human",
+            include_system=True,
+            allow_partial=False,
+        )
+        # 最近一个回合本身就超出限制时，退回到只保留当前回合
+        if not any(isinstance(m, HumanMessage) for m in trimmed):
+            return _from_last_human(messages)
+        return trimmed
+
+    def __call__(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        messages = list(messages)
+        self.metrics["calls"] += 1
+        if not self.enabled:
+            return messages
+
+        trimmed = messages
+        if self.max_messages and len(trimmed) > self.max_messages:
+            trimmed = self._trim(trimmed, self.max_messages, len)
+        if self.max_tokens:
+            trimmed = self._trim(trimmed, self.max_tokens, count_tokens_approximately)
+
+        dropped = len(messages) - len(trimmed)
+        if dropped > 0:
+            self.metrics["trimmed_calls"] += 1
+            self.metrics["dropped_messages"] += dropped
+        return trimmed
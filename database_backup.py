@@ -0,0 +1,301 @@
+# database_backup.py
+"""
+数据库在线备份
+
+按 persistence_config.json 的 backup_settings 定期备份 agent_memory.db、chainlit_history.db 等数据库。
+备份使用 SQLite 在线备份 API，在线程中运行，每一步只复制 pages_per_step 页，步与步之间休眠，
+应用可以在备份期间照常读写：
+
+- WAL 数据库：备份连接先开启读事务固定快照，写入者不受影响，备份也不会因为新写入而重新开始；
+- 回滚日志数据库：每一步只短暂持有共享锁，步间释放，写入者只需等待一步；
+  期间有其他连接写入时 SQLite 会从头重新备份，重启超过 max_restarts 次后改为持有快照一次复制完成。
+
+备份本身不获取写锁。写入者受到的影响从本进程已有的写入路径统计：备份前后各读取一次
+检查点连接管理器（锁等待、忙重试）和 Chainlit 连接池（写连接等待）的计数，差值和备份耗时一起输出；
+回滚日志模式下写入者最多等待一步，最长一步的耗时（max_step_seconds）即等待上限。
+每个数据库只保留最新的 max_backup_files 个备份文件。
+"""
+
+import asyncio
+import glob
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+DEFAULT_BACKUP_INTERVAL_HOURS = 24
+DEFAULT_BACKUP_LOCATION = "./backups/"
+DEFAULT_MAX_BACKUP_FILES = 7
+DEFAULT_PAGES_PER_STEP = 64
+DEFAULT_STEP_SLEEP_SECONDS = 0.005
+DEFAULT_MAX_RESTARTS = 3
+
+DEFAULT_CHAINLIT_DATABASE = "./data/chainlit_history.db"
+
+# 与 scripts/clear_history_data.py 的备份文件名一致: <数据库文件名>.backup_<时间戳>
+BACKUP_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+
+
+class _BackupRestarted(Exception):
+    """备份期间源数据库被其他连接修改的次数超过上限"""
+
+
+def journal_mode(path: str) -> str:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA journal_mode").fetchone()[0].lower()
+    finally:
+        conn.close()
+
+
+class WriterWaitStats:
+    """备份期间本进程写入者的等待：备份前后各取一次写入路径已有的累计计数，返回差值"""
+
+    KEYS = ("lock_waits", "lock_wait_seconds", "busy_retries", "busy_failures")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._start = self._snapshot()
+
+    def _snapshot(self) -> Dict[str, float]:
+        from sqlite_checkpointer import find_connection_manager
+        from sqlite_connection_pool import find_connection_pool
+
+        totals = dict.fromkeys(self.KEYS, 0)
+        manager = find_connection_manager(self.path)
+        if manager is not None:
+            for key in self.KEYS:
+                totals[key] += manager.metrics[key]
+        pool = find_connection_pool(self.path)
+        if pool is not None:
+            totals["lock_waits"] += pool.metrics["write_waits"]
+            totals["lock_wait_seconds"] += pool.metrics["write_wait_seconds"]
+        return totals
+
+    def stop(self) -> Dict[str, Any]:
+        end = self._snapshot()
+        return {f"writer_{key}": end[key] - self._start[key] for key in self.KEYS}
+
+
+def backup_database(path: str, destination: str, pages_per_step: int = DEFAULT_PAGES_PER_STEP,
+                    step_sleep_seconds: float = DEFAULT_STEP_SLEEP_SECONDS,
+                    max_restarts: int = DEFAULT_MAX_RESTARTS) -> Dict[str, Any]:
+    """
+    把 path 在线备份到 destination（同步函数，在线程中调用）
+
+    先写入 destination.partial，校验通过后再改名，中途失败不会留下不完整的备份文件。
+    """
+    wal = journal_mode(path) == "wal"
+    partial = f"{destination}.partial"
+    stats = {"steps": 0, "restarts": 0, "pages": 0, "max_step_seconds": 0.0}
+    step_started = [time.perf_counter()]
+    # 回滚日志模式下持有快照会阻塞写入者，此时步间休眠只会延长阻塞
+    pause = [step_sleep_seconds]
+
+    def progress(status, remaining, total):
+        step_seconds = time.perf_counter() - step_started[0]
+        stats["max_step_seconds"] = max(stats["max_step_seconds"], step_seconds)
+        if stats["steps"] and total - remaining <= stats["pages"]:
+            # 已复制的页数没有增加：源数据库被修改，备份从头开始
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _BackupRestarted()
+        stats["steps"] += 1
+        stats["pages"] = total - remaining
+        # 在步与步之间休眠，此时不持有源数据库的锁（WAL 模式下只保留不阻塞写入的读事务）
+        time.sleep(pause[0])
+        step_started[0] = time.perf_counter()
+
+    def copy(snapshot: bool):
+        if os.path.exists(partial):
+            os.remove(partial)
+        source = sqlite3.connect(path, timeout=60, isolation_level=None)
+        target = sqlite3.connect(partial)
+        try:
+            if snapshot:
+                # 开启读事务固定快照，之后的每一步都读同一个版本
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            step_started[0] = time.perf_counter()
+            source.backup(target, pages=pages_per_step, progress=progress)
+            if snapshot:
+                source.execute("COMMIT")
+            # 备份文件独立保存，不依赖 -wal 文件
+            target.execute("PRAGMA journal_mode=DELETE")
+            check = target.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        return check
+
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    start = time.perf_counter()
+    writer_waits = WriterWaitStats(path)
+    snapshot = wal
+    try:
+        try:
+            check = copy(snapshot)
+        except _BackupRestarted:
+            snapshot = True
+            pause[0] = 0
+            stats.update(steps=0, pages=0)
+            check = copy(snapshot)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        writer_report = writer_waits.stop()
+
+    if check != "ok":
+        os.remove(partial)
+        raise sqlite3.DatabaseError(f"备份文件校验失败: {check}")
+    os.replace(partial, destination)
+    return {
+        "database": path,
+        "backup": destination,
+        "bytes": os.path.getsize(destination),
+        "journal_mode": "wal" if wal else "rollback",
+        "snapshot": snapshot,
+        "seconds": time.perf_counter() - start,
+        **stats,
+        **writer_report,
+    }
+
+
+def rotate_backups(directory: str, database_name: str, keep: int) -> List[str]:
+    """删除超出保留数量的旧备份，返回删除的文件"""
+    backups = sorted(glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(database_name)}.backup_*")))
+    backups = [b for b in backups if not b.endswith(".partial")]
+    removed = backups[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def default_backup_databases(persistence_config: Dict[str, Any]) -> List[str]:
+    """需要备份的数据库：检查点数据库（或各分片）、Chainlit 历史数据库、长期记忆数据库"""
+    persistence = persistence_config.get("persistence", {})
+    backend_config = persistence.get("config", {})
+    databases = []
+    if persistence.get("backend", "sqlite") == "sqlite_sharded":
+        from sharded_checkpointer import DEFAULT_SHARD_COUNT, DEFAULT_SHARD_DIRECTORY, DEFAULT_SHARD_FILE_PATTERN, shard_paths
+        sharded = backend_config.get("sqlite_sharded", {})
+        databases.extend(shard_paths(
+            int(sharded.get("shard_count", DEFAULT_SHARD_COUNT)),
+            sharded.get("shard_directory", DEFAULT_SHARD_DIRECTORY),
+            sharded.get("file_pattern", DEFAULT_SHARD_FILE_PATTERN),
+        ))
+    else:
+        databases.append(backend_config.get("sqlite", {}).get("database_path", "./data/agent_memory.db"))
+    databases.append(DEFAULT_CHAINLIT_DATABASE)
+    long_term = persistence_config.get("memory_settings", {}).get("long_term_memory", {})
+    if long_term.get("enabled", False):
+        databases.append(long_term.get("database_path", "./data/long_term_memory.db"))
+    return databases
+
+
+class DatabaseBackup:
+    """按 backup_settings 定期在线备份数据库的后台任务"""
+
+    def __init__(self, databases: List[str], backup_location: str = DEFAULT_BACKUP_LOCATION,
+                 interval_hours: float = DEFAULT_BACKUP_INTERVAL_HOURS,
+                 max_backup_files: int = DEFAULT_MAX_BACKUP_FILES,
+                 pages_per_step: int = DEFAULT_PAGES_PER_STEP,
+                 step_sleep_seconds: float = DEFAULT_STEP_SLEEP_SECONDS,
+                 max_restarts: int = DEFAULT_MAX_RESTARTS):
+        self.databases = list(databases)
+        self.backup_location = backup_location
+        self.interval_seconds = float(interval_hours) * 3600
+        self.max_backup_files = max(int(max_backup_files), 1)
+        self.pages_per_step = max(int(pages_per_step), 1)
+        self.step_sleep_seconds = float(step_sleep_seconds)
+        self.max_restarts = int(max_restarts)
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, persistence_config: Dict[str, Any]) -> Optional["DatabaseBackup"]:
+        """根据 backup_settings 创建备份任务；未启用时返回 None"""
+        options = persistence_config.get("backup_settings", {})
+        if not options.get("enabled", False):
+            return None
+        return cls(
+            options.get("databases") or default_backup_databases(persistence_config),
+            backup_location=options.get("backup_location", DEFAULT_BACKUP_LOCATION),
+            interval_hours=options.get("backup_interval_hours", DEFAULT_BACKUP_INTERVAL_HOURS),
+            max_backup_files=options.get("max_backup_files", DEFAULT_MAX_BACKUP_FILES),
+            pages_per_step=options.get("pages_per_step", DEFAULT_PAGES_PER_STEP),
+            step_sleep_seconds=options.get("step_sleep_seconds", DEFAULT_STEP_SLEEP_SECONDS),
+            max_restarts=options.get("max_restarts", DEFAULT_MAX_RESTARTS),
+        )
+
+    async def run_once(self) -> Dict[str, Any]:
+        """依次备份每个数据库并轮换旧备份，返回统计报告"""
+        start = time.perf_counter()
+        timestamp = datetime.now().strftime(BACKUP_TIMESTAMP_FORMAT)
+        report = {"databases": [], "failed": [], "removed": 0}
+        for path in self.databases:
+            if not os.path.exists(path):
+                continue
+            name = os.path.basename(path)
+            destination = os.path.join(self.backup_location, f"{name}.backup_{timestamp}")
+            try:
+                result = await asyncio.to_thread(
+                    backup_database, path, destination, self.pages_per_step, self.step_sleep_seconds,
+                    self.max_restarts,
+                )
+            except Exception as e:
+                print(f"⚠️ 备份 {path} 失败: {e}")
+                report["failed"].append(path)
+                continue
+            report["databases"].append(result)
+            report["removed"] += len(rotate_backups(self.backup_location, name, self.max_backup_files))
+        report["seconds"] = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+    @staticmethod
+    def print_report(report: Dict[str, Any]):
+        print(f"💾 数据库备份完成: {len(report['databases'])} 个数据库, 删除旧备份 {report['removed']} 个, "
+              f"总耗时 {report['seconds']:.2f}s")
+        for r in report["databases"]:
+            mode = "快照" if r["snapshot"] else "分步"
+            print(f"   {os.path.basename(r['database'])}: {r['bytes'] / 1024:.1f} KB, {r['seconds']:.2f}s "
+                  f"({mode}, {r['steps']} 步, 重启 {r['restarts']} 次), "
+                  f"最长一步 {r['max_step_seconds'] * 1000:.1f} ms, "
+                  f"本进程写入等待 {r['writer_lock_waits']} 次 ({r['writer_lock_wait_seconds'] * 1000:.1f} ms), "
+                  f"忙重试 {r['writer_busy_retries']} 次")
+
+    def _initial_delay(self) -> float:
+        """距离上次备份不足一个间隔时，等到满一个间隔再备份"""
+        newest = 0.0
+        for path in self.databases:
+            pattern = os.path.join(glob.escape(self.backup_location), f"{glob.escape(os.path.basename(path))}.backup_*")
+            for backup in glob.glob(pattern):
+                newest = max(newest, os.path.getmtime(backup))
+        return max(self.interval_seconds - (time.time() - newest), 0.0)
+
+    async def _run_forever(self):
+        await asyncio.sleep(self._initial_delay())
+        while True:
+            try:
+                self.print_report(await self.run_once())
+            except Exception as e:
+                print(f"⚠️ 数据库备份任务出错: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """启动后台备份任务"""
+        if self._task is None:
+            print(f"💾 数据库备份已启用: 每 {self.interval_seconds / 3600:g} 小时备份到 {self.backup_location}, "
+                  f"保留 {self.max_backup_files} 份")
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def aclose(self):
+        """停止后台备份任务（正在进行的备份线程会完成当前数据库后结束）"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
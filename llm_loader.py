@@ -2,14 +2,9 @@
 import json
 import os
 from typing import Optional
-from langchain_openai import ChatOpenAI
 
-# 导入自定义 Ollama 适配器
-try:
-    from ollama_adapter import create_ollama_chat_model
-    OLLAMA_ADAPTER_AVAILABLE = True
-except ImportError:
-    OLLAMA_ADAPTER_AVAILABLE = False
+# 提供商模块（langchain_openai、ollama_adapter）在选中对应提供商时才导入，
+# 避免未使用的提供商拖慢启动
 
 def load_llm_from_config(config_path: str = "config/llm_config.json", provider: Optional[str] = None):
     """
@@ -43,26 +38,44 @@ def load_llm_from_config(config_path: str = "config/llm_config.json", provider:
         provider_type = llm_conf.get("provider", "openai")
 
     # 如果是 Ollama 提供商且自定义适配器可用，使用自定义适配器
-    if provider_type == "ollama" and OLLAMA_ADAPTER_AVAILABLE:
-        print(f"🔧 使用 Ollama 自定义适配器: {model}")
-        return create_ollama_chat_model(
-            model=model,
-            base_url=api_base,
-            temperature=temperature,
-            streaming=streaming
-        )
-    else:
-        # 使用标准 OpenAI 兼容接口
-        if provider_type == "ollama" and not OLLAMA_ADAPTER_AVAILABLE:
+    if provider_type == "ollama":
+        try:
+            from ollama_adapter import create_ollama_chat_model
+        except ImportError:
             print("⚠️ Ollama 适配器不可用，尝试使用 OpenAI 兼容接口")
+        else:
+            print(f"🔧 使用 Ollama 自定义适配器: {model}")
+            return create_ollama_chat_model(
+                model=model,
+                base_url=api_base,
+                temperature=temperature,
+                streaming=streaming
+            )
+
+    # 使用标准 OpenAI 兼容接口
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model,
+        api_key=api_key,
+        base_url=api_base,
+        temperature=temperature,
+        streaming=streaming
+    )
 
-        return ChatOpenAI(
-            model=model,
-            api_key=api_key,
-            base_url=api_base,
-            temperature=temperature,
-            streaming=streaming
-        )
+def load_context_budget(config_path: str = "config/llm_config.json", provider: Optional[str] = None) -> Optional[int]:
+    """
+    读取提供商的上下文 token 预算（max_context_tokens），未配置时返回 None。
+    provider 的选择规则与 load_llm_from_config 相同。
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if "models" in config:
+        llm_conf = config["models"].get(provider or config.get("default_provider"), {})
+    else:
+        llm_conf = config.get("llm", {})
+    budget = llm_conf.get("max_context_tokens")
+    return int(budget) if budget else None
 
 def list_available_models(config_path: str = "llm_config.json"):
     """
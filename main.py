@@ -9,7 +9,7 @@ import asyncio
 import json
 import os
 import uuid
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
 # 禁用 LangSmith 追踪以避免 TracerException 错误
 os.environ["LANGCHAIN_TRACING_V2"] = "false"
@@ -19,26 +19,23 @@ os.environ["LANGCHAIN_API_KEY"] = ""
 os.environ["LANGCHAIN_PROJECT"] = ""
 os.environ["LANGSMITH_TRACING"] = "false"
 
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langgraph.graph import END, StateGraph, MessagesState
-from langgraph.prebuilt import ToolNode
-
-# 从我们的模块中导入加载函数
-from llm_loader import load_llm_from_config
-from mcp_loader import load_mcp_tools_from_config
-
-# 导入持久化模块 - 严格按照 LangGraph 官方标准
-import aiosqlite
-try:
-    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
-    SQLITE_AVAILABLE = True
-    print("✅ AsyncSQLite checkpointer 可用")
-except ImportError:
-    from langgraph.checkpoint.memory import MemorySaver
-    SQLITE_AVAILABLE = False
-    print("⚠️ AsyncSQLite checkpointer 不可用，将使用内存存储")
+from startup_profiler import enable_startup_profiling, profile_phase
+
+enable_startup_profiling()
 
+# LLM 提供商和检查点后端模块在被配置选中时才导入（见 llm_loader 和 create_checkpointer）
+with profile_phase("imports (main)"):
+    from langchain_core.messages import HumanMessage, AIMessage, ToolMessage, message_chunk_to_message
+    from langchain_core.runnables import RunnableConfig
+    from langgraph.graph import END, StateGraph, MessagesState
 
+    # 从我们的模块中导入加载函数
+    from context_trimmer import ContextTrimmer
+    from llm_loader import load_context_budget, load_llm_from_config
+    from mcp_loader import load_mcp_tool_registry
+    from message_history import DEFAULT_PAGE_SIZE, get_message_page
+    from thread_catalog import CLI_THREAD_ID
+    from tool_executor import ToolExecutor
 
 
 # 配置加载函数
@@ -83,12 +80,26 @@ class AgentState(MessagesState):
     pass
 
 
+def _sqlite_saver_class(sqlite_config: Dict[str, Any]):
+    """根据 serialization 配置选择 SQLite 存储器类型，返回 (类, 构造参数)"""
+    serialization = sqlite_config.get("serialization")
+    if not serialization:
+        from sqlite_checkpointer import TunedAsyncSqliteSaver
+        return TunedAsyncSqliteSaver, {}
+
+    from checkpoint_serde import CompactSqliteSaver, compact_saver_options
+    options = compact_saver_options(serialization)
+    print(f"📝 检查点格式: 压缩 {options['compression']}, 消息去重 {'开启' if options['deduplicate_messages'] else '关闭'}")
+    return CompactSqliteSaver, options
+
+
 async def create_checkpointer(config: Optional[Dict[str, Any]] = None):
     """创建检查点存储器 - 按照 LangGraph 官方标准实现"""
     if config is None:
         config = load_persistence_config()
 
     persistence_config = config.get("persistence", {})
+    from langgraph.checkpoint.memory import MemorySaver
 
     if not persistence_config.get("enabled", True):
         print("📝 持久化已禁用，使用内存存储器")
@@ -97,29 +108,72 @@ async def create_checkpointer(config: Optional[Dict[str, Any]] = None):
     backend = persistence_config.get("backend", "sqlite")
     backend_config = persistence_config.get("config", {})
 
-    if backend == "sqlite" and SQLITE_AVAILABLE:
-        # 从配置获取数据库路径
-        db_path = backend_config.get("database_path", "./data/agent_memory.db")
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    if backend == "sqlite":
+        # 仅在选中 SQLite 后端时导入持久化模块 - 严格按照 LangGraph 官方标准
+        try:
+            from sqlite_checkpointer import DEFAULT_DATABASE_PATH, get_connection_manager
+        except ImportError:
+            print("⚠️ AsyncSQLite checkpointer 不可用，使用内存存储器")
+            return MemorySaver()
+
+        # 从配置获取数据库路径和连接参数
+        sqlite_config = backend_config.get("sqlite", {})
+        db_path = sqlite_config.get("database_path", DEFAULT_DATABASE_PATH)
 
         print(f"📝 使用 AsyncSQLite 检查点存储器: {db_path}")
-        # 直接创建 AsyncSqliteSaver 实例
-        conn = await aiosqlite.connect(db_path)
-        checkpointer = AsyncSqliteSaver(conn)
+        # 同一数据库文件在进程内只打开一个连接，PRAGMA 在打开时应用
+        manager = get_connection_manager(db_path, sqlite_config.get("connection_options"))
+        saver_cls, saver_kwargs = _sqlite_saver_class(sqlite_config)
+        checkpointer = await saver_cls.from_manager(manager, **saver_kwargs)
+        return checkpointer
+    elif backend == "sqlite_sharded":
+        try:
+            from sharded_checkpointer import ShardedSqliteSaver
+        except ImportError:
+            print("⚠️ AsyncSQLite checkpointer 不可用，使用内存存储器")
+            return MemorySaver()
+
+        # 分片沿用 sqlite 配置中的连接参数和序列化格式
+        sharded_config = backend_config.get("sqlite_sharded", {})
+        sqlite_config = backend_config.get("sqlite", {})
+        saver_cls, saver_kwargs = _sqlite_saver_class(sqlite_config)
+        checkpointer = await ShardedSqliteSaver.from_config(
+            sharded_config, sqlite_config.get("connection_options"), saver_cls, **saver_kwargs
+        )
+        print(f"📝 使用分片 AsyncSQLite 检查点存储器: {len(checkpointer.shards)} 个分片")
         return checkpointer
     elif backend == "memory":
         print("📝 使用内存检查点存储器")
         return MemorySaver()
     else:
-        print(f"⚠️ 不支持的后端 '{backend}' 或 SQLite 不可用，使用内存存储器")
+        print(f"⚠️ 不支持的后端 '{backend}'，使用内存存储器")
         return MemorySaver()
 
 
+def wrap_write_back_cache(checkpointer, persistence_config: Dict[str, Any]):
+    """按 write_back_cache 配置在检查点存储器前加一层内存写回缓存"""
+    if not persistence_config.get("write_back_cache", {}).get("enabled", False):
+        return checkpointer
+    from write_back_checkpointer import WriteBackCheckpointSaver
+    return WriteBackCheckpointSaver.from_config(checkpointer, persistence_config)
+
+
+def create_memory_store(persistence_config: Dict[str, Any]):
+    """按 long_term_memory 配置创建长期记忆存储，未启用时返回 None"""
+    long_term = persistence_config.get("memory_settings", {}).get("long_term_memory", {})
+    if not long_term.get("enabled", False):
+        return None
+    from memory_store import SQLiteMemoryStore
+    return SQLiteMemoryStore.from_config(persistence_config)
+
+
 class SimpleSessionManager:
     """简单的会话管理器 - 符合 LangGraph 官方标准"""
 
-    def __init__(self, config: Optional[Dict[str, Any]] = None):
+    def __init__(self, config: Optional[Dict[str, Any]] = None, session_index=None):
         self.config = config or {}
+        # 进程内共享的 UserSessionIndex，用于执行 max_sessions_per_user 配额
+        self.session_index = session_index
         session_config = self.config.get("session_management", {})
 
         self.current_thread_id = None
@@ -137,6 +191,8 @@ class SimpleSessionManager:
         thread_id = f"{user_id}_{uuid.uuid4().hex[:8]}"
         self.current_thread_id = thread_id
         self.current_user_id = user_id
+        if self.session_index is not None:
+            self.session_index.add(user_id, thread_id)
 
         print(f"🆕 创建新会话: {thread_id}")
         return thread_id
@@ -144,6 +200,8 @@ class SimpleSessionManager:
     def get_session_config(self, thread_id: str, user_id: Optional[str] = None):
         """获取 LangGraph 标准的会话配置 - 支持 user_id"""
         config = {"configurable": {"thread_id": thread_id}}
+        if self.session_index is not None:
+            self.session_index.touch(thread_id)
 
         # 如果提供了 user_id，添加到配置中（用于跨线程持久化）
         if user_id:
@@ -163,59 +221,84 @@ class SimpleSessionManager:
             return self.get_session_config(self.current_thread_id, self.current_user_id)
         return None
 
-    def resume_session(self, thread_id: str):
-        """恢复到指定的会话"""
+    def resume_session(self, thread_id: str, user_id: Optional[str] = None):
+        """恢复到指定的会话（user_id 通常来自会话目录）"""
         self.current_thread_id = thread_id
-        # 从 thread_id 中提取 user_id（如果遵循 user_id_xxxxxxxx 格式）
-        if '_' in thread_id:
-            self.current_user_id = thread_id.split('_')[0]
+        if user_id is None:
+            # 目录中没有记录时，从 user_id_xxxxxxxx 格式的 thread_id 中提取
+            match = CLI_THREAD_ID.match(thread_id)
+            user_id = match.group("user_id") if match else None
+        if user_id:
+            self.current_user_id = user_id
+        if self.session_index is not None and self.current_user_id:
+            owner = self.session_index.owner(thread_id) or self.current_user_id
+            self.session_index.add(owner, thread_id)
         print(f"🔄 恢复会话: {thread_id}")
         return thread_id
 
 
-async def initialize_agent():
-    """初始化Agent组件并构建工作流 - 简化版持久化功能"""
-    print("--- 初始化Agent (带持久化功能) ---")
-
-    # 加载持久化配置
-    persistence_config = load_persistence_config("config/persistence_config.json")
-
-    # 创建检查点存储器 - 参考 WoodenFish 项目
-    checkpointer = await create_checkpointer(persistence_config)
-
-    # 创建简单的会话管理器
-    session_manager = SimpleSessionManager(persistence_config)
-
-    # 自动使用配置文件中指定的默认提供商
-    llm = load_llm_from_config("config/llm_config.json")
-    _, tools = await load_mcp_tools_from_config("config/mcp_config.json")
-
-    # 将工具绑定到LLM，这样LLM就知道可以使用哪些工具
-    llm_with_tools = llm.bind_tools(tools)
+def create_context_trimmer(persistence_config: Dict[str, Any],
+                           llm_config_path: str = "config/llm_config.json") -> ContextTrimmer:
+    """根据短期记忆配置和提供商的 token 预算创建上下文裁剪器"""
+    short_term = persistence_config.get("memory_settings", {}).get("short_term_memory", {})
+    max_messages = short_term.get("max_messages_per_session") if short_term.get("enabled", True) else None
+    trimmer = ContextTrimmer(max_tokens=load_context_budget(llm_config_path), max_messages=max_messages)
+    print(f"✂️ 上下文裁剪: token 预算 {trimmer.max_tokens or '不限'}, 消息上限 {trimmer.max_messages or '不限'}")
+    return trimmer
+
+
+def compile_workflow(llm, registry, checkpointer, context_trimmer: Optional[ContextTrimmer] = None,
+                     store=None):
+    """
+    构建并编译 Agent 工作流
+
+    Args:
+        llm: 聊天模型
+        registry: 工具注册表（提供 tools 列表、version 版本号和 server_of 查询）
+        checkpointer: 检查点存储器
+        context_trimmer: 上下文裁剪器，只影响发送给模型的消息，检查点中的历史保持完整
+        store: 跨会话的长期记忆存储，节点和工具通过 get_store() 访问
+    """
+    tools = registry.tools
+
+    # 按注册表版本缓存绑定结果：延迟就绪的 MCP 服务器追加工具后自动重新绑定
+    bound = {"version": None, "llm": llm}
+
+    def refresh_bindings():
+        if bound["version"] != registry.version:
+            # 将工具绑定到LLM，这样LLM就知道可以使用哪些工具
+            bound["llm"] = llm.bind_tools(tools) if tools else llm
+            bound["version"] = registry.version
+        return bound
 
     # 定义节点函数
-    def call_model(state: AgentState):
-        """调用模型节点 - 严格按照 LangGraph 官方标准"""
+    async def call_model(state: AgentState, config: RunnableConfig):
+        """调用模型节点 - 原生异步，逐个 token 流式生成，不阻塞事件循环"""
         messages = state["messages"]
+        if context_trimmer is not None:
+            messages = context_trimmer(messages)
 
         try:
-            response = llm_with_tools.invoke(messages)
+            # 使用 astream 让 stream_mode="messages" 在 token 生成时即可收到
+            response = None
+            async for chunk in refresh_bindings()["llm"].astream(messages, config):
+                response = chunk if response is None else response + chunk
 
             # 确保响应不为空
-            if not response.content and not (hasattr(response, 'tool_calls') and response.tool_calls):
+            if response is None or (not response.content and not response.tool_calls):
                 # 如果响应为空，创建一个默认响应
-                from langchain_core.messages import AIMessage
                 response = AIMessage(content="抱歉，我无法处理这个请求。请重新尝试。")
+            else:
+                response = message_chunk_to_message(response)
 
             return {"messages": [response]}
         except Exception as e:
             print(f"⚠️ 模型调用出错: {e}")
-            from langchain_core.messages import AIMessage
             error_response = AIMessage(content=f"抱歉，处理请求时出现错误: {str(e)}")
             return {"messages": [error_response]}
 
-    # 创建工具节点
-    tool_node = ToolNode(tools)
+    # 创建工具节点：并发执行多个工具调用，按服务器限流，每次调用有独立的截止时间
+    tool_node = ToolExecutor(registry)
 
     def should_continue(state: AgentState):
         """判断是否继续执行 - 严格按照 LangGraph 官方标准"""
@@ -250,13 +333,56 @@ async def initialize_agent():
     workflow.add_edge("tools", "agent")
 
     # 关键修改：编译图时集成检查点 - 严格按照 LangGraph 官方标准（参考 WoodenFish）
-    app = workflow.compile(checkpointer=checkpointer)
+    return workflow.compile(checkpointer=checkpointer, store=store)
+
+
+async def build_agent():
+    """
+    构建Agent组件和工作流
+
+    Returns:
+        Tuple: (编译后的工作流, MCP 工具注册表, 持久化配置)
+    """
+    print("--- 初始化Agent (带持久化功能) ---")
+
+    # 加载持久化配置
+    with profile_phase("config"):
+        persistence_config = load_persistence_config("config/persistence_config.json")
+
+    # 创建检查点存储器 - 参考 WoodenFish 项目
+    with profile_phase("checkpointer open"):
+        checkpointer = await create_checkpointer(persistence_config)
+        checkpointer = wrap_write_back_cache(checkpointer, persistence_config)
+        store = create_memory_store(persistence_config)
+
+    # 自动使用配置文件中指定的默认提供商
+    with profile_phase("LLM construction"):
+        llm = load_llm_from_config("config/llm_config.json")
+        context_trimmer = create_context_trimmer(persistence_config, "config/llm_config.json")
+    with profile_phase("MCP spawn"):
+        registry = await load_mcp_tool_registry("config/mcp_config.json")
+    if store is not None:
+        from memory_store import memory_tools
+        registry.add_local_tools(memory_tools())
+
+    with profile_phase("graph compile"):
+        app = compile_workflow(llm, registry, checkpointer, context_trimmer, store)
     print("--- 工作流构建完成 (已集成持久化) ---")
     
     # 显示持久化信息
     print(f"📝 检查点存储: {type(checkpointer).__name__}")
 
-    return app, tools, session_manager
+    return app, registry, persistence_config
+
+
+async def initialize_agent():
+    """初始化Agent组件并构建工作流 - 简化版持久化功能"""
+    app, registry, persistence_config = await build_agent()
+
+    # 创建简单的会话管理器
+    session_manager = SimpleSessionManager(persistence_config)
+
+    return app, registry.tools, session_manager
 
 
 async def run_agent_with_persistence(app, query, session_manager, thread_id):
@@ -309,8 +435,9 @@ def show_welcome(tools=None):
     
     print("\n📋 可用命令:")
     print("  • 'new' - 开始新对话")
-    print("  • 'resume <thread_id>' - 恢复到指定会话")
-    print("  • 'history' - 查看对话历史")
+    print("  • 'sessions' - 列出最近的会话")
+    print("  • 'resume <序号|thread_id>' - 恢复到指定会话")
+    print("  • 'history [每页条数] [偏移]' - 分页查看对话历史，从最新的消息开始")
     print("  • 'help' - 查看帮助")
     print("  • 'tools' - 查看可用工具")
     print("  • 'clear' - 清屏")
@@ -334,12 +461,34 @@ def show_help(tools=None):
             print(f"  ... 还有 {len(tools) - 5} 个工具")
 
 
-async def interactive_loop_with_persistence(app, tools, session_manager):
-    """带持久化功能的交互式对话循环"""
+def _format_session(index: int, session: Dict[str, Any], current_thread_id: str) -> str:
+    marker = "👉" if session["thread_id"] == current_thread_id else "  "
+    last_active = session["last_active_at"][:19].replace("T", " ")
+    title = session["title"] or "(无标题)"
+    return f"{marker}{index:>3}. {session['thread_id']}  {last_active}  {session['message_count']:>4} 条  {title}"
+
+
+async def show_sessions(catalog, session_manager, thread_id: str) -> List[Dict[str, Any]]:
+    """列出当前用户最近的会话，返回列表供 resume <序号> 使用"""
+    user_id = session_manager.current_user_id or session_manager.default_user_id
+    sessions = await catalog.list_sessions(user_id)
+    if not sessions:
+        print(f"📂 用户 {user_id} 暂无已保存的会话")
+        return []
+    print(f"\n📂 用户 {user_id} 最近的会话 ({len(sessions)} 个，最后活动时间为 UTC):")
+    for i, session in enumerate(sessions, 1):
+        print(_format_session(i, session, thread_id))
+    print("   输入 'resume <序号>' 或 'resume <thread_id>' 恢复会话")
+    return sessions
+
+
+async def interactive_loop_with_persistence(app, tools, session_manager, catalog=None):
+    """带持久化功能的交互式对话循环（catalog 为会话目录，用于 sessions 和 resume 命令）"""
     show_welcome(tools)
     
     # 创建新会话
     thread_id = session_manager.create_session()
+    listed_sessions: List[Dict[str, Any]] = []
     
     while True:
         try:
@@ -357,29 +506,57 @@ async def interactive_loop_with_persistence(app, tools, session_manager):
                 thread_id = session_manager.clear_current_session()
                 print("✅ 已开始新对话")
                 continue
+            elif user_input.lower() == 'sessions':
+                if catalog is None:
+                    print("❌ 当前检查点存储器不支持会话目录")
+                else:
+                    listed_sessions = await show_sessions(catalog, session_manager, thread_id)
+                continue
             elif user_input.lower().startswith('resume '):
-                # 恢复到指定会话：resume thread_id
-                parts = user_input.split(' ', 1)
-                if len(parts) == 2:
-                    target_thread_id = parts[1].strip()
-                    thread_id = session_manager.resume_session(target_thread_id)
-                    print("✅ 已恢复到指定会话")
+                # 恢复到指定会话：resume <序号>（来自 sessions 列表）或 resume <thread_id>
+                target = user_input.split(' ', 1)[1].strip()
+                if target.isdigit() and 1 <= int(target) <= len(listed_sessions):
+                    target = listed_sessions[int(target) - 1]["thread_id"]
+                index = session_manager.session_index
+                if index is not None and index.is_archived(target):
+                    print(f"❌ 会话 {target} 已因超出会话配额归档，不能恢复")
+                    continue
+                entry = await catalog.get(target) if catalog is not None else None
+                if catalog is not None and entry is None:
+                    print(f"❌ 会话目录中没有会话 {target}，输入 'sessions' 查看可恢复的会话")
+                    continue
+                thread_id = session_manager.resume_session(target, entry["user_id"] if entry else None)
+                if entry:
+                    print(f"✅ 已恢复到会话: {entry['title'] or target} ({entry['message_count']} 条消息)")
                 else:
-                    print("❌ 请提供会话ID，格式：resume <thread_id>")
+                    print("✅ 已恢复到指定会话")
                 continue
-            elif user_input.lower() == 'history':
-                # 获取对话历史
+            elif user_input.lower().split()[0] == 'history':
+                # 分页查看对话历史：history [每页条数] [跳过最新的条数]，只读取这一页的消息
+                try:
+                    args = user_input.split()[1:]
+                    page_size = int(args[0]) if args else DEFAULT_PAGE_SIZE
+                    offset = int(args[1]) if len(args) > 1 else 0
+                    if page_size <= 0 or offset < 0:
+                        raise ValueError
+                except ValueError:
+                    print("❌ 用法: history [每页条数] [跳过最新的条数]，例如 'history 20 40'")
+                    continue
                 try:
                     config = session_manager.get_session_config(thread_id)
-                    state = await app.aget_state(config)
-                    if state.values and "messages" in state.values:
-                        messages = state.values["messages"]
-                        print(f"\n📚 当前会话历史 ({len(messages)} 条消息):")
-                        for i, msg in enumerate(messages[-10:], 1):  # 只显示最近10条
-                            msg_type = "👤" if isinstance(msg, HumanMessage) else "🤖" if isinstance(msg, AIMessage) else "🔧"
-                            print(f"  {i}. {msg_type} {msg.content[:50]}...")
-                    else:
-                        print("📚 当前会话暂无历史记录")
+                    page = await get_message_page(app.checkpointer, config, page_size, offset)
+                    if not page or not page["messages"]:
+                        print("📚 当前会话暂无历史记录" if not page or not page["total"]
+                              else f"📚 偏移 {offset} 之前没有更早的消息（共 {page['total']} 条）")
+                        continue
+                    first = page["start"] + 1
+                    last = page["start"] + len(page["messages"])
+                    print(f"\n📚 当前会话历史 (第 {first}-{last} 条，共 {page['total']} 条消息):")
+                    for i, msg in enumerate(page["messages"], first):
+                        msg_type = "👤" if isinstance(msg, HumanMessage) else "🤖" if isinstance(msg, AIMessage) else "🔧"
+                        print(f"  {i}. {msg_type} {str(msg.content)[:50]}...")
+                    if page["next_offset"] is not None:
+                        print(f"   输入 'history {page_size} {page['next_offset']}' 查看更早的消息")
                 except Exception as e:
                     print(f"❌ 获取历史记录失败: {e}")
                 continue
@@ -409,18 +586,24 @@ async def interactive_loop_with_persistence(app, tools, session_manager):
 
 async def main():
     """主函数"""
+    from agent_runtime import get_agent_runtime, shutdown_agent_runtime
+
     try:
-        # 初始化 Agent
-        app, tools, session_manager = await initialize_agent()
+        # 初始化 Agent；传入本模块的定义，以脚本运行时 agent_runtime 不会再导入一份 main
+        runtime = await get_agent_runtime(build_agent, SimpleSessionManager)
+        session_manager = runtime.new_session_manager()
 
         # 启动交互循环
-        await interactive_loop_with_persistence(app, tools, session_manager)
+        await interactive_loop_with_persistence(runtime.app, runtime.tools, session_manager, runtime.thread_catalog)
 
     except Exception as e:
         print(f"\n💥 初始化失败: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        await shutdown_agent_runtime()
 
 
 if __name__ == "__main__":
+    # 启动耗时分析：python main.py --profile-startup
     asyncio.run(main())
@@ -1,22 +1,34 @@
 # mcp_loader.py
+import asyncio
+import hashlib
 import json
+import os
+import time
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from typing import List
-from langchain_core.tools import BaseTool
+from typing import Any, Callable, Dict, List, Optional
+from langchain_core.tools import BaseTool, StructuredTool
 
-async def load_mcp_tools_from_config(config_path: str = "config/mcp_config.json"):
-    """
-    从指定的JSON配置文件加载并初始化MCP工具。
+from mcp_session_pool import DEFAULT_HEALTH_CHECK_INTERVAL, DEFAULT_PING_TIMEOUT, MCPSessionPool
+from tool_result_cache import ToolResultCacheSet
 
-    Args:
-        config_path (str): MCP工具配置文件的路径。
+# 单个 MCP 服务器的默认启动超时（秒），可在 mcp_config.json 中用 startup_timeout 覆盖
+DEFAULT_STARTUP_TIMEOUT = 30.0
 
-    Returns:
-        Tuple[MultiServerMCPClient, List[BaseTool]]: MCP客户端和LangChain兼容的工具列表。
-    """
+# 工具 schema 缓存文件，按服务器配置的哈希索引
+DEFAULT_TOOL_CACHE_PATH = "./data/mcp_tool_cache.json"
+
+# mcp_config.json 中由加载器自身使用的字段，不会传给 MultiServerMCPClient
+LOADER_OPTION_KEYS = {"startup_timeout", "lazy", "max_concurrency", "call_timeout", "result_cache"}
+
+# 决定服务器启动什么、提供哪些工具的字段；调整超时、并发或结果缓存不会让工具 schema 缓存失效
+TOOL_SCHEMA_HASH_KEYS = ("command", "args", "env", "cwd", "transport", "url", "headers")
+
+
+def _read_mcp_config(config_path: str) -> Dict[str, Any]:
+    """读取 MCP 配置文件"""
     try:
         with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+            return json.load(f)
     except FileNotFoundError:
         print(f"错误: 配置文件 '{config_path}' 未找到。")
         exit(1)
@@ -24,15 +36,295 @@ async def load_mcp_tools_from_config(config_path: str = "config/mcp_config.json"
         print(f"错误: 无法解析配置文件 '{config_path}'。请检查其JSON格式。")
         exit(1)
 
+
+def _connection_params(server_config: Dict[str, Any]) -> Dict[str, Any]:
+    """去掉加载器扩展字段，得到 MCP 客户端可以识别的连接参数"""
+    return {k: v for k, v in server_config.items() if k not in LOADER_OPTION_KEYS}
+
+
+def server_config_hash(server_config: Dict[str, Any]) -> str:
+    """计算服务器配置中决定工具列表的字段的哈希，这些字段变化后缓存自动失效"""
+    identity = {k: server_config[k] for k in TOOL_SCHEMA_HASH_KEYS if k in server_config}
+    canonical = json.dumps(identity, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _tool_schema(tool: BaseTool) -> Dict[str, Any]:
+    """提取可以写入缓存的工具描述"""
+    args_schema = tool.args_schema
+    if args_schema is not None and not isinstance(args_schema, dict):
+        args_schema = args_schema.model_json_schema()
+    return {
+        "name": tool.name,
+        "description": tool.description,
+        "args_schema": args_schema or {"type": "object", "properties": {}},
+        "metadata": tool.metadata,
+    }
+
+
+class ToolSchemaCache:
+    """MCP 工具 schema 的磁盘缓存"""
+
+    def __init__(self, path: str = DEFAULT_TOOL_CACHE_PATH):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"⚠️ 工具缓存 '{path}' 无法读取，将重新生成: {e}")
+
+    def get(self, config_hash: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self.entries.get(config_hash)
+        return entry["tools"] if entry else None
+
+    def put(self, config_hash: str, server_name: str, tools: List[BaseTool], valid_hashes):
+        """写入某个服务器的工具描述，同时清理已不在配置中的旧条目"""
+        self.entries[config_hash] = {
+            "server": server_name,
+            "tools": [_tool_schema(tool) for tool in tools],
+            "updated_at": time.time(),
+        }
+        self.entries = {h: e for h, e in self.entries.items() if h in valid_hashes}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class MCPToolRegistry:
+    """
+    MCP 工具注册表
+
+    记录每个服务器提供的工具及其启动情况。启动超时的服务器会在后台继续启动，
+    就绪后再追加到注册表中，并通知已注册的监听器。
+
+    对于 lazy 服务器（默认），如果缓存中有与当前配置匹配的工具 schema，
+    启动时只根据缓存绑定代理工具，直到第一次真正调用其中某个工具时才启动服务器。
+
+    注册表中的工具都是代理工具，实际调用通过 MCPSessionPool 的长连接会话完成，
+    配置了 result_cache 的服务器先查结果缓存。
+    """
+
+    def __init__(self, client: MultiServerMCPClient, server_configs: Dict[str, Dict[str, Any]],
+                 schema_cache: Optional[ToolSchemaCache] = None,
+                 pool_options: Optional[Dict[str, Any]] = None,
+                 execution_options: Optional[Dict[str, Any]] = None):
+        pool_options = pool_options or {}
+        self.client = client
+        self.server_configs = server_configs
+        self.execution_options = execution_options or {}
+        self.schema_cache = schema_cache or ToolSchemaCache()
+        self.pool = MCPSessionPool(
+            client,
+            health_check_interval=float(pool_options.get("health_check_interval", DEFAULT_HEALTH_CHECK_INTERVAL)),
+            ping_timeout=float(pool_options.get("ping_timeout", DEFAULT_PING_TIMEOUT)),
+            on_session_start=self._remember_schemas,
+        )
+        self.result_caches = ToolResultCacheSet(server_configs)
+        self.config_hashes = {name: server_config_hash(conf) for name, conf in server_configs.items()}
+        self.tools: List[BaseTool] = []
+        self.server_tools: Dict[str, List[BaseTool]] = {}
+        self.startup_report: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
+        self._listeners: List[Callable[[str, List[BaseTool]], None]] = []
+        self._background_tasks: Dict[str, asyncio.Task] = {}
+
+    def add_listener(self, callback: Callable[[str, List[BaseTool]], None]):
+        """注册工具变更回调，参数为 (服务器名称, 新增工具列表)"""
+        self._listeners.append(callback)
+
+    def attach(self, server_name: str, tools: List[BaseTool]):
+        """把某个服务器的工具加入注册表"""
+        self.server_tools[server_name] = tools
+        self.tools.extend(tools)
+        self.version += 1
+        for callback in self._listeners:
+            callback(server_name, tools)
+
+    def add_local_tools(self, tools: List[BaseTool]):
+        """加入不属于任何 MCP 服务器的本地工具（如长期记忆工具）"""
+        self.tools.extend(tools)
+        self.version += 1
+
+    def server_of(self, tool_name: str):
+        """查找工具所属的服务器名称"""
+        for server_name, tools in self.server_tools.items():
+            if any(tool.name == tool_name for tool in tools):
+                return server_name
+        return None
+
+    def _startup_timeout(self, server_name: str) -> float:
+        return float(self.server_configs[server_name].get("startup_timeout", DEFAULT_STARTUP_TIMEOUT))
+
+    def _is_lazy(self, server_name: str) -> bool:
+        return bool(self.server_configs[server_name].get("lazy", True))
+
+    def _remember_schemas(self, server_name: str, tools: List[BaseTool]):
+        """会话建立时刷新该服务器的 schema 缓存"""
+        self.schema_cache.put(self.config_hashes[server_name], server_name, tools,
+                              set(self.config_hashes.values()))
+
+    async def _load_server(self, server_name: str) -> List[BaseTool]:
+        start = time.perf_counter()
+        try:
+            live_tools = await self.pool.get_tools(server_name)
+        finally:
+            self.startup_report.setdefault(server_name, {})["seconds"] = time.perf_counter() - start
+        return [self._make_pooled_tool(server_name, _tool_schema(tool)) for tool in live_tools.values()]
+
+    def _make_pooled_tool(self, server_name: str, schema: Dict[str, Any]) -> BaseTool:
+        """根据 schema 创建代理工具，调用时通过会话池转发（lazy 服务器在首次调用时启动）"""
+        tool_name = schema["name"]
+        result_cache = self.result_caches.for_tool(server_name, tool_name)
+
+        async def call_tool(**arguments):
+            if result_cache is not None:
+                hit, result = result_cache.get(arguments)
+                if hit:
+                    return result
+            result = await self.pool.call_tool(server_name, tool_name, arguments,
+                                               startup_timeout=self._startup_timeout(server_name))
+            if result_cache is not None:
+                result_cache.put(arguments, result)
+            return result
+
+        return StructuredTool(
+            name=tool_name,
+            description=schema.get("description") or "",
+            args_schema=schema["args_schema"],
+            coroutine=call_tool,
+            response_format="content_and_artifact",
+            metadata=schema.get("metadata"),
+        )
+
+    async def _await_startup(self, server_name: str, task: asyncio.Task):
+        timeout = self._startup_timeout(server_name)
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        report = self.startup_report.setdefault(server_name, {})
+
+        if not done:
+            # 超时的服务器不取消，继续在后台启动，就绪后再追加
+            report.update({"status": "timeout", "timeout": timeout})
+            self._background_tasks[server_name] = task
+            task.add_done_callback(lambda t, name=server_name: self._on_late_startup(name, t))
+            return
+
+        if task.exception() is not None:
+            report.update({"status": "failed", "error": str(task.exception())})
+            return
+
+        tools = task.result()
+        report.update({"status": "ready", "tools": len(tools)})
+        self.attach(server_name, tools)
+
+    def _on_late_startup(self, server_name: str, task: asyncio.Task):
+        self._background_tasks.pop(server_name, None)
+        report = self.startup_report.setdefault(server_name, {})
+        if task.cancelled():
+            report["status"] = "cancelled"
+            return
+        if task.exception() is not None:
+            report.update({"status": "failed", "error": str(task.exception())})
+            print(f"❌ MCP 服务器 '{server_name}' 后台启动失败: {task.exception()}")
+            return
+
+        tools = task.result()
+        report.update({"status": "late", "tools": len(tools)})
+        self.attach(server_name, tools)
+        print(f"✅ MCP 服务器 '{server_name}' 延迟就绪 ({report['seconds']:.2f}s)，已追加 {len(tools)} 个工具")
+
+    async def start(self):
+        """绑定缓存中的 lazy 服务器，并发启动其余服务器，每个服务器独立计时"""
+        tasks = {}
+        for server_name in self.server_configs:
+            cached_schemas = self.schema_cache.get(self.config_hashes[server_name])
+            if self._is_lazy(server_name) and cached_schemas is not None:
+                tools = [self._make_pooled_tool(server_name, schema) for schema in cached_schemas]
+                self.startup_report[server_name] = {"status": "cached", "tools": len(tools), "seconds": 0.0}
+                self.attach(server_name, tools)
+            else:
+                tasks[server_name] = asyncio.create_task(self._load_server(server_name))
+        await asyncio.gather(*(self._await_startup(name, task) for name, task in tasks.items()))
+        self.pool.start_health_checks()
+
+    async def aclose(self):
+        """关闭后台启动任务和所有 MCP 会话"""
+        for task in list(self._background_tasks.values()):
+            task.cancel()
+        self.pool.print_metrics()
+        self.result_caches.print_metrics()
+        await self.pool.aclose()
+
+    def print_startup_report(self):
+        """打印每个服务器的启动耗时报告"""
+        print("📊 MCP 服务器启动报告:")
+        for server_name, report in self.startup_report.items():
+            status = report.get("status")
+            if status == "ready":
+                print(f"  ✅ {server_name}: {report['tools']} 个工具, {report['seconds']:.2f}s")
+            elif status == "cached":
+                print(f"  💤 {server_name}: 从缓存绑定 {report['tools']} 个工具，首次调用时启动")
+            elif status == "timeout":
+                print(f"  ⏱️ {server_name}: 超过 {report['timeout']:.0f}s 未就绪，后台继续启动")
+            elif status == "late":
+                print(f"  🐢 {server_name}: 延迟就绪，已追加 {report['tools']} 个工具, {report.get('seconds', 0):.2f}s")
+            elif status == "cancelled":
+                print(f"  🚫 {server_name}: 后台启动已取消（运行时关闭）")
+            else:
+                print(f"  ❌ {server_name}: 启动失败 ({report.get('error')}), {report.get('seconds', 0):.2f}s")
+
+
+async def load_mcp_tool_registry(config_path: str = "config/mcp_config.json",
+                                 cache_path: str = DEFAULT_TOOL_CACHE_PATH) -> MCPToolRegistry:
+    """
+    并发启动配置中的所有 MCP 服务器，返回工具注册表。
+
+    每个服务器有独立的启动超时，Agent 使用已就绪服务器的工具先行启动，
+    超时的服务器在后台继续启动并在就绪后追加到注册表。
+    lazy 服务器命中 schema 缓存时不在启动阶段拉起进程。
+
+    Args:
+        config_path (str): MCP工具配置文件的路径。
+        cache_path (str): 工具 schema 缓存文件的路径。
+
+    Returns:
+        MCPToolRegistry: 包含已就绪工具和启动报告的注册表。
+    """
+    config = _read_mcp_config(config_path)
+
     print(f"正在从 '{config_path}' 加载MCP工具...")
-    
-    # 使用 MultiServerMCPClient 从配置字典创建客户端，并获取工具
-    client = MultiServerMCPClient(config["mcpServers"])
-    tools = await client.get_tools()
-    
-    print(f"成功加载 {len(tools)} 个MCP工具:")
-    for tool in tools:
+
+    server_configs = config["mcpServers"]
+    client = MultiServerMCPClient({
+        name: _connection_params(server_config) for name, server_config in server_configs.items()
+    })
+    registry = MCPToolRegistry(client, server_configs, ToolSchemaCache(cache_path),
+                               pool_options=config.get("sessionPool"),
+                               execution_options=config.get("toolExecution"))
+    await registry.start()
+
+    registry.print_startup_report()
+    print(f"成功加载 {len(registry.tools)} 个MCP工具:")
+    for tool in registry.tools:
         print(f"  - 工具名称: {tool.name}")
         print(f"    描述: {tool.description}")
 
-    return client, tools
\ No newline at end of file
+    return registry
+
+
+async def load_mcp_tools_from_config(config_path: str = "config/mcp_config.json"):
+    """
+    从指定的JSON配置文件加载并初始化MCP工具。
+
+    Args:
+        config_path (str): MCP工具配置文件的路径。
+
+    Returns:
+        Tuple[MultiServerMCPClient, List[BaseTool]]: MCP客户端和LangChain兼容的工具列表。
+    """
+    registry = await load_mcp_tool_registry(config_path)
+    return registry.client, registry.tools
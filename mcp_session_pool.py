@@ -0,0 +1,195 @@
+# mcp_session_pool.py
+"""
+MCP 长连接会话池
+
+MultiServerMCPClient.get_tools() 返回的工具在每次调用时都会新建一个会话
+（stdio 服务器会重新拉起进程并重新握手）。会话池为每个配置的服务器维护一个
+进程级的长连接会话，由所有图运行共享，并提供健康检查、崩溃自动重启和复用统计。
+
+工具调用只在请求确定没有发出时（写入请求时发现会话已关闭）重启会话并重试；
+等待响应时连接断开（进程退出、流结束）服务器可能已经执行了工具，只重启会话、不重试，
+避免文件写入、HTTP POST 等不可重复的工具执行两次。其他错误原样抛出，不影响会话。
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio
+from langchain_core.tools import BaseTool, ToolException
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+# 健康检查默认参数（秒），可在 mcp_config.json 的 sessionPool 中覆盖
+DEFAULT_HEALTH_CHECK_INTERVAL = 30.0
+DEFAULT_PING_TIMEOUT = 5.0
+
+# 写入请求时会话的发送流已关闭：请求没有离开客户端，重启会话后重试是安全的
+UNSENT_REQUEST_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError)
+# 连接已断开，但请求可能已经送达服务器
+CONNECTION_LOST_ERRORS = UNSENT_REQUEST_ERRORS + (anyio.EndOfStream, EOFError, ConnectionError)
+
+
+def _connection_lost(error: BaseException) -> bool:
+    """会话是否已经断开（服务器进程退出时，等待中的请求收到 CONNECTION_CLOSED 错误）"""
+    if isinstance(error, McpError):
+        return error.error.code == CONNECTION_CLOSED
+    return isinstance(error, CONNECTION_LOST_ERRORS)
+
+
+class _PooledSession:
+    """单个服务器的长连接会话"""
+
+    def __init__(self, server_name: str):
+        self.server_name = server_name
+        self.session = None
+        self.tools: Dict[str, BaseTool] = {}
+        self.error: Optional[BaseException] = None
+        self.ready = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.owner_task: Optional[asyncio.Task] = None
+        self.started_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.closed.is_set()
+
+
+class MCPSessionPool:
+    """进程级 MCP 会话池，每个服务器一个长连接会话"""
+
+    def __init__(self, client: MultiServerMCPClient,
+                 health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL,
+                 ping_timeout: float = DEFAULT_PING_TIMEOUT,
+                 on_session_start: Optional[Callable[[str, List[BaseTool]], None]] = None):
+        self.client = client
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+        self.on_session_start = on_session_start
+        self.metrics = {
+            "sessions_created": 0,
+            "session_reuses": 0,
+            "restarts": 0,
+            "health_check_failures": 0,
+            "transport_errors": 0,
+        }
+        self._sessions: Dict[str, _PooledSession] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def _own_session(self, entry: _PooledSession):
+        """会话的所有者任务：进入和退出 session 上下文必须在同一个任务中完成"""
+        try:
+            async with self.client.session(entry.server_name) as session:
+                tools = await load_mcp_tools(session)
+                entry.session = session
+                entry.tools = {tool.name: tool for tool in tools}
+                entry.started_at = time.perf_counter()
+                self.metrics["sessions_created"] += 1
+                entry.ready.set()
+                if self.on_session_start:
+                    self.on_session_start(entry.server_name, tools)
+                await entry.closed.wait()
+        except Exception as e:
+            entry.error = e
+            if entry.session is not None:
+                print(f"⚠️ MCP 会话 '{entry.server_name}' 异常退出: {e}")
+        finally:
+            entry.session = None
+            entry.tools = {}
+            entry.closed.set()
+            entry.ready.set()
+
+    async def get_tools(self, server_name: str, timeout: Optional[float] = None) -> Dict[str, BaseTool]:
+        """获取服务器当前会话绑定的工具，会话不存在或已断开时启动新会话"""
+        entry = self._sessions.get(server_name)
+        if entry is not None and entry.alive:
+            self.metrics["session_reuses"] += 1
+            return entry.tools
+
+        lock = self._locks.setdefault(server_name, asyncio.Lock())
+        async with lock:
+            entry = self._sessions.get(server_name)
+            if entry is None or entry.closed.is_set():
+                if entry is not None:
+                    self.metrics["restarts"] += 1
+                    print(f"🔄 重启 MCP 会话 '{server_name}'")
+                else:
+                    print(f"🔌 启动 MCP 会话 '{server_name}'")
+                entry = _PooledSession(server_name)
+                entry.owner_task = asyncio.create_task(self._own_session(entry))
+                self._sessions[server_name] = entry
+
+        # 等待超时只放弃本次等待，会话继续在后台启动，供后续调用复用
+        await asyncio.wait_for(asyncio.shield(entry.ready.wait()), timeout)
+        if not entry.alive:
+            raise ToolException(f"MCP 服务器 '{server_name}' 启动失败: {entry.error}")
+        return entry.tools
+
+    def _invalidate(self, entry: _PooledSession):
+        """标记会话失效，所有者任务会关闭会话，下次调用时重启"""
+        entry.closed.set()
+
+    async def call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any],
+                        startup_timeout: Optional[float] = None):
+        """通过长连接会话调用工具，请求未发出就发现会话已关闭时重启会话并重试一次"""
+        for attempt in range(2):
+            tools = await self.get_tools(server_name, timeout=startup_timeout)
+            if tool_name not in tools:
+                raise ToolException(f"MCP 服务器 '{server_name}' 不提供工具 '{tool_name}'")
+            entry = self._sessions[server_name]
+            try:
+                return await tools[tool_name].coroutine(**arguments)
+            except Exception as e:
+                if not _connection_lost(e):
+                    # 工具错误、协议错误和超时：服务器可能已经收到请求，会话仍然可用
+                    raise
+                self.metrics["transport_errors"] += 1
+                self._invalidate(entry)
+                if attempt == 1 or not isinstance(e, UNSENT_REQUEST_ERRORS):
+                    raise
+                print(f"⚠️ MCP 会话 '{server_name}' 已关闭，请求未发出，重启后重试: {e!r}")
+
+    async def _health_check_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for server_name, entry in list(self._sessions.items()):
+                if not entry.alive:
+                    continue
+                try:
+                    await asyncio.wait_for(entry.session.send_ping(), self.ping_timeout)
+                except Exception as e:
+                    self.metrics["health_check_failures"] += 1
+                    print(f"⚠️ MCP 会话 '{server_name}' 健康检查失败: {e!r}，正在重启")
+                    self._invalidate(entry)
+                    try:
+                        await self.get_tools(server_name)
+                    except Exception as restart_error:
+                        print(f"❌ MCP 会话 '{server_name}' 重启失败: {restart_error}")
+
+    def start_health_checks(self):
+        """启动后台健康检查任务"""
+        if self._health_task is None and self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_check_loop())
+
+    def print_metrics(self):
+        """打印会话复用统计"""
+        m = self.metrics
+        total = m["sessions_created"] + m["session_reuses"]
+        reuse_rate = m["session_reuses"] / total * 100 if total else 0.0
+        print(f"📊 MCP 会话池: 新建 {m['sessions_created']}, 复用 {m['session_reuses']} ({reuse_rate:.1f}%), "
+              f"重启 {m['restarts']}, 健康检查失败 {m['health_check_failures']}, 连接错误 {m['transport_errors']}")
+
+    async def aclose(self):
+        """关闭所有会话和后台任务"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for entry in self._sessions.values():
+            entry.closed.set()
+        owner_tasks = [e.owner_task for e in self._sessions.values() if e.owner_task is not None]
+        if owner_tasks:
+            await asyncio.gather(*owner_tasks, return_exceptions=True)
+        self._sessions.clear()
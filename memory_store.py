@@ -0,0 +1,529 @@
+# memory_store.py
+"""
+长期记忆存储
+
+SQLiteMemoryStore 是 LangGraph BaseStore 的 SQLite 实现，编译图时作为 store 传入，
+节点和工具通过 langgraph.config.get_store() 访问。条目按命名空间组织，
+记忆工具使用 ("memories", user_id)，user_id 来自 SimpleSessionManager.get_session_config。
+
+全文检索使用 FTS5 外部内容表，由触发器与 memory_items 同步。unicode61 分词器不会切分中文，
+因此写入和查询前先把连续的中文切成相邻二字组，其余文本按单词切分。
+检索按 bm25 排序，命名空间作为 FTS 列参与匹配，结果数和查询词数都有上限，
+超过 search_timeout_ms 的查询会被中断并返回空结果，保证回忆不会拖慢回合：
+检索语句在 aiosqlite 的线程中执行，取消等待它的协程并不会停止它，因此由连接上的
+progress handler 在期限到达时让 SQLite 中止语句，连接随即可以执行下一个操作。
+
+每个条目带过期时间（默认 retention_days，读取时续期），MemoryExpiry 在后台分批删除过期条目。
+"""
+
+import asyncio
+import json
+import re
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.tools import BaseTool, tool
+from langgraph.config import get_config, get_store
+from langgraph.store.base import (
+    BaseStore,
+    GetOp,
+    Item,
+    ListNamespacesOp,
+    Op,
+    PutOp,
+    Result,
+    SearchItem,
+    SearchOp,
+)
+from langgraph.store.base.embed import get_text_at_path
+
+from sqlite_checkpointer import get_connection_manager
+
+DEFAULT_DATABASE_PATH = "./data/long_term_memory.db"
+DEFAULT_RETENTION_DAYS = 365
+DEFAULT_SEARCH_TIMEOUT_MS = 200
+DEFAULT_MAX_SEARCH_RESULTS = 20
+DEFAULT_EXPIRY_INTERVAL_MINUTES = 60
+DEFAULT_EXPIRY_BATCH_SIZE = 500
+DEFAULT_EXPIRY_BATCH_PAUSE_SECONDS = 0.05
+
+# progress handler 每执行多少条 SQLite 虚拟机指令检查一次检索期限
+SEARCH_PROGRESS_INTERVAL = 1000
+
+# 单次查询最多使用的检索词，避免长问题生成过大的 MATCH 表达式
+MAX_QUERY_TERMS = 32
+
+# 记忆工具使用的命名空间为 (MEMORY_NAMESPACE, user_id)
+MEMORY_NAMESPACE = "memories"
+DEFAULT_MEMORY_USER = "default_user"
+DEFAULT_RECALL_LIMIT = 5
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS memory_items (
+        prefix TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        search_text TEXT NOT NULL DEFAULT '',
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        ttl_minutes REAL,
+        expires_at REAL,
+        PRIMARY KEY (prefix, key)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS memory_items_expires_at ON memory_items (expires_at) WHERE expires_at IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS memory_items_updated_at ON memory_items (prefix, updated_at)",
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS memory_items_fts USING fts5(
+        prefix, search_text, content='memory_items', content_rowid='rowid'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_items_ai AFTER INSERT ON memory_items BEGIN
+        INSERT INTO memory_items_fts (rowid, prefix, search_text) VALUES (new.rowid, new.prefix, new.search_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_items_ad AFTER DELETE ON memory_items BEGIN
+        INSERT INTO memory_items_fts (memory_items_fts, rowid, prefix, search_text)
+        VALUES ('delete', old.rowid, old.prefix, old.search_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS memory_items_au AFTER UPDATE OF prefix, search_text ON memory_items BEGIN
+        INSERT INTO memory_items_fts (memory_items_fts, rowid, prefix, search_text)
+        VALUES ('delete', old.rowid, old.prefix, old.search_text);
+        INSERT INTO memory_items_fts (rowid, prefix, search_text) VALUES (new.rowid, new.prefix, new.search_text);
+    END
+    """,
+)
+
+_CJK = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TERM_RE = re.compile(rf"[{_CJK}]+|[^\W_{_CJK}]+")
+_CJK_RE = re.compile(rf"[{_CJK}]")
+
+_FILTER_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def search_terms(text: str) -> List[str]:
+    """把文本切分为检索词：连续中文切成二字组，其余按单词"""
+    terms = []
+    for run in _TERM_RE.findall(text.lower()):
+        if _CJK_RE.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _string_leaves(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [s for v in value.values() for s in _string_leaves(v)]
+    if isinstance(value, (list, tuple)):
+        return [s for v in value for s in _string_leaves(v)]
+    return []
+
+
+def _timestamp(seconds: float) -> datetime:
+    return datetime.fromtimestamp(seconds, timezone.utc)
+
+
+class SQLiteMemoryStore(BaseStore):
+    """带 FTS5 全文索引的 SQLite 长期记忆存储（同步接口在所属事件循环中执行异步实现）"""
+
+    supports_ttl = True
+
+    def __init__(self, manager, retention_days: Optional[float] = DEFAULT_RETENTION_DAYS,
+                 search_timeout_ms: float = DEFAULT_SEARCH_TIMEOUT_MS,
+                 max_search_results: int = DEFAULT_MAX_SEARCH_RESULTS,
+                 index_fields: Optional[Sequence[str]] = None):
+        self.manager = manager
+        self.lock = manager.lock
+        self.conn = None
+        self.retention_days = retention_days
+        self.search_timeout = float(search_timeout_ms) / 1000
+        self.max_search_results = max(int(max_search_results), 1)
+        self.index_fields = list(index_fields) if index_fields else None
+        # 默认 TTL 由 BaseStore.aput 填入 PutOp.ttl，单位为分钟
+        self.ttl_config = {"default_ttl": retention_days * 24 * 60, "refresh_on_read": True} if retention_days else None
+        self._ready = False
+        # 所属事件循环：同步接口从其他线程把操作提交到这里执行（连接和锁都属于它）
+        try:
+            self.loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+        # 正在执行的检索语句的期限（time.monotonic），没有检索在执行时为 None
+        self._search_deadline: Optional[float] = None
+        self.metrics = {"puts": 0, "gets": 0, "searches": 0, "search_timeouts": 0, "search_seconds": 0.0}
+
+    @classmethod
+    def from_config(cls, persistence_config: Dict[str, Any]) -> Optional["SQLiteMemoryStore"]:
+        """根据 memory_settings.long_term_memory 创建存储；未启用时返回 None"""
+        options = persistence_config.get("memory_settings", {}).get("long_term_memory", {})
+        if not options.get("enabled", False):
+            return None
+        backend = options.get("storage_backend", "sqlite")
+        if backend != "sqlite":
+            print(f"⚠️ 不支持的长期记忆后端 '{backend}'，长期记忆未启用")
+            return None
+        sqlite_config = persistence_config.get("persistence", {}).get("config", {}).get("sqlite", {})
+        db_path = options.get("database_path", DEFAULT_DATABASE_PATH)
+        store = cls(
+            get_connection_manager(db_path, sqlite_config.get("connection_options")),
+            retention_days=options.get("retention_days", DEFAULT_RETENTION_DAYS),
+            search_timeout_ms=options.get("search_timeout_ms", DEFAULT_SEARCH_TIMEOUT_MS),
+            max_search_results=options.get("max_search_results", DEFAULT_MAX_SEARCH_RESULTS),
+            index_fields=options.get("index_fields"),
+        )
+        print(f"🧠 长期记忆: {db_path}, 保留 {store.retention_days or '不限'} 天")
+        return store
+
+    async def setup(self):
+        if self._ready:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.conn = await self.manager.get_connection()
+        async with self.lock:
+            for statement in SCHEMA:
+                await self.conn.execute(statement)
+            await self.conn.commit()
+            await self.conn.set_progress_handler(self._search_expired, SEARCH_PROGRESS_INTERVAL)
+        self._ready = True
+
+    def _search_expired(self) -> bool:
+        """progress handler（在 aiosqlite 线程中调用）：检索语句超过期限时返回 True，SQLite 中止该语句"""
+        deadline = self._search_deadline
+        return deadline is not None and time.monotonic() > deadline
+
+    def batch(self, ops: Iterable[Op]) -> List[Result]:
+        """
+        同步接口（store.get / put / search、同步工具和 graph.invoke 使用）
+
+        与 LangGraph 的异步存储相同：在所属事件循环中执行 abatch 并等待结果，
+        因此不能在该事件循环的线程中调用；所属事件循环不存在或已停止时在临时事件循环中执行
+        """
+        ops = list(ops)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None and running is self.loop:
+            raise asyncio.InvalidStateError(
+                "不能在长期记忆存储所属的事件循环中调用同步接口，请使用 abatch / aget / aput / asearch"
+            )
+        if self.loop is not None and self.loop.is_running():
+            return asyncio.run_coroutine_threadsafe(self.abatch(ops), self.loop).result()
+        return asyncio.run(self.abatch(ops))
+
+    async def abatch(self, ops: Iterable[Op]) -> List[Result]:
+        await self.setup()
+        results: List[Result] = []
+        for op in ops:
+            if isinstance(op, GetOp):
+                results.append(await self._get(op))
+            elif isinstance(op, SearchOp):
+                results.append(await self._search(op))
+            elif isinstance(op, PutOp):
+                results.append(await self._put(op))
+            elif isinstance(op, ListNamespacesOp):
+                results.append(await self._list_namespaces(op))
+            else:
+                raise ValueError(f"未知的存储操作: {op}")
+        return results
+
+    # ---- 写入 ----
+
+    def _search_text(self, value: Dict[str, Any], index) -> str:
+        if index is False:
+            return ""
+        fields = index or self.index_fields
+        if fields:
+            texts = [text for field in fields for text in get_text_at_path(value, field)]
+        else:
+            texts = _string_leaves(value)
+        return " ".join(search_terms(" ".join(texts)))
+
+    async def _put(self, op: PutOp):
+        prefix = ".".join(op.namespace)
+        async with self.lock:
+            if op.value is None:
+                await self.conn.execute("DELETE FROM memory_items WHERE prefix = ? AND key = ?", (prefix, op.key))
+            else:
+                now = time.time()
+                expires_at = now + op.ttl * 60 if op.ttl else None
+                await self.conn.execute(
+                    """
+                    INSERT INTO memory_items (prefix, key, value, search_text, created_at, updated_at, ttl_minutes, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (prefix, key) DO UPDATE SET
+                        value = excluded.value, search_text = excluded.search_text, updated_at = excluded.updated_at,
+                        ttl_minutes = excluded.ttl_minutes, expires_at = excluded.expires_at
+                    """,
+                    (prefix, op.key, json.dumps(op.value, ensure_ascii=False), self._search_text(op.value, op.index),
+                     now, now, op.ttl, expires_at),
+                )
+            await self.conn.commit()
+        self.metrics["puts"] += 1
+
+    async def _refresh(self, rowids: List[int]):
+        """读取时按条目自己的 TTL 续期"""
+        if not rowids:
+            return
+        now = time.time()
+        async with self.lock:
+            await self.conn.executemany(
+                "UPDATE memory_items SET expires_at = ? + ttl_minutes * 60 WHERE rowid = ? AND ttl_minutes IS NOT NULL",
+                [(now, rowid) for rowid in rowids],
+            )
+            await self.conn.commit()
+
+    # ---- 读取 ----
+
+    async def _get(self, op: GetOp) -> Optional[Item]:
+        self.metrics["gets"] += 1
+        async with self.lock:
+            async with self.conn.execute(
+                "SELECT rowid, value, created_at, updated_at FROM memory_items "
+                "WHERE prefix = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (".".join(op.namespace), op.key, time.time()),
+            ) as cur:
+                row = await cur.fetchone()
+        if row is None:
+            return None
+        if op.refresh_ttl:
+            await self._refresh([row[0]])
+        return Item(value=json.loads(row[1]), key=op.key, namespace=op.namespace,
+                    created_at=_timestamp(row[2]), updated_at=_timestamp(row[3]))
+
+    def _filter_sql(self, filter_: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for field, condition in (filter_ or {}).items():
+            path = "$." + _quote(field)
+            conditions = condition if isinstance(condition, dict) else {"$eq": condition}
+            for operator, expected in conditions.items():
+                if operator not in _FILTER_OPERATORS:
+                    raise ValueError(f"不支持的过滤运算符: {operator}")
+                clauses.append(f"json_extract(i.value, ?) {_FILTER_OPERATORS[operator]} ?")
+                params.extend([path, json.dumps(expected) if isinstance(expected, (dict, list)) else expected])
+        return "".join(f" AND {c}" for c in clauses), params
+
+    async def _search(self, op: SearchOp) -> List[SearchItem]:
+        self.metrics["searches"] += 1
+        start = time.perf_counter()
+        try:
+            return await self._run_search(op, time.monotonic() + self.search_timeout)
+        except asyncio.TimeoutError as e:
+            self.metrics["search_timeouts"] += 1
+            print(f"⏱️ 长期记忆检索超过 {self.search_timeout * 1000:.0f} ms，{e}")
+            return []
+        finally:
+            self.metrics["search_seconds"] += time.perf_counter() - start
+
+    async def _run_search(self, op: SearchOp, deadline: float) -> List[SearchItem]:
+        """执行检索；等锁和执行语句共用 deadline，超时时抛出 asyncio.TimeoutError（说明原因）"""
+        prefix = ".".join(op.namespace_prefix)
+        limit = min(op.limit, self.max_search_results)
+        filter_sql, filter_params = self._filter_sql(op.filter)
+        namespace_sql, namespace_params = "", []
+        if prefix:
+            namespace_sql = " AND (i.prefix = ? OR i.prefix LIKE ? ESCAPE '\\')"
+            escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            namespace_params = [prefix, escaped + ".%"]
+
+        terms = list(dict.fromkeys(search_terms(op.query or "")))[:MAX_QUERY_TERMS]
+        if terms:
+            # 命名空间也作为 FTS 列参与匹配，只在当前用户的条目中计算 bm25
+            match = f"search_text : ({' OR '.join(_quote(t) for t in terms)})"
+            if prefix:
+                match = f"prefix : ^{_quote(prefix)} AND {match}"
+            sql = (
+                "SELECT i.rowid, i.prefix, i.key, i.value, i.created_at, i.updated_at, "
+                "bm25(memory_items_fts, 0.0, 1.0) AS rank "
+                "FROM memory_items_fts JOIN memory_items i ON i.rowid = memory_items_fts.rowid "
+                "WHERE memory_items_fts MATCH ? AND (i.expires_at IS NULL OR i.expires_at > ?)"
+                f"{namespace_sql}{filter_sql} ORDER BY rank LIMIT ? OFFSET ?"
+            )
+            params = [match, time.time(), *namespace_params, *filter_params, limit, op.offset]
+        elif op.query:
+            return []
+        else:
+            sql = (
+                "SELECT i.rowid, i.prefix, i.key, i.value, i.created_at, i.updated_at, NULL "
+                "FROM memory_items i WHERE (i.expires_at IS NULL OR i.expires_at > ?)"
+                f"{namespace_sql}{filter_sql} ORDER BY i.updated_at DESC LIMIT ? OFFSET ?"
+            )
+            params = [time.time(), *namespace_params, *filter_params, limit, op.offset]
+
+        try:
+            await asyncio.wait_for(self.lock.acquire(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("等待数据库连接超时，未执行检索") from None
+        # 持有锁期间连接上只有本次检索的语句，期限只对它生效
+        self._search_deadline = deadline
+        try:
+            async with self.conn.execute(sql, params) as cur:
+                rows = await cur.fetchall()
+        except sqlite3.OperationalError as e:
+            if "interrupted" not in str(e):
+                raise
+            raise asyncio.TimeoutError("检索语句已中止") from None
+        finally:
+            self._search_deadline = None
+            self.lock.release()
+        if op.refresh_ttl:
+            await self._refresh([row[0] for row in rows])
+        return [
+            SearchItem(
+                namespace=tuple(row_prefix.split(".")) if row_prefix else (), key=key, value=json.loads(value),
+                created_at=_timestamp(created_at), updated_at=_timestamp(updated_at),
+                # bm25 越小越相关，转换为越大越相关的分数
+                score=-rank if rank is not None else None,
+            )
+            for _, row_prefix, key, value, created_at, updated_at, rank in rows
+        ]
+
+    async def _list_namespaces(self, op: ListNamespacesOp) -> List[Tuple[str, ...]]:
+        async with self.lock:
+            async with self.conn.execute("SELECT DISTINCT prefix FROM memory_items") as cur:
+                namespaces = [tuple(row[0].split(".")) for row in await cur.fetchall()]
+
+        def matches(namespace, condition) -> bool:
+            path = condition.path
+            if len(path) > len(namespace):
+                return False
+            part = namespace[:len(path)] if condition.match_type == "prefix" else namespace[len(namespace) - len(path):]
+            return all(p == "*" or p == n for p, n in zip(path, part))
+
+        namespaces = [ns for ns in namespaces if all(matches(ns, c) for c in op.match_conditions or ())]
+        if op.max_depth is not None:
+            namespaces = [ns[:op.max_depth] for ns in namespaces]
+        return sorted(set(namespaces))[op.offset:op.offset + op.limit]
+
+    # ---- 过期清理 ----
+
+    async def delete_expired_batch(self, batch_size: int) -> int:
+        """删除一批已过期的条目，返回删除行数"""
+        await self.setup()
+        async with self.lock:
+            cur = await self.conn.execute(
+                "DELETE FROM memory_items WHERE rowid IN "
+                "(SELECT rowid FROM memory_items WHERE expires_at IS NOT NULL AND expires_at <= ? LIMIT ?)",
+                (time.time(), batch_size),
+            )
+            await self.conn.commit()
+            return cur.rowcount
+
+    def print_metrics(self):
+        m = self.metrics
+        average = m["search_seconds"] / m["searches"] * 1000 if m["searches"] else 0.0
+        print(f"📊 长期记忆: 写入 {m['puts']} 次, 读取 {m['gets']} 次, 检索 {m['searches']} 次 "
+              f"(平均 {average:.1f} ms, 超时 {m['search_timeouts']} 次)")
+
+    async def aclose(self):
+        self.print_metrics()
+        await self.manager.aclose()
+
+
+class MemoryExpiry:
+    """按 retention_days 分批删除过期长期记忆的后台任务"""
+
+    def __init__(self, store: SQLiteMemoryStore, interval_minutes: float = DEFAULT_EXPIRY_INTERVAL_MINUTES,
+                 batch_size: int = DEFAULT_EXPIRY_BATCH_SIZE,
+                 batch_pause_seconds: float = DEFAULT_EXPIRY_BATCH_PAUSE_SECONDS):
+        self.store = store
+        self.interval_seconds = float(interval_minutes) * 60
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_pause_seconds = float(batch_pause_seconds)
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, store, persistence_config: Dict[str, Any]) -> Optional["MemoryExpiry"]:
+        """存储未启用或没有配置保留天数时返回 None"""
+        if store is None or not getattr(store, "retention_days", None):
+            return None
+        options = persistence_config.get("memory_settings", {}).get("long_term_memory", {})
+        return cls(
+            store,
+            interval_minutes=options.get("expiry_interval_minutes", DEFAULT_EXPIRY_INTERVAL_MINUTES),
+            batch_size=options.get("expiry_batch_size", DEFAULT_EXPIRY_BATCH_SIZE),
+            batch_pause_seconds=options.get("expiry_batch_pause_seconds", DEFAULT_EXPIRY_BATCH_PAUSE_SECONDS),
+        )
+
+    async def run_once(self) -> Dict[str, Any]:
+        """删除所有已过期条目，每批单独提交，批次之间让出事件循环"""
+        start = time.perf_counter()
+        deleted = batches = 0
+        while True:
+            count = await self.store.delete_expired_batch(self.batch_size)
+            deleted += count
+            batches += 1
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause_seconds)
+        self.last_report = {"deleted": deleted, "batches": batches, "seconds": time.perf_counter() - start}
+        if deleted:
+            print(f"🧹 长期记忆过期清理: 删除 {deleted} 条 ({batches} 批, {self.last_report['seconds']:.2f}s)")
+        return self.last_report
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ 长期记忆过期清理失败: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def _user_namespace() -> Tuple[str, str]:
+    """当前调用所属用户的记忆命名空间，user_id 来自 config["configurable"]"""
+    user_id = get_config().get("configurable", {}).get("user_id") or DEFAULT_MEMORY_USER
+    return MEMORY_NAMESPACE, str(user_id)
+
+
+@tool
+async def remember(fact: str, topic: str = "") -> str:
+    """保存一条关于用户的长期记忆（偏好、个人信息、约定等），以后在任何会话中都可以用 recall 找回。
+    fact 用一句完整的话描述要记住的内容，topic 是可选的简短主题。"""
+    key = uuid.uuid4().hex
+    await get_store().aput(_user_namespace(), key, {"text": fact, "topic": topic})
+    return f"已记住: {fact}"
+
+
+@tool
+async def recall(query: str, limit: int = DEFAULT_RECALL_LIMIT) -> str:
+    """按关键词检索当前用户在以往会话中保存的长期记忆，返回最相关的几条。"""
+    items = await get_store().asearch(_user_namespace(), query=query, limit=limit)
+    if not items:
+        return "没有找到相关的长期记忆"
+    return "\n".join(f"- {item.value.get('text', item.value)} ({item.updated_at:%Y-%m-%d})" for item in items)
+
+
+def memory_tools() -> List[BaseTool]:
+    """供模型调用的长期记忆工具"""
+    return [remember, recall]
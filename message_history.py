@@ -0,0 +1,66 @@
+# message_history.py
+"""
+分页读取会话消息
+
+app.aget_state 会还原最新检查点的全部通道值和消息，CLI 查看历史时却只显示末尾几条。
+get_message_page 从会话末尾按页读取：offset 为跳过的最新消息数，返回的 next_offset 作为
+查看更早一页的游标。
+
+存储器提供 aget_message_page(config, limit, offset) 时直接调用，只读取需要的消息：
+- CompactSqliteSaver 只解析最新检查点中的消息引用，再按哈希读取这一页的消息；
+- TunedAsyncSqliteSaver 只读取最新检查点一行，不读取 writes，解析时只构造这一页的消息对象；
+- WriteBackCheckpointSaver 命中缓存时直接切片内存中的消息列表。
+其他存储器回退到 aget_tuple 后切片。
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+MESSAGES_CHANNEL = "messages"
+
+DEFAULT_PAGE_SIZE = 10
+
+
+def page_bounds(total: int, limit: int, offset: int = 0) -> Tuple[int, int]:
+    """末尾分页在完整消息列表中的 [start, end) 区间"""
+    end = max(total - max(offset, 0), 0)
+    return max(end - max(limit, 0), 0), end
+
+
+def slice_page(messages: Any, limit: int, offset: int = 0) -> Tuple[List[Any], int]:
+    """从完整消息列表中取一页，返回 (消息, 消息总数)"""
+    messages = messages if isinstance(messages, list) else []
+    start, end = page_bounds(len(messages), limit, offset)
+    return messages[start:end], len(messages)
+
+
+async def get_message_page(checkpointer, config: Dict[str, Any],
+                           page_size: int = DEFAULT_PAGE_SIZE, offset: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    读取会话末尾的一页消息，会话不存在时返回 None
+
+    返回 {"messages", "total", "start", "next_offset"}：messages 按时间顺序排列，
+    start 为第一条消息在整个会话中的序号（从 0 开始），没有更早的消息时 next_offset 为 None。
+    """
+    reader = getattr(checkpointer, "aget_message_page", None)
+    if reader is not None:
+        result = await reader(config, page_size, offset)
+    else:
+        checkpoint_tuple = await checkpointer.aget_tuple(config)
+        result = None if checkpoint_tuple is None else slice_page(
+            checkpoint_tuple.checkpoint["channel_values"].get(MESSAGES_CHANNEL), page_size, offset)
+    if result is None:
+        return None
+    messages, total = result
+    start, _ = page_bounds(total, page_size, offset)
+    return {
+        "messages": messages,
+        "total": total,
+        "start": start,
+        "next_offset": offset + len(messages) if start > 0 else None,
+    }
+
+
+async def message_count(checkpointer, config: Dict[str, Any]) -> Optional[int]:
+    """会话最新检查点中的消息数，没有检查点时返回 None（空页只解析检查点，不还原消息）"""
+    page = await get_message_page(checkpointer, config, 0)
+    return None if page is None else page["total"]
@@ -8,8 +8,8 @@ import requests
 from typing import List, Dict, Any, Optional, AsyncIterator
 from langchain_core.language_models.llms import LLM
 from langchain_core.language_models.chat_models import BaseChatModel
-from langchain_core.messages import BaseMessage, AIMessage, HumanMessage
-from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.messages import BaseMessage, AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
 from langchain_core.callbacks.manager import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
 import asyncio
 import aiohttp
@@ -103,6 +103,14 @@ class OllamaChatModel(BaseChatModel):
     def _llm_type(self) -> str:
         return "ollama-chat"
     
+    def _build_prompt(self, messages: List[BaseMessage]) -> str:
+        """构建提示，如果有绑定的工具，添加工具信息到提示中"""
+        prompt = self._messages_to_prompt(messages)
+        if self.bound_tools:
+            tools_info = self._format_tools_for_prompt(self.bound_tools)
+            prompt = f"{tools_info}\n\n{prompt}"
+        return prompt
+
     def _generate(
         self,
         messages: List[BaseMessage],
@@ -110,15 +118,27 @@ class OllamaChatModel(BaseChatModel):
         run_manager: Optional[CallbackManagerForLLMRun] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        """生成聊天回复 - 使用异步方法的同步包装"""
-        # 使用异步方法的同步包装
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        """同步生成聊天回复 - 直接使用同步 HTTP 请求，不再创建新的事件循环"""
+        prompt = self._build_prompt(messages)
+
         try:
-            result = loop.run_until_complete(self._agenerate(messages, stop, run_manager, **kwargs))
-            return result
-        finally:
-            loop.close()
+            response = requests.post(
+                f"{self.api_url}/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": {
+                        "temperature": self.temperature
+                    }
+                },
+                timeout=60
+            )
+            response.raise_for_status()
+            content = response.json().get("response", "")
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+        except Exception as e:
+            raise Exception(f"Ollama API 调用失败: {e}")
     
     async def _agenerate(
         self,
@@ -128,12 +148,7 @@ class OllamaChatModel(BaseChatModel):
         **kwargs: Any,
     ) -> ChatResult:
         """异步生成聊天回复"""
-        prompt = self._messages_to_prompt(messages)
-
-        # 如果有绑定的工具，添加工具信息到提示中
-        if self.bound_tools:
-            tools_info = self._format_tools_for_prompt(self.bound_tools)
-            prompt = f"{tools_info}\n\n{prompt}"
+        prompt = self._build_prompt(messages)
 
         try:
             async with aiohttp.ClientSession() as session:
@@ -167,9 +182,9 @@ class OllamaChatModel(BaseChatModel):
         stop: Optional[List[str]] = None,
         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
         **kwargs: Any,
-    ) -> AsyncIterator[ChatGeneration]:
-        """异步流式生成"""
-        prompt = self._messages_to_prompt(messages)
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """异步流式生成 - 每个 token 产出一个消息块，回调由 BaseChatModel.astream 统一触发"""
+        prompt = self._build_prompt(messages)
         
         try:
             async with aiohttp.ClientSession() as session:
@@ -194,12 +209,8 @@ class OllamaChatModel(BaseChatModel):
                                 if 'response' in data:
                                     content = data['response']
                                     if content:
-                                        message = AIMessage(content=content)
-                                        yield ChatGeneration(message=message)
-                                        
-                                        if run_manager:
-                                            await run_manager.on_llm_new_token(content)
-                                            
+                                        yield ChatGenerationChunk(message=AIMessageChunk(content=content))
+
                                 if data.get('done', False):
                                     break
                             except json.JSONDecodeError:
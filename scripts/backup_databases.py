@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+数据库在线备份脚本
+按 persistence_config.json 的 backup_settings 立即执行一次在线备份并轮换旧备份，
+应用运行期间也可以执行，不会阻塞写入
+
+用法: python scripts/backup_databases.py [备份目录]
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from database_backup import DEFAULT_BACKUP_LOCATION, DatabaseBackup, default_backup_databases
+
+
+async def main():
+    with open(PROJECT_ROOT / "config" / "persistence_config.json", "r", encoding="utf-8") as f:
+        persistence_config = json.load(f)
+    options = persistence_config.get("backup_settings", {})
+    backup = DatabaseBackup(
+        options.get("databases") or default_backup_databases(persistence_config),
+        backup_location=sys.argv[1] if len(sys.argv) > 1 else options.get("backup_location", DEFAULT_BACKUP_LOCATION),
+        max_backup_files=options.get("max_backup_files", 7),
+        pages_per_step=options.get("pages_per_step", 64),
+        step_sleep_seconds=options.get("step_sleep_seconds", 0.005),
+        max_restarts=options.get("max_restarts", 3),
+    )
+    print("💾 数据库在线备份")
+    print("=" * 50)
+    report = await backup.run_once()
+    backup.print_report(report)
+    if report["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
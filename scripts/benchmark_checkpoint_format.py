@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+检查点格式对比测试
+用同一段多轮对话分别写入原始格式、仅压缩、压缩 + 消息去重三种存储器，
+比较数据库大小、写入耗时和读取最新状态的延迟，并校验读回的 MessagesState 完全一致
+
+用法: python scripts/benchmark_checkpoint_format.py [轮数]
+"""
+
+import asyncio
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import END, StateGraph
+
+from checkpoint_serde import CompactSqliteSaver
+from main import AgentState
+from sqlite_checkpointer import TunedAsyncSqliteSaver, get_connection_manager
+
+READ_SAMPLES = 50
+THREAD_ID = "format-bench"
+VOCABULARY = ("模型", "检查点", "数据库", "会话", "工具", "搜索", "结果", "用户", "问题", "回答", "延迟", "配置",
+              "langgraph", "sqlite", "agent", "token", "2024", "3.14", "https://example.com", "、", "，", "。")
+
+
+def text(seed: str, words: int) -> str:
+    """生成不重复的伪随机文本，避免重复内容让压缩率虚高"""
+    rng = random.Random(seed)
+    return "".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def build_app(checkpointer):
+    """每轮: 模型发起一次工具调用 -> 工具返回 -> 模型回答，与真实 Agent 的检查点节奏一致"""
+    def agent(state: AgentState):
+        turn = len(state["messages"])
+        if isinstance(state["messages"][-1], HumanMessage):
+            return {"messages": [AIMessage(id=f"ai_{turn}", content="", tool_calls=[
+                {"name": "tavily-search", "args": {"query": f"问题 {turn}"}, "id": f"call_{turn}"}
+            ])]}
+        return {"messages": [AIMessage(id=f"ai_{turn}", content=text(f"ai_{turn}", 200))]}
+
+    def tools(state: AgentState):
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": [ToolMessage(id=f"tool_{call['id']}", content=text(call["id"], 800),
+                                         tool_call_id=call["id"], name=call["name"])]}
+
+    def route(state: AgentState):
+        return "tools" if state["messages"][-1].tool_calls else END
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("agent", agent)
+    workflow.add_node("tools", tools)
+    workflow.set_entry_point("agent")
+    workflow.add_conditional_edges("agent", route, ["tools", END])
+    workflow.add_edge("tools", "agent")
+    return workflow.compile(checkpointer=checkpointer)
+
+
+async def run_variant(label: str, saver_cls, saver_kwargs, db_path: str, turns: int):
+    manager = get_connection_manager(db_path)
+    saver = await saver_cls.from_manager(manager, **saver_kwargs)
+    app = build_app(saver)
+    config = {"configurable": {"thread_id": THREAD_ID}}
+
+    start = time.perf_counter()
+    for turn in range(turns):
+        # 固定消息 id，三种格式读回的消息才可以直接比较
+        question = HumanMessage(id=f"human_{turn}", content=text(f"human_{turn}", 40))
+        await app.ainvoke({"messages": [question]}, config)
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(READ_SAMPLES):
+        state = await app.aget_state(config)
+    read_ms = (time.perf_counter() - start) / READ_SAMPLES * 1000
+
+    async with saver.lock:
+        await saver.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    await manager.aclose()
+    size = Path(db_path).stat().st_size
+    return {"label": label, "size": size, "write": write_seconds, "read_ms": read_ms,
+            "messages": state.values["messages"]}
+
+
+async def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"📦 检查点格式对比 ({turns} 轮对话, 每轮 4 条消息)")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="checkpoint_format_")
+    variants = [
+        ("原始格式", TunedAsyncSqliteSaver, {}),
+        ("仅压缩", CompactSqliteSaver, {"deduplicate_messages": False}),
+        ("压缩 + 消息去重", CompactSqliteSaver, {"deduplicate_messages": True}),
+    ]
+    try:
+        results = []
+        for index, (label, saver_cls, kwargs) in enumerate(variants):
+            results.append(await run_variant(label, saver_cls, kwargs, f"{directory}/variant_{index}.db", turns))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = results[0]
+    print()
+    for r in results:
+        print(f"  {r['label']:<12} 大小 {r['size'] / 1024 / 1024:8.2f} MB ({r['size'] / baseline['size'] * 100:5.1f}%)  "
+              f"写入 {r['write']:6.2f}s  读取最新状态 {r['read_ms']:6.2f} ms")
+
+    identical = all(r["messages"] == baseline["messages"] for r in results[1:])
+    print(f"\n{'✅' if identical else '❌'} 读回的消息列表{'完全一致' if identical else '不一致'} "
+          f"({len(baseline['messages'])} 条消息)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+检查点分片写入吞吐基准测试
+用不同的分片数量并发写入检查点，比较每秒写入的检查点数
+
+用法: python scripts/benchmark_checkpoint_shards.py [线程数] [每线程写入次数] [synchronous]
+"""
+
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+
+from sharded_checkpointer import ShardedSqliteSaver
+from sqlite_checkpointer import close_all_connection_managers
+
+SHARD_COUNTS = (1, 2, 4, 8)
+
+
+async def write_thread(saver: ShardedSqliteSaver, thread_id: str, writes: int):
+    """模拟一个会话：每次写入一个包含完整消息列表的检查点及其 writes"""
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    messages = []
+    for step in range(writes):
+        messages = messages + [HumanMessage(content=f"问题 {step} " * 20), AIMessage(content=f"回答 {step} " * 60)]
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"messages": messages}
+        checkpoint["channel_versions"] = {"messages": saver.get_next_version(None, None)}
+        config = await saver.aput(config, checkpoint, {"source": "loop", "step": step}, {})
+        await saver.aput_writes(config, [("messages", messages[-1])], task_id=f"task-{step}")
+
+
+async def run(shard_count: int, threads: int, writes: int, synchronous: str, directory: str) -> float:
+    saver = await ShardedSqliteSaver.from_config(
+        {"shard_count": shard_count, "shard_directory": f"{directory}/shards_{shard_count}"},
+        {"synchronous": synchronous},
+    )
+    await saver.setup()
+    start = time.perf_counter()
+    await asyncio.gather(*(write_thread(saver, f"bench-{i}", writes) for i in range(threads)))
+    elapsed = time.perf_counter() - start
+    await close_all_connection_managers()
+    return elapsed
+
+
+async def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    writes = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    synchronous = sys.argv[3] if len(sys.argv) > 3 else "FULL"
+    total = threads * writes
+
+    print(f"⏱️ 检查点分片写入基准 ({threads} 个线程 × {writes} 次写入, synchronous={synchronous})")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="checkpoint_shards_")
+    try:
+        baseline = None
+        for shard_count in SHARD_COUNTS:
+            elapsed = await run(shard_count, threads, writes, synchronous, directory)
+            throughput = total / elapsed
+            baseline = baseline or throughput
+            print(f"  {shard_count} 个分片: {elapsed:6.2f}s, {throughput:8.1f} 检查点/s ({throughput / baseline:.2f}x)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+并发会话基准测试
+用一个模拟延迟的聊天模型驱动真实的 Agent 工作流，验证 N 个并发会话不会被串行化，
+并检查 stream_mode="messages" 是否在 token 生成时即可收到
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Any, List, Optional
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, StateGraph
+
+from main import AgentState, compile_workflow
+
+
+class SimulatedChatModel(BaseChatModel):
+    """模拟网络延迟的聊天模型：同步接口阻塞线程，异步接口逐 token 让出事件循环"""
+
+    latency: float = 1.0
+    tokens: int = 10
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        content = "".join(f"t{i} " for i in range(self.tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        for i in range(self.tokens):
+            await asyncio.sleep(self.latency / self.tokens)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"t{i} "))
+
+
+class _NoTools:
+    """不带工具的注册表占位"""
+    tools: List[Any] = []
+    version = 0
+
+    def server_of(self, tool_name: str):
+        return None
+
+
+def build_legacy_workflow(llm):
+    """旧实现：同步节点内调用 llm.invoke"""
+    def call_model(state: AgentState):
+        return {"messages": [llm.invoke(state["messages"])]}
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("agent", call_model)
+    workflow.set_entry_point("agent")
+    workflow.add_edge("agent", END)
+    return workflow.compile(checkpointer=MemorySaver())
+
+
+async def run_session(app, index: int, started: float):
+    """运行一个会话，返回 (首 token 时间, 完成时间)"""
+    config = {"configurable": {"thread_id": f"bench_{index}"}}
+    first_token: Optional[float] = None
+    async for msg, metadata in app.astream(
+        {"messages": [HumanMessage(content=f"会话 {index}")]},
+        config=config,
+        stream_mode="messages",
+    ):
+        if first_token is None and getattr(msg, "content", None) and not isinstance(msg, HumanMessage):
+            first_token = time.perf_counter() - started
+    return first_token, time.perf_counter() - started
+
+
+async def run_benchmark(label: str, app, sessions: int, latency: float):
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_session(app, i, started) for i in range(sessions)))
+    wall = time.perf_counter() - started
+    first_tokens = [r[0] for r in results if r[0] is not None]
+
+    print(f"\n📊 {label}")
+    print(f"   总耗时: {wall:.2f}s (串行执行约需 {sessions * latency:.2f}s)")
+    if first_tokens:
+        print(f"   首 token 延迟: 最小 {min(first_tokens):.2f}s, 最大 {max(first_tokens):.2f}s")
+    print(f"   并发度: {sessions * latency / wall:.1f}x")
+    return wall
+
+
+async def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    print(f"⏱️ 并发会话基准测试 ({sessions} 个会话, 每次模型调用 {latency:.1f}s)")
+    print("=" * 50)
+
+    llm = SimulatedChatModel(latency=latency)
+    await run_benchmark("旧实现: 同步节点 + invoke", build_legacy_workflow(llm), sessions, latency)
+    await run_benchmark("新实现: 异步节点 + astream", compile_workflow(llm, _NoTools(), MemorySaver()),
+                        sessions, latency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Chainlit 数据层连接开销对比测试
+同一个数据库分别用"每次调用新开连接"（连接池引入前的做法）和进程级连接池执行
+SQLiteDataLayer 的常用方法，比较每次调用的延迟、并发调用的吞吐和创建数据层实例的耗时；
+另外在一个有 PAGING_THREADS 个线程的用户上比较 list_threads 首页和深页的耗时
+（游标分页与原先的 COUNT + OFFSET 分页），以及默认线程池被其他阻塞任务占满时
+数据库调用在默认线程池和连接池专用线程池中的延迟
+
+用法: python scripts/benchmark_data_layer.py [每项调用次数] [并发数]
+"""
+
+import asyncio
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import logging
+
+from sqlite_connection_pool import close_all_connection_pools
+from sqlite_data_layer import SQLiteDataLayer
+
+THREADS = 200
+STEPS_PER_THREAD = 20
+PAGING_THREADS = 20000
+PAGE_SIZE = 20
+
+# 游标分页引入前 list_threads 的查询：每页先统计总数，再按偏移读取
+OFFSET_PAGE_QUERIES = (
+    "SELECT COUNT(*) FROM threads WHERE archived = 0 AND userId = ?",
+    "SELECT * FROM threads WHERE archived = 0 AND userId = ? ORDER BY createdAt DESC LIMIT ? OFFSET ?",
+)
+
+
+class PerCallConnections:
+    """与连接池相同的接口，但每次调用新开连接、用完关闭，并在事件循环的默认线程池中执行（连接池引入前的行为）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def acquire(self, write: bool = False) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path)
+
+    def release(self, conn: sqlite3.Connection):
+        conn.close()
+
+
+def seed(layer: SQLiteDataLayer, user_id: str):
+    """写入 THREADS 个线程，每个线程 STEPS_PER_THREAD 个步骤"""
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    with layer.pool.connection(write=True) as conn:
+        conn.execute("INSERT INTO users (id, identifier, metadata, createdAt) VALUES (?, 'bench', '{}', ?)",
+                     (user_id, start.isoformat()))
+        for t in range(THREADS):
+            thread_id = f"thread_{t:04d}"
+            created = (start + timedelta(minutes=t)).isoformat()
+            conn.execute("INSERT INTO threads (id, createdAt, name, userId, userIdentifier, tags, metadata, lastActiveAt) "
+                         "VALUES (?, ?, ?, ?, 'bench', '[]', '{}', ?)", (thread_id, created, f"会话 {t}", user_id, created))
+            conn.executemany(
+                "INSERT INTO steps (id, name, type, threadId, streaming, output, createdAt, metadata, tags) "
+                "VALUES (?, 'bench', ?, ?, 0, ?, ?, '{}', '[]')",
+                [(str(uuid.uuid4()), "user_message" if s % 2 == 0 else "assistant_message", thread_id,
+                  "内容 " * 40, (start + timedelta(minutes=t, seconds=s)).isoformat()) for s in range(STEPS_PER_THREAD)],
+            )
+        conn.commit()
+
+
+def new_step(thread_id: str) -> dict:
+    return {"id": str(uuid.uuid4()), "name": "bench", "type": "user_message", "threadId": thread_id,
+            "output": "新消息", "createdAt": datetime.now(timezone.utc).isoformat(), "metadata": {}, "tags": []}
+
+
+def operations(layer: SQLiteDataLayer, user_id: str):
+    from chainlit.types import Pagination, ThreadFilter
+    return {
+        "get_user": lambda i: layer.get_user("bench"),
+        "get_thread_author": lambda i: layer.get_thread_author(f"thread_{i % THREADS:04d}"),
+        "get_thread": lambda i: layer.get_thread(f"thread_{i % THREADS:04d}"),
+        "list_threads": lambda i: layer.list_threads(Pagination(first=20), ThreadFilter(userId=user_id)),
+        "create_step": lambda i: layer.create_step(new_step(f"thread_{i % THREADS:04d}")),
+    }
+
+
+async def measure(layer: SQLiteDataLayer, user_id: str, calls: int, concurrency: int) -> dict:
+    results = {}
+    for name, op in operations(layer, user_id).items():
+        await op(0)  # 预热
+        samples = []
+        for i in range(calls):
+            start = time.perf_counter()
+            await op(i)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = (statistics.median(samples), sorted(samples)[int(len(samples) * 0.95) - 1])
+
+    # 读写混合的并发调用：一半 get_thread，一半 create_step
+    ops = operations(layer, user_id)
+    start = time.perf_counter()
+    for batch in range(0, calls, concurrency):
+        await asyncio.gather(*(
+            ops["get_thread" if i % 2 == 0 else "create_step"](i)
+            for i in range(batch, min(batch + concurrency, calls))
+        ))
+    results["mixed_ops_per_s"] = calls / (time.perf_counter() - start)
+    return results
+
+
+async def measure_paging(layer: SQLiteDataLayer, db_path: str) -> dict:
+    """逐页遍历一个线程很多的用户，记录首页、中间页和最后一页的耗时"""
+    from chainlit.types import Pagination, ThreadFilter
+    user_id = str(uuid.uuid4())
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    with layer.pool.connection(write=True) as conn:
+        conn.executemany(
+            "INSERT INTO threads (id, createdAt, name, userId, userIdentifier, tags, metadata, lastActiveAt) "
+            "VALUES (?, ?, '分页', ?, 'bench', '[]', '{}', ?)",
+            [(f"page_{t:05d}", (start + timedelta(seconds=t)).isoformat(), user_id,
+              (start + timedelta(seconds=t)).isoformat()) for t in range(PAGING_THREADS)],
+        )
+        conn.commit()
+
+    keyset_ms, cursor = [], None
+    while True:
+        t0 = time.perf_counter()
+        page = await layer.list_threads(Pagination(first=PAGE_SIZE, cursor=cursor), ThreadFilter(userId=user_id))
+        keyset_ms.append((time.perf_counter() - t0) * 1000)
+        if not page.pageInfo.hasNextPage:
+            break
+        cursor = page.pageInfo.endCursor
+
+    offset_ms = []
+    with sqlite3.connect(db_path) as conn:
+        count_sql, page_sql = OFFSET_PAGE_QUERIES
+        for offset in range(0, PAGING_THREADS, PAGE_SIZE):
+            t0 = time.perf_counter()
+            conn.execute(count_sql, (user_id,)).fetchone()
+            conn.execute(page_sql, (user_id, PAGE_SIZE, offset)).fetchall()
+            offset_ms.append((time.perf_counter() - t0) * 1000)
+
+    def positions(samples):
+        return samples[0], samples[len(samples) // 2], samples[-1]
+
+    return {"pages": len(keyset_ms), "keyset": positions(keyset_ms), "offset": positions(offset_ms),
+            "keyset_total": sum(keyset_ms), "offset_total": sum(offset_ms)}
+
+
+async def measure_executor_isolation(layer: SQLiteDataLayer, db_path: str, blockers: int = 64,
+                                     block_seconds: float = 0.2) -> tuple:
+    """默认线程池被 blockers 个阻塞任务占满时 get_thread 的延迟：默认线程池与专用线程池"""
+    loop = asyncio.get_running_loop()
+
+    async def timed_get_thread(target) -> float:
+        background = [loop.run_in_executor(None, time.sleep, block_seconds) for _ in range(blockers)]
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        await target.get_thread("thread_0000")
+        elapsed = (time.perf_counter() - start) * 1000
+        await asyncio.gather(*background)
+        return elapsed
+
+    dedicated_ms = await timed_get_thread(layer)
+    layer.pool, pool = PerCallConnections(db_path), layer.pool
+    default_ms = await timed_get_thread(layer)
+    layer.pool = pool
+    return default_ms, dedicated_ms
+
+
+def measure_construction(db_path: str, samples: int = 20) -> tuple:
+    """创建数据层实例的耗时：每次都建表（原行为）与连接池初始化后（只执行一次）"""
+    schema_ms = []
+    layer = SQLiteDataLayer(db_path)
+    for _ in range(samples):
+        start = time.perf_counter()
+        conn = sqlite3.connect(db_path)
+        layer._create_schema(conn)
+        conn.commit()
+        conn.close()
+        schema_ms.append((time.perf_counter() - start) * 1000)
+    pooled_ms = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        SQLiteDataLayer(db_path)
+        pooled_ms.append((time.perf_counter() - start) * 1000)
+    return statistics.median(schema_ms), statistics.median(pooled_ms)
+
+
+async def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    # 数据层在 DEBUG 级别记录每次调用，计时时关闭
+    logging.disable(logging.INFO)
+
+    work_dir = tempfile.mkdtemp(prefix="bench_data_layer_")
+    try:
+        db_path = str(Path(work_dir) / "chainlit_history.db")
+        user_id = str(uuid.uuid4())
+        layer = SQLiteDataLayer(db_path)
+        seed(layer, user_id)
+        print(f"🧪 数据库: {THREADS} 个线程 × {STEPS_PER_THREAD} 个步骤，每项 {calls} 次调用，并发 {concurrency}")
+
+        pooled = await measure(layer, user_id, calls, concurrency)
+        layer.pool, pool = PerCallConnections(db_path), layer.pool
+        per_call = await measure(layer, user_id, calls, concurrency)
+        layer.pool = pool
+
+        print(f"\n{'操作':<20}{'每次新开连接 p50/p95':>24}{'连接池 p50/p95':>22}{'提升':>10}")
+        for name in operations(layer, user_id):
+            (b50, b95), (a50, a95) = per_call[name], pooled[name]
+            print(f"{name:<20}{b50:>12.3f} / {b95:>7.3f} ms{a50:>10.3f} / {a95:>7.3f} ms{b50 / a50:>9.1f}x")
+        print(f"{'读写混合吞吐':<18}{per_call['mixed_ops_per_s']:>20.0f} 次/s{pooled['mixed_ops_per_s']:>18.0f} 次/s"
+              f"{pooled['mixed_ops_per_s'] / per_call['mixed_ops_per_s']:>9.1f}x")
+
+        schema_ms, pooled_ms = measure_construction(db_path)
+        print(f"\n🏗️ 创建数据层实例: 每次建表 {schema_ms:.3f} ms → 连接池已初始化 {pooled_ms:.3f} ms")
+
+        default_ms, dedicated_ms = await measure_executor_isolation(layer, db_path)
+        print(f"\n🧵 默认线程池被阻塞任务占满时 get_thread: 默认线程池 {default_ms:.1f} ms → 专用线程池 {dedicated_ms:.1f} ms")
+
+        paging = await measure_paging(layer, db_path)
+        print(f"\n📄 list_threads 逐页遍历 {PAGING_THREADS} 个线程（每页 {PAGE_SIZE} 个，共 {paging['pages']} 页）")
+        print(f"{'':<16}{'首页':>10}{'中间页':>12}{'最后一页':>12}{'全部页':>12}")
+        for label, key in (("COUNT + OFFSET", "offset"), ("游标分页", "keyset")):
+            first, middle, last = paging[key]
+            print(f"{label:<16}{first:>8.3f} ms{middle:>9.3f} ms{last:>9.3f} ms{paging[key + '_total']:>9.0f} ms")
+        print()
+        close_all_connection_pools()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+会话启动延迟基准测试
+对比每个会话调用 initialize_agent() 与使用进程级共享运行时的启动耗时
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+
+async def measure_per_session_init(sessions: int):
+    """旧方式：每个会话都完整初始化一次 Agent"""
+    from main import initialize_agent
+
+    timings = []
+    for _ in range(sessions):
+        start = time.perf_counter()
+        app, _, _ = await initialize_agent()
+        timings.append(time.perf_counter() - start)
+        conn = getattr(app.checkpointer, "conn", None)
+        if conn is not None:
+            await conn.close()
+    return timings
+
+
+async def measure_shared_runtime(sessions: int):
+    """新方式：所有会话共享同一个运行时"""
+    from agent_runtime import get_agent_runtime, shutdown_agent_runtime
+
+    timings = []
+    for _ in range(sessions):
+        start = time.perf_counter()
+        runtime = await get_agent_runtime()
+        runtime.new_session_manager()
+        timings.append(time.perf_counter() - start)
+    await shutdown_agent_runtime()
+    return timings
+
+
+def print_timings(label: str, timings):
+    print(f"\n📊 {label}")
+    print(f"   首个会话: {timings[0] * 1000:.1f} ms")
+    if len(timings) > 1:
+        rest = timings[1:]
+        print(f"   后续会话平均: {statistics.mean(rest) * 1000:.1f} ms")
+        print(f"   后续会话最大: {max(rest) * 1000:.1f} ms")
+    print(f"   总耗时: {sum(timings):.2f} s")
+
+
+async def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    os.chdir(PROJECT_ROOT)
+
+    print(f"⏱️ 会话启动延迟基准测试 ({sessions} 个会话)")
+    print("=" * 50)
+
+    old_timings = await measure_per_session_init(sessions)
+    new_timings = await measure_shared_runtime(sessions)
+
+    print_timings("每会话 initialize_agent()", old_timings)
+    print_timings("共享 AgentRuntime", new_timings)
+
+    if len(new_timings) > 1:
+        old_avg = statistics.mean(old_timings[1:])
+        new_avg = max(statistics.mean(new_timings[1:]), 1e-6)
+        print(f"\n🚀 后续会话启动延迟降低: {old_avg * 1000:.1f} ms -> {new_avg * 1000:.3f} ms "
+              f"({old_avg / new_avg:.0f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+检查点写回缓存对比测试
+同样的多轮对话分别直接写入 SQLite 存储器和经过 WriteBackCheckpointSaver 写入，
+模型调用用固定延迟模拟，比较每轮延迟、读取最新状态的延迟，并校验重启后读回的状态完全一致
+
+用法: python scripts/benchmark_write_back_cache.py [轮数] [线程数] [模型延迟毫秒]
+"""
+
+import asyncio
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / "scripts"))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import END, StateGraph
+
+from benchmark_checkpoint_format import text
+from checkpoint_serde import CompactSqliteSaver
+from main import AgentState
+from sqlite_checkpointer import get_connection_manager
+from write_back_checkpointer import WriteBackCheckpointSaver
+
+READ_SAMPLES = 50
+
+
+def build_app(checkpointer, llm_latency: float):
+    """与 benchmark_checkpoint_format 相同的图，模型节点等待 llm_latency 秒"""
+    async def agent(state: AgentState):
+        await asyncio.sleep(llm_latency)
+        turn = len(state["messages"])
+        if isinstance(state["messages"][-1], HumanMessage):
+            return {"messages": [AIMessage(id=f"ai_{turn}", content="", tool_calls=[
+                {"name": "tavily-search", "args": {"query": f"问题 {turn}"}, "id": f"call_{turn}"}
+            ])]}
+        return {"messages": [AIMessage(id=f"ai_{turn}", content=text(f"ai_{turn}", 200))]}
+
+    def tools(state: AgentState):
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": [ToolMessage(id=f"tool_{call['id']}", content=text(call["id"], 800),
+                                         tool_call_id=call["id"], name=call["name"])]}
+
+    def route(state: AgentState):
+        return "tools" if state["messages"][-1].tool_calls else END
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("agent", agent)
+    workflow.add_node("tools", tools)
+    workflow.set_entry_point("agent")
+    workflow.add_conditional_edges("agent", route, ["tools", END])
+    workflow.add_edge("tools", "agent")
+    return workflow.compile(checkpointer=checkpointer)
+
+
+async def run_variant(label: str, db_path: str, write_back: bool, turns: int, threads: int, llm_latency: float):
+    inner = await CompactSqliteSaver.from_manager(get_connection_manager(db_path))
+    saver = WriteBackCheckpointSaver(inner) if write_back else inner
+    app = build_app(saver, llm_latency)
+    configs = [{"configurable": {"thread_id": f"thread_{t}"}} for t in range(threads)]
+
+    async def conversation(config):
+        latencies = []
+        for turn in range(turns):
+            question = HumanMessage(id=f"human_{turn}", content=text(f"human_{turn}", 40))
+            start = time.perf_counter()
+            await app.ainvoke({"messages": [question]}, config)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    # 多个会话并发进行，与 Chainlit 中多个用户同时对话一致
+    start = time.perf_counter()
+    latencies = [x for items in await asyncio.gather(*(conversation(c) for c in configs)) for x in items]
+    total = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(READ_SAMPLES):
+        await app.aget_state(configs[0])
+    read_ms = (time.perf_counter() - start) / READ_SAMPLES * 1000
+
+    states = [(await app.aget_state(c)).values["messages"] for c in configs]
+    await saver.aclose()
+
+    # 重新打开数据库，确认关闭时队列已全部写入
+    reopened = await CompactSqliteSaver.from_manager(get_connection_manager(db_path))
+    reread = [(await build_app(reopened, 0).aget_state(c)).values["messages"] for c in configs]
+    await reopened.aclose()
+
+    return {"label": label, "total": total, "p50": statistics.median(latencies) * 1000,
+            "p95": statistics.quantiles(latencies, n=20)[-1] * 1000, "read_ms": read_ms,
+            "durable": reread == states}
+
+
+async def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    llm_latency = (float(sys.argv[3]) if len(sys.argv) > 3 else 20) / 1000
+    print(f"🧠 检查点写回缓存对比 ({threads} 个会话并发, 每个 {turns} 轮, 模型延迟 {llm_latency * 1000:g} ms)")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="checkpoint_write_back_")
+    try:
+        results = [
+            await run_variant("直接写入 SQLite", f"{directory}/direct.db", False, turns, threads, llm_latency),
+            await run_variant("写回缓存", f"{directory}/write_back.db", True, turns, threads, llm_latency),
+        ]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print()
+    for r in results:
+        print(f"  {r['label']:<14} 总耗时 {r['total']:6.2f}s  每轮 p50 {r['p50']:7.1f} ms  p95 {r['p95']:7.1f} ms  "
+              f"读取最新状态 {r['read_ms']:6.2f} ms  {'✅ 重启后状态一致' if r['durable'] else '❌ 重启后状态不一致'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+MCP 会话池重试检查
+在临时目录中启动一个记录每次工具执行的 stdio MCP 服务器，验证：
+
+1. 工具执行途中服务器进程退出（请求已送达）：调用报错，不重试，工具只执行一次；
+2. 两次调用之间服务器进程被杀死（请求未发出）：重启会话后重试，工具执行一次；
+3. 工具返回的错误（参数不合法）原样抛出，不重启会话。
+
+任一检查失败时以非零状态退出。
+
+用法: python scripts/check_mcp_session_retry.py
+"""
+
+import asyncio
+import os
+import shutil
+import signal
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langchain_mcp_adapters.client import MultiServerMCPClient
+
+from mcp_session_pool import MCPSessionPool
+
+SERVER_SOURCE = '''
+import os
+import sys
+from mcp.server.fastmcp import FastMCP
+
+LOG_PATH = sys.argv[1]
+mcp = FastMCP("retry_check")
+
+
+def record(text: str):
+    with open(LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(text + "\\n")
+
+
+@mcp.tool()
+def append(text: str) -> str:
+    """记录一行"""
+    record(text)
+    return "ok"
+
+
+@mcp.tool()
+def append_and_exit(text: str) -> str:
+    """记录一行后进程立即退出，不返回响应"""
+    record(text)
+    os._exit(1)
+
+
+@mcp.tool()
+def pid() -> str:
+    """服务器进程 ID"""
+    return str(os.getpid())
+
+
+mcp.run()
+'''
+
+
+def executions(log_path: Path, text: str) -> int:
+    if not log_path.exists():
+        return 0
+    return log_path.read_text(encoding="utf-8").splitlines().count(text)
+
+
+async def call(pool: MCPSessionPool, tool_name: str, arguments: dict):
+    """返回 (结果, 异常)"""
+    try:
+        return await asyncio.wait_for(pool.call_tool("retry_check", tool_name, arguments), 30), None
+    except Exception as e:
+        return None, e
+
+
+async def main():
+    work_dir = Path(tempfile.mkdtemp(prefix="mcp_retry_"))
+    server_path = work_dir / "server.py"
+    log_path = work_dir / "executions.log"
+    server_path.write_text(SERVER_SOURCE, encoding="utf-8")
+    client = MultiServerMCPClient({
+        "retry_check": {"command": sys.executable, "args": [str(server_path), str(log_path)], "transport": "stdio"},
+    })
+    pool = MCPSessionPool(client, health_check_interval=0)
+    checks = []
+    try:
+        await call(pool, "append", {"text": "warmup"})
+
+        _, error = await call(pool, "append_and_exit", {"text": "crash"})
+        count = executions(log_path, "crash")
+        checks.append((error is not None and count == 1,
+                       f"执行途中进程退出: 调用{'报错 ' + type(error).__name__ if error else '成功'}, 工具执行 {count} 次"))
+
+        (pid, _), _ = await call(pool, "pid", {})
+        os.kill(int(pid), signal.SIGKILL)
+        await asyncio.sleep(0.5)
+        result, error = await call(pool, "append", {"text": "after_kill"})
+        count = executions(log_path, "after_kill")
+        checks.append((error is None and count == 1,
+                       f"两次调用之间进程被杀死: 调用{'成功' if error is None else '报错 ' + repr(error)}, 工具执行 {count} 次"))
+
+        restarts = pool.metrics["restarts"]
+        _, error = await call(pool, "append", {})
+        checks.append((error is not None and pool.metrics["restarts"] == restarts,
+                       f"参数错误: 调用{'报错 ' + type(error).__name__ if error else '成功'}, "
+                       f"会话重启 {pool.metrics['restarts'] - restarts} 次"))
+    finally:
+        await pool.aclose()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for ok, message in checks:
+        print(f"{'✅' if ok else '❌'} {message}")
+    failures = sum(1 for ok, _ in checks if not ok)
+    print(f"\n{'✅ 只有未发出的请求会被重试' if not failures else f'❌ {failures} 项检查失败'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+长期记忆检索超时检查
+在临时数据库中写入大量条目，使一次全文检索明显慢于 search_timeout_ms，验证：
+
+1. 超时的检索在期限附近返回空结果；
+2. 检索语句被 SQLite 中止，连接立即空闲，紧随其后的读取不需要等待慢查询执行完。
+
+任一检查失败时以非零状态退出。
+
+用法: python scripts/check_memory_search_timeout.py [条目数] [超时毫秒]
+"""
+
+import asyncio
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from memory_store import MAX_QUERY_TERMS, SQLiteMemoryStore, search_terms
+from sqlite_checkpointer import get_connection_manager
+
+NAMESPACE = ("memories", "timeout_check")
+WORDS = [f"word{i}" for i in range(MAX_QUERY_TERMS)]
+# 期限之后允许的误差（progress handler 检查间隔和事件循环调度）
+TOLERANCE_SECONDS = 0.1
+
+
+def seed(db_path: str, items: int):
+    """每个条目都包含全部检索词，检索时每个词都要匹配并为所有条目计算 bm25"""
+    search_text = " ".join(search_terms(" ".join(WORDS)))
+    now = time.time()
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO memory_items (prefix, key, value, search_text, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(".".join(NAMESPACE), f"item_{i}", '{"text": "x"}', search_text, now, now) for i in range(items)],
+        )
+
+
+async def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    timeout_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    work_dir = tempfile.mkdtemp(prefix="memory_timeout_")
+    try:
+        db_path = str(Path(work_dir) / "long_term_memory.db")
+        store = SQLiteMemoryStore(get_connection_manager(db_path), retention_days=None, search_timeout_ms=timeout_ms)
+        await store.setup()
+        await store.aput(NAMESPACE, "probe", {"text": "探针"})
+        seed(db_path, items)
+        print(f"🧪 {items} 个条目，检索超时 {timeout_ms:.0f} ms")
+
+        # 不限时间执行一次，确认这个检索确实比期限慢
+        store.search_timeout = 3600
+        start = time.perf_counter()
+        await store.asearch(NAMESPACE, query=" ".join(WORDS), limit=5)
+        full_seconds = time.perf_counter() - start
+        store.search_timeout = timeout_ms / 1000
+
+        start = time.perf_counter()
+        results = await store.asearch(NAMESPACE, query=" ".join(WORDS), limit=5)
+        search_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        probe = await store.aget(NAMESPACE, "probe")
+        get_seconds = time.perf_counter() - start
+        await store.aclose()
+
+        checks = [
+            (full_seconds > store.search_timeout * 2, f"不限时间的检索耗时 {full_seconds * 1000:.0f} ms（需明显慢于期限）"),
+            (not results and search_seconds < store.search_timeout + TOLERANCE_SECONDS,
+             f"超时的检索 {search_seconds * 1000:.0f} ms 后返回 {len(results)} 条结果"),
+            (probe is not None and get_seconds < TOLERANCE_SECONDS,
+             f"超时后的读取耗时 {get_seconds * 1000:.1f} ms（连接{'已' if get_seconds < TOLERANCE_SECONDS else '未'}释放）"),
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for ok, message in checks:
+        print(f"{'✅' if ok else '❌'} {message}")
+    failures = sum(1 for ok, _ in checks if not ok)
+    print(f"\n{'✅ 超时的检索已中止，连接没有被占用' if not failures else f'❌ {failures} 项检查失败'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
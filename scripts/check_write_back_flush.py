@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+检查点写回缓存的取消安全检查
+在临时数据库上用一个写入较慢的 SQLite 存储器验证：
+
+1. 调用 flush() 的协程在写入中途被取消时，未提交的操作留在队列中，之后的写入不丢数据；
+2. 后台写入任务正在写入时调用 aclose()，队列中的全部操作仍然写入数据库。
+
+任一检查失败时以非零状态退出。
+
+用法: python scripts/check_write_back_flush.py
+"""
+
+import asyncio
+import shutil
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langgraph.checkpoint.base import empty_checkpoint
+
+from sqlite_checkpointer import TunedAsyncSqliteSaver, get_connection_manager
+from write_back_checkpointer import WriteBackCheckpointSaver
+
+OPERATIONS = 5
+BATCH_SIZE = 2
+WRITE_DELAY_SECONDS = 0.05
+
+
+class SlowSqliteSaver(TunedAsyncSqliteSaver):
+    """每个批次先等待 WRITE_DELAY_SECONDS 再写入，模拟较慢的磁盘"""
+
+    async def aput_batch(self, operations):
+        await asyncio.sleep(WRITE_DELAY_SECONDS)
+        await super().aput_batch(operations)
+
+
+def persisted_checkpoints(db_path: str) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+
+
+async def queue_checkpoints(saver: WriteBackCheckpointSaver, prefix: str):
+    for i in range(OPERATIONS):
+        config = {"configurable": {"thread_id": f"{prefix}_{i}", "checkpoint_ns": ""}}
+        await saver.aput(config, empty_checkpoint(), {"step": i}, {})
+
+
+async def check_cancelled_flush(db_path: str) -> bool:
+    """第二个批次写入时取消 flush()，再次 flush() 后全部操作都应写入"""
+    inner = await SlowSqliteSaver.from_manager(get_connection_manager(db_path))
+    # 写入间隔足够长，后台任务不参与
+    saver = WriteBackCheckpointSaver(inner, flush_interval_seconds=3600, flush_batch_size=BATCH_SIZE)
+    await queue_checkpoints(saver, "cancel")
+
+    task = asyncio.create_task(saver.flush())
+    await asyncio.sleep(WRITE_DELAY_SECONDS * 1.5)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    queued = len(saver._queue)
+    await saver.flush()
+    persisted = persisted_checkpoints(db_path)
+    await saver.aclose()
+
+    ok = queued == OPERATIONS - BATCH_SIZE and persisted == OPERATIONS
+    print(f"{'✅' if ok else '❌'} 写入中途取消 flush(): 取消后队列中 {queued} 个操作 "
+          f"(期望 {OPERATIONS - BATCH_SIZE}), 最终写入 {persisted}/{OPERATIONS} 个检查点")
+    return ok
+
+
+async def check_close_during_flush(db_path: str) -> bool:
+    """后台任务写入第一个批次时调用 aclose()，全部操作都应写入"""
+    inner = await SlowSqliteSaver.from_manager(get_connection_manager(db_path))
+    saver = WriteBackCheckpointSaver(inner, flush_interval_seconds=0.01, flush_batch_size=BATCH_SIZE)
+    await queue_checkpoints(saver, "close")
+    await asyncio.sleep(WRITE_DELAY_SECONDS / 2)
+    writing = saver._flush_lock.locked()
+    await saver.aclose()
+    persisted = persisted_checkpoints(db_path)
+
+    ok = writing and persisted == OPERATIONS and not saver._queue
+    print(f"{'✅' if ok else '❌'} 后台写入进行中时 aclose(): 关闭时{'正在' if writing else '未在'}写入, "
+          f"最终写入 {persisted}/{OPERATIONS} 个检查点, 队列剩余 {len(saver._queue)} 个操作")
+    return ok
+
+
+async def main():
+    work_dir = tempfile.mkdtemp(prefix="write_back_flush_")
+    try:
+        results = [
+            await check_cancelled_flush(str(Path(work_dir) / "cancel.db")),
+            await check_close_during_flush(str(Path(work_dir) / "close.db")),
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    failures = results.count(False)
+    print(f"\n{'✅ 写回缓存在取消和关闭时没有丢失操作' if not failures else f'❌ {failures} 项检查失败'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+检查点压缩脚本
+按 persistence_config.json 中的 checkpoint_retention 策略立即执行一轮清理，
+只保留每个线程最新的 K 个检查点
+
+存储器由 main.create_checkpointer 按配置创建，与运行时使用相同的存储器类型和分片
+（消息去重格式下同时清理不再被引用的消息）
+
+用法: python scripts/compact_checkpoints.py [keep_last]
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from checkpoint_retention import DEFAULT_KEEP_LAST, CheckpointRetention
+from main import create_checkpointer, load_persistence_config
+
+
+def _database_location(config) -> str:
+    """配置中检查点数据库（或分片目录）的位置"""
+    persistence = config.get("persistence", {})
+    backend_config = persistence.get("config", {})
+    if persistence.get("backend", "sqlite") == "sqlite_sharded":
+        return backend_config.get("sqlite_sharded", {}).get("shard_directory", "./data/checkpoint_shards")
+    return backend_config.get("sqlite", {}).get("database_path", "./data/agent_memory.db")
+
+
+async def main():
+    # 配置中的路径相对于项目根目录
+    os.chdir(PROJECT_ROOT)
+    config = load_persistence_config("config/persistence_config.json")
+
+    options = config.get("checkpoint_retention", {})
+    keep_last = int(sys.argv[1]) if len(sys.argv) > 1 else options.get("keep_last", DEFAULT_KEEP_LAST)
+    location = _database_location(config)
+    if not Path(location).exists():
+        print(f"❌ 数据库不存在: {location}")
+        return
+
+    # create_checkpointer 不加写回缓存层，这里直接得到底层的 SQLite（或分片）存储器
+    checkpointer = await create_checkpointer(config)
+    checkpointer = getattr(checkpointer, "inner", checkpointer)
+    try:
+        savers = getattr(checkpointer, "shards", None) or [checkpointer]
+        if any(getattr(s, "conn", None) is None for s in savers):
+            print(f"❌ 检查点压缩仅支持 SQLite 存储器，当前为 {type(checkpointer).__name__}")
+            return
+
+        print(f"🧹 压缩检查点数据库: {location} ({len(savers)} 个数据库, 每个线程保留 {keep_last} 个检查点)")
+        print("=" * 50)
+        retention = CheckpointRetention(
+            checkpointer,
+            keep_last=keep_last,
+            batch_size=options.get("batch_size", 500),
+            batch_pause_seconds=0,
+            database_path=location,
+        )
+        report = await retention.run_once()
+        CheckpointRetention.print_report(report)
+    finally:
+        aclose = getattr(checkpointer, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+检查点格式迁移脚本
+把已有的检查点数据库转换为压缩 + 消息去重格式，或用 --revert 转换回 LangGraph 原始格式
+请在应用停止时运行
+
+用法:
+    python scripts/migrate_checkpoint_format.py [数据库路径]
+    python scripts/migrate_checkpoint_format.py --revert [数据库路径]
+"""
+
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from checkpoint_serde import MESSAGES_CHANNEL, CompactSqliteSaver, compact_saver_options, message_refs
+from sqlite_checkpointer import get_connection_manager
+
+BATCH_SIZE = 200
+
+
+def file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+async def fetch_batch(saver, table: str, columns: str, after_rowid: int):
+    async with saver.lock:
+        async with saver.conn.execute(
+            f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (after_rowid, BATCH_SIZE),
+        ) as cur:
+            return await cur.fetchall()
+
+
+async def update_rows(saver, table: str, column: str, updates):
+    async with saver.lock:
+        await saver.conn.executemany(f"UPDATE {table} SET type = ?, {column} = ? WHERE rowid = ?", updates)
+        await saver.conn.commit()
+
+
+async def convert_checkpoints(saver: CompactSqliteSaver, revert: bool) -> int:
+    plain = JsonPlusSerializer()
+    converted, last_rowid = 0, 0
+    while True:
+        rows = await fetch_batch(saver, "checkpoints", "thread_id, type, checkpoint", last_rowid)
+        if not rows:
+            return converted
+        updates = []
+        for rowid, thread_id, type_, blob in rows:
+            checkpoint = saver.serde.loads_typed((type_, blob))
+            refs = message_refs(checkpoint)
+            if revert:
+                if refs is not None:
+                    checkpoint["channel_values"][MESSAGES_CHANNEL] = await saver.load_messages(thread_id, refs)
+                new_type, new_blob = plain.dumps_typed(checkpoint)
+            else:
+                if refs is None and saver.deduplicate_messages:
+                    checkpoint, message_rows = saver.split_messages(thread_id, checkpoint)
+                    if message_rows:
+                        await saver._store_messages(message_rows)
+                new_type, new_blob = saver.serde.dumps_typed(checkpoint)
+            updates.append((new_type, new_blob, rowid))
+        await update_rows(saver, "checkpoints", "checkpoint", updates)
+        converted += len(updates)
+        last_rowid = rows[-1][0]
+
+
+async def convert_writes(saver: CompactSqliteSaver, revert: bool) -> int:
+    target = JsonPlusSerializer() if revert else saver.serde
+    converted, last_rowid = 0, 0
+    while True:
+        rows = await fetch_batch(saver, "writes", "type, value", last_rowid)
+        if not rows:
+            return converted
+        updates = [(*target.dumps_typed(saver.serde.loads_typed((type_, value))), rowid)
+                   for rowid, type_, value in rows]
+        await update_rows(saver, "writes", "value", updates)
+        converted += len(updates)
+        last_rowid = rows[-1][0]
+
+
+async def main():
+    args = [a for a in sys.argv[1:] if a != "--revert"]
+    revert = "--revert" in sys.argv
+
+    with open(PROJECT_ROOT / "config" / "persistence_config.json", "r", encoding="utf-8") as f:
+        sqlite_config = json.load(f)["persistence"]["config"]["sqlite"]
+    db_path = args[0] if args else sqlite_config.get("database_path", "./data/agent_memory.db")
+    db_path = str((PROJECT_ROOT / db_path).resolve())
+    if not os.path.exists(db_path):
+        print(f"❌ 数据库不存在: {db_path}")
+        return
+
+    options = compact_saver_options(sqlite_config.get("serialization") or {})
+    target = "LangGraph 原始格式" if revert else (
+        f"压缩 {options['compression']} + 消息去重" if options["deduplicate_messages"] else f"压缩 {options['compression']}"
+    )
+    print(f"🔄 检查点格式迁移: {db_path}")
+    print(f"   目标格式: {target}")
+    print("=" * 50)
+
+    size_before = file_size(db_path)
+    manager = get_connection_manager(db_path, sqlite_config.get("connection_options"))
+    saver = await CompactSqliteSaver.from_manager(manager, **options)
+    try:
+        await saver.setup()
+        checkpoints = await convert_checkpoints(saver, revert)
+        writes = await convert_writes(saver, revert)
+        async with saver.lock:
+            if revert:
+                await saver.conn.execute("DROP TABLE IF EXISTS checkpoint_messages")
+            await saver.conn.commit()
+            # 迁移在离线状态下进行，直接 VACUUM 收缩文件
+            await saver.conn.execute("VACUUM")
+            await saver.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        await saver.aclose()
+
+    size_after = file_size(db_path)
+    print(f"✅ 转换检查点 {checkpoints} 个, writes {writes} 行")
+    print(f"📦 文件大小: {size_before / 1024:.1f} KB -> {size_after / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+检查点分片迁移脚本
+把单文件检查点数据库（或旧的分片文件）中的线程按 thread_id 哈希迁移到
+persistence_config.json 中 sqlite_sharded 配置的分片文件
+
+用法:
+    python scripts/rebalance_checkpoint_shards.py                 # 迁移 sqlite.database_path
+    python scripts/rebalance_checkpoint_shards.py a.db b.db ...   # 迁移指定的源文件（可以是旧分片）
+
+源文件不在分片列表中时保持不变，确认无误后可手动删除；
+源文件本身就是分片时（调整分片数量），迁出的行会从原分片中删除。
+"""
+
+import json
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from checkpoint_serde import MESSAGES_TABLE_DDL
+from session_quota import ARCHIVED_SESSIONS_DDL
+from thread_catalog import BACKFILL_QUERY, CATALOG_DDL, CATALOG_UPSERT, backfill_row
+from sharded_checkpointer import (
+    DEFAULT_SHARD_COUNT,
+    DEFAULT_SHARD_DIRECTORY,
+    DEFAULT_SHARD_FILE_PATTERN,
+    shard_index,
+    shard_paths,
+)
+
+# checkpoint_messages 只在启用消息去重的数据库中存在，archived_sessions 只在有会话被配额归档后存在
+TABLES = ("checkpoints", "writes", "checkpoint_messages", "archived_sessions")
+# 会话目录：源文件有目录时随线程复制，没有目录的线程按检查点补充
+CATALOG_TABLE = "thread_catalog"
+
+
+def load_config():
+    with open(PROJECT_ROOT / "config" / "persistence_config.json", "r", encoding="utf-8") as f:
+        return json.load(f)["persistence"]["config"]
+
+
+def resolve(path: str) -> str:
+    return str((PROJECT_ROOT / path).resolve())
+
+
+def open_shard(path: str, shard_count: int) -> sqlite3.Connection:
+    """打开分片文件并确保检查点表存在"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    SqliteSaver(conn).setup()
+    conn.execute(MESSAGES_TABLE_DDL)
+    conn.execute(ARCHIVED_SESSIONS_DDL)
+    for ddl in CATALOG_DDL:
+        conn.execute(ddl)
+    conn.create_function("shard_of", 1, lambda thread_id: shard_index(thread_id, shard_count),
+                         deterministic=True)
+    return conn
+
+
+def existing_tables(conn: sqlite3.Connection, schema: str = "main") -> set:
+    rows = conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'").fetchall()
+    return {row[0] for row in rows}
+
+
+def count_rows(conn: sqlite3.Connection, schema: str = "main") -> dict:
+    tables = existing_tables(conn, schema)
+    return {
+        table: conn.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0] if table in tables else 0
+        for table in TABLES
+    }
+
+
+def migrate_source(source: str, targets: list, shard_count: int):
+    """把一个源文件中的行按分片复制到各目标分片"""
+    print(f"\n📦 迁移 {source}")
+    moved = {table: 0 for table in TABLES}
+    for index, target in enumerate(targets):
+        conn = open_shard(target, shard_count)
+        if os.path.samefile(source, target):
+            conn.close()
+            continue
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        source_tables = existing_tables(conn, "src")
+        conn.execute("BEGIN IMMEDIATE")
+        for table in (t for t in TABLES if t in source_tables):
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO main.{table} SELECT * FROM src.{table} WHERE shard_of(thread_id) = ?",
+                (index,),
+            )
+            moved[table] += cur.rowcount
+        if CATALOG_TABLE in source_tables:
+            conn.execute(
+                f"INSERT OR IGNORE INTO main.{CATALOG_TABLE} SELECT * FROM src.{CATALOG_TABLE} "
+                "WHERE shard_of(thread_id) = ?",
+                (index,),
+            )
+        # 源文件没有目录（或目录不完整）时，为迁入的会话补充目录行
+        cataloged = {row[0] for row in conn.execute(f"SELECT thread_id FROM main.{CATALOG_TABLE}")}
+        rows = [backfill_row(*row) for row in conn.execute(BACKFILL_QUERY) if row[0] not in cataloged]
+        conn.executemany(CATALOG_UPSERT, rows)
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+
+    if source in targets:
+        # 源文件本身是分片：删除已迁往其他分片的行
+        own_index = targets.index(source)
+        conn = open_shard(source, shard_count)
+        conn.execute("BEGIN IMMEDIATE")
+        for table in TABLES + (CATALOG_TABLE,):
+            conn.execute(f"DELETE FROM {table} WHERE shard_of(thread_id) != ?", (own_index,))
+        conn.execute("COMMIT")
+        conn.close()
+
+    print(f"  ✅ 复制检查点 {moved['checkpoints']} 行, writes {moved['writes']} 行, "
+          f"消息 {moved['checkpoint_messages']} 行")
+
+
+def main():
+    config = load_config()
+    sharded = config.get("sqlite_sharded", {})
+    shard_count = int(sharded.get("shard_count", DEFAULT_SHARD_COUNT))
+    targets = [resolve(p) for p in shard_paths(
+        shard_count,
+        sharded.get("shard_directory", DEFAULT_SHARD_DIRECTORY),
+        sharded.get("file_pattern", DEFAULT_SHARD_FILE_PATTERN),
+    )]
+
+    if len(sys.argv) > 1:
+        sources = [resolve(p) for p in sys.argv[1:]]
+    else:
+        sources = [resolve(config.get("sqlite", {}).get("database_path", "./data/agent_memory.db"))]
+
+    print(f"🔀 检查点分片迁移: {len(sources)} 个源文件 -> {shard_count} 个分片")
+    print("=" * 50)
+
+    missing = [s for s in sources if not os.path.exists(s)]
+    if missing:
+        print(f"❌ 源文件不存在: {', '.join(missing)}")
+        return
+
+    source_totals = {table: 0 for table in TABLES}
+    for source in sources:
+        conn = sqlite3.connect(source)
+        for table, count in count_rows(conn).items():
+            source_totals[table] += count
+        conn.close()
+
+    for source in sources:
+        migrate_source(source, targets, shard_count)
+
+    print("\n📊 分片分布:")
+    shard_totals = {table: 0 for table in TABLES}
+    for index, target in enumerate(targets):
+        conn = sqlite3.connect(target)
+        counts = count_rows(conn)
+        threads = conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+        conn.close()
+        for table, count in counts.items():
+            shard_totals[table] += count
+        print(f"  分片 {index}: {threads} 个线程, 检查点 {counts['checkpoints']} 行, writes {counts['writes']} 行, "
+              f"消息 {counts['checkpoint_messages']} 行")
+
+    if all(shard_totals[t] >= source_totals[t] for t in TABLES):
+        print("\n✅ 迁移完成，所有行都已写入分片")
+        print("💡 在 persistence_config.json 中设置 \"backend\": \"sqlite_sharded\" 即可启用分片存储")
+    else:
+        print(f"\n⚠️ 分片行数少于源文件: 源 {source_totals}, 分片 {shard_totals}")
+
+
+if __name__ == "__main__":
+    main()
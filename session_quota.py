@@ -0,0 +1,165 @@
+# session_quota.py
+"""
+每个用户的会话配额（session_management.max_sessions_per_user）
+
+UserSessionIndex 在进程内按用户记录会话的最近活动顺序，创建或恢复会话时
+只需查看该用户的有序字典长度即可判断配额，超出时淘汰最久未活动的会话：
+- quota_policy = "archive"：记入检查点数据库的 archived_sessions 表（不能再恢复，
+  启动时不再计入配额），检查点留给过期会话清理任务回收；
+- quota_policy = "delete"：同时删除该会话的检查点。
+淘汰后的处理由 on_evict 回调完成（见 AgentRuntime）。
+
+启动时从会话目录（thread_catalog，每个会话一行）读取最后活动时间作为初始顺序（跳过已归档的会话），
+不支持会话目录时按线程聚合检查点表；
+CLI 会话 ID 的格式为 <user_id>_<8 位十六进制>，据此得到所属用户。
+Chainlit 线程的配额由 SQLiteDataLayer 在 threads 表上维护。
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from thread_catalog import CLI_THREAD_ID
+
+# 与检查点保存在同一个数据库（分片时为线程所在的分片）中，随检查点一起迁移和备份
+ARCHIVED_SESSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS archived_sessions (
+        thread_id TEXT PRIMARY KEY,
+        archived_at TEXT NOT NULL
+    )
+"""
+
+ARCHIVE_SESSION = "INSERT OR IGNORE INTO archived_sessions (thread_id, archived_at) VALUES (?, ?)"
+
+
+def _sqlite_savers(checkpointer) -> List[Any]:
+    """检查点存储器背后的 SQLite 存储器（分片时为全部分片），不是 SQLite 存储器时返回空列表"""
+    inner = getattr(checkpointer, "inner", checkpointer)
+    savers = getattr(inner, "shards", None) or [inner]
+    if any(getattr(s, "conn", None) is None or getattr(s, "lock", None) is None for s in savers):
+        return []
+    return list(savers)
+
+
+async def archive_sessions(checkpointer, thread_ids: Sequence[str]) -> int:
+    """把会话记入所在数据库的 archived_sessions 表，返回新记录的会话数"""
+    savers = _sqlite_savers(checkpointer)
+    if not savers:
+        return 0
+    inner = getattr(checkpointer, "inner", checkpointer)
+    shard_for = getattr(inner, "shard_for", None)
+    archived_at = datetime.now(timezone.utc).isoformat()
+    archived = 0
+    for thread_id in thread_ids:
+        saver = shard_for({"configurable": {"thread_id": thread_id}}) if shard_for else savers[0]
+        await saver.setup()
+        async with saver.lock:
+            await saver.conn.execute(ARCHIVED_SESSIONS_DDL)
+            cur = await saver.conn.execute(ARCHIVE_SESSION, (str(thread_id), archived_at))
+            await saver.conn.commit()
+            archived += cur.rowcount
+    return archived
+
+
+class UserSessionIndex:
+    """按用户维护会话的最近活动顺序，超出配额时淘汰最久未活动的会话"""
+
+    def __init__(self, max_sessions_per_user: Optional[int] = None,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_sessions_per_user = max_sessions_per_user
+        self.on_evict = on_evict
+        self.evicted = 0
+        self._sessions: Dict[str, "OrderedDict[str, None]"] = {}
+        self._owners: Dict[str, str] = {}
+        self._archived: set = set()
+
+    async def load(self, checkpointer, catalog=None) -> int:
+        """
+        读取已有的未归档 CLI 会话，返回载入的会话数
+
+        提供会话目录（ThreadCatalog）时按目录的最后活动时间排序，每个会话只读一行；
+        否则按线程聚合 SQLite 检查点表，取最新 checkpoint_id 排序
+        """
+        found = []
+        for saver in _sqlite_savers(checkpointer):
+            await saver.setup()
+            async with saver.lock:
+                await saver.conn.execute(ARCHIVED_SESSIONS_DDL)
+                await saver.conn.commit()
+                async with saver.conn.execute("SELECT thread_id FROM archived_sessions") as cur:
+                    self._archived.update(row[0] for row in await cur.fetchall())
+                if catalog is not None:
+                    continue
+                async with saver.conn.execute(
+                    "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints WHERE checkpoint_ns = '' "
+                    "AND thread_id NOT IN (SELECT thread_id FROM archived_sessions) GROUP BY thread_id"
+                ) as cur:
+                    found.extend(await cur.fetchall())
+        if catalog is not None:
+            found = [(s["thread_id"], s["last_active_at"]) for s in await catalog.active_sessions()]
+        # checkpoint_id 是 uuid6、last_active_at 是 ISO 时间，按字符串排序即按时间排序
+        loaded = 0
+        for thread_id, _ in sorted(found, key=lambda row: row[1]):
+            match = CLI_THREAD_ID.match(str(thread_id))
+            if match:
+                self._insert(match.group("user_id"), str(thread_id))
+                loaded += 1
+        return loaded
+
+    def _insert(self, user_id: str, thread_id: str):
+        sessions = self._sessions.setdefault(user_id, OrderedDict())
+        sessions[thread_id] = None
+        sessions.move_to_end(thread_id)
+        self._owners[thread_id] = user_id
+
+    def add(self, user_id: str, thread_id: str) -> List[str]:
+        """记录新建或恢复的会话，返回因超出配额被淘汰的会话"""
+        self._insert(user_id, thread_id)
+        sessions = self._sessions[user_id]
+        evicted = []
+        while self.max_sessions_per_user and len(sessions) > self.max_sessions_per_user:
+            oldest, _ = sessions.popitem(last=False)
+            self._owners.pop(oldest, None)
+            evicted.append(oldest)
+        if evicted:
+            self.evicted += len(evicted)
+            print(f"📦 用户 {user_id} 超出会话配额 {self.max_sessions_per_user}，淘汰最久未活动的会话: {', '.join(evicted)}")
+            if self.on_evict is not None:
+                for thread_id in evicted:
+                    self.on_evict(thread_id)
+        return evicted
+
+    def discard(self, thread_ids: Sequence[str]):
+        """移除已被删除的会话（例如过期会话清理），不触发 on_evict，也不再计入配额"""
+        for thread_id in thread_ids:
+            self._archived.discard(thread_id)
+            user_id = self._owners.pop(thread_id, None)
+            if user_id is None:
+                continue
+            sessions = self._sessions[user_id]
+            sessions.pop(thread_id, None)
+            if not sessions:
+                del self._sessions[user_id]
+
+    def touch(self, thread_id: str):
+        """会话有新活动时移到最近位置（未记录的会话忽略）"""
+        user_id = self._owners.get(thread_id)
+        if user_id is not None:
+            self._sessions[user_id].move_to_end(thread_id)
+
+    def mark_archived(self, thread_id: str):
+        """记录会话已归档（持久化由 archive_sessions 完成）"""
+        self._archived.add(thread_id)
+
+    def is_archived(self, thread_id: str) -> bool:
+        return thread_id in self._archived
+
+    def owner(self, thread_id: str) -> Optional[str]:
+        return self._owners.get(thread_id)
+
+    def count(self, user_id: str) -> int:
+        return len(self._sessions.get(user_id, ()))
+
+    def sessions(self, user_id: str) -> List[str]:
+        """用户的会话，最近活动的在前"""
+        return list(reversed(self._sessions.get(user_id, {})))
@@ -0,0 +1,281 @@
+# session_reaper.py
+"""
+过期会话清理
+
+按 session_management.session_timeout_hours 找出两个数据库中都已空闲超过时限的会话，
+删除它们的检查点、writes、去重消息，以及 Chainlit 的 steps、elements、feedbacks 和 threads 行。
+
+会话最后活动时间：
+- 检查点数据库：最新 checkpoint_id（uuid6，本身带有时间戳）；
+- Chainlit 数据库：最新 step 的 createdAt，没有 step 时取线程的 createdAt。
+
+同一个会话 ID 在任一数据库中仍有活动就不会被清理。删除按小批次进行，每批单独提交，
+批次之间让出事件循环并暂停，作为低优先级后台任务运行，不影响正在进行的对话。
+每删除一组会话就通过 on_reaped 回调通知调用方（AgentRuntime 据此从会话配额索引中移除）。
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from chainlit_schema import apply_migrations
+
+# 默认参数，可在 persistence_config.json 的 session_management 中覆盖
+DEFAULT_SESSION_TIMEOUT_HOURS = 24
+DEFAULT_INTERVAL_MINUTES = 60
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_PAUSE_SECONDS = 0.05
+DEFAULT_CHAINLIT_DATABASE = "./data/chainlit_history.db"
+
+# 每次删除处理的会话数，配合 batch_size 限制每批删除的行数
+THREADS_PER_BATCH = 50
+
+CHECKPOINT_TABLES = ("writes", "checkpoints", "checkpoint_messages")
+CHAINLIT_TABLES = ("feedbacks", "elements", "steps")
+
+# uuid6 时间戳从 1582-10-15 起以 100 纳秒为单位
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+def checkpoint_id_at(timestamp: float) -> str:
+    """返回该时刻对应的最小 uuid6 字符串，早于该时刻的 checkpoint_id 按字符串比较都小于它"""
+    digits = f"{int(timestamp * 10_000_000) + _UUID_EPOCH_OFFSET:015x}"
+    return f"{digits[:8]}-{digits[8:12]}-6{digits[12:]}-0000-000000000000"
+
+
+def chainlit_time_at(timestamp: float) -> str:
+    """Chainlit 以 UTC ISO 格式保存时间，只比较到秒的前 19 个字符"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _chunks(items: List[str], size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SessionReaper:
+    """删除空闲超过 session_timeout_hours 的会话的后台任务"""
+
+    def __init__(self, checkpointer, chainlit_db_path: Optional[str] = DEFAULT_CHAINLIT_DATABASE,
+                 timeout_hours: float = DEFAULT_SESSION_TIMEOUT_HOURS,
+                 interval_minutes: float = DEFAULT_INTERVAL_MINUTES,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_pause_seconds: float = DEFAULT_BATCH_PAUSE_SECONDS,
+                 on_reaped: Optional[Callable[[List[str]], None]] = None):
+        self.checkpointer = checkpointer
+        # 写回缓存只负责最近的检查点，按批删除直接作用于底层存储器
+        inner = getattr(checkpointer, "inner", checkpointer)
+        self.savers = [] if checkpointer is None else list(getattr(inner, "shards", None) or [inner])
+        self.chainlit_db_path = chainlit_db_path
+        self.timeout_seconds = float(timeout_hours) * 3600
+        self.interval_seconds = float(interval_minutes) * 60
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_pause_seconds = float(batch_pause_seconds)
+        self.on_reaped = on_reaped
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._schema_ready = False
+
+    @classmethod
+    def from_config(cls, checkpointer, persistence_config: Dict[str, Any],
+                    on_reaped: Optional[Callable[[List[str]], None]] = None) -> Optional["SessionReaper"]:
+        """根据 session_management 创建清理任务；auto_cleanup_enabled 为 false 时返回 None"""
+        options = persistence_config.get("session_management", {})
+        if not options.get("auto_cleanup_enabled", False):
+            return None
+        inner = getattr(checkpointer, "inner", checkpointer)
+        savers = getattr(inner, "shards", None) or [inner]
+        if any(getattr(s, "conn", None) is None or getattr(s, "lock", None) is None for s in savers):
+            # 内存存储器重启即清空，只清理 Chainlit 数据库
+            checkpointer = None
+        return cls(
+            checkpointer,
+            chainlit_db_path=options.get("chainlit_database_path", DEFAULT_CHAINLIT_DATABASE),
+            timeout_hours=options.get("session_timeout_hours", DEFAULT_SESSION_TIMEOUT_HOURS),
+            interval_minutes=options.get("cleanup_interval_minutes", DEFAULT_INTERVAL_MINUTES),
+            batch_size=options.get("cleanup_batch_size", DEFAULT_BATCH_SIZE),
+            batch_pause_seconds=options.get("cleanup_batch_pause_seconds", DEFAULT_BATCH_PAUSE_SECONDS),
+            on_reaped=on_reaped,
+        )
+
+    # ---- Chainlit 数据库（同步，在线程中执行） ----
+
+    def _connect_chainlit(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.chainlit_db_path, timeout=30)
+
+    def _chainlit_activity(self) -> Dict[str, str]:
+        """每个会话的最后活动时间（UTC，精确到秒）"""
+        conn = self._connect_chainlit()
+        try:
+            # 按会话查找和删除 Chainlit 行需要 threadId 索引（chainlit_schema 的迁移），否则每批都要全表扫描
+            if not self._schema_ready:
+                apply_migrations(conn)
+                self._schema_ready = True
+            activity = {}
+            for thread_id, created_at in conn.execute("SELECT id, SUBSTR(createdAt, 1, 19) FROM threads"):
+                activity[thread_id] = created_at or ""
+            # 没有线程行的 steps 也属于会话（get_thread 会为它们补出默认线程）
+            for thread_id, last_step in conn.execute(
+                "SELECT threadId, MAX(SUBSTR(createdAt, 1, 19)) FROM steps GROUP BY threadId"
+            ):
+                activity[thread_id] = max(activity.get(thread_id, ""), last_step or "")
+            return activity
+        finally:
+            conn.close()
+
+    def _delete_chainlit_batch(self, table: str, thread_ids: List[str]) -> int:
+        placeholders = ",".join("?" * len(thread_ids))
+        column = "id" if table == "threads" else "threadId"
+        conn = self._connect_chainlit()
+        try:
+            cursor = conn.execute(
+                f"DELETE FROM {table} WHERE rowid IN "
+                f"(SELECT rowid FROM {table} WHERE {column} IN ({placeholders}) LIMIT ?)",
+                [*thread_ids, self.batch_size],
+            )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    # ---- 检查点数据库 ----
+
+    async def _checkpoint_activity(self, saver) -> Dict[str, str]:
+        """每个会话最新的 checkpoint_id"""
+        await saver.setup()
+        async with saver.lock:
+            async with saver.conn.execute(
+                "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints GROUP BY thread_id"
+            ) as cur:
+                return {str(thread_id): last for thread_id, last in await cur.fetchall()}
+
+    async def _checkpoint_tables(self, saver) -> List[str]:
+        async with saver.lock:
+            async with saver.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'") as cur:
+                names = {row[0] for row in await cur.fetchall()}
+        return [table for table in CHECKPOINT_TABLES if table in names]
+
+    async def _delete_checkpoint_batch(self, saver, table: str, thread_ids: List[str]) -> int:
+        placeholders = ",".join("?" * len(thread_ids))
+        async with saver.lock:
+            cursor = await saver.conn.execute(
+                f"DELETE FROM {table} WHERE rowid IN "
+                f"(SELECT rowid FROM {table} WHERE thread_id IN ({placeholders}) LIMIT ?)",
+                [*thread_ids, self.batch_size],
+            )
+            await saver.conn.commit()
+            return cursor.rowcount
+
+    # ---- 清理 ----
+
+    async def _drain(self, delete, table: str, thread_ids: List[str], report: Dict[str, Any]):
+        """反复删除一批，直到这些会话在该表中没有剩余行"""
+        while True:
+            deleted = await delete(table, thread_ids)
+            report[f"{table}_deleted"] = report.get(f"{table}_deleted", 0) + deleted
+            await asyncio.sleep(self.batch_pause_seconds)
+            if deleted < self.batch_size:
+                return
+
+    async def find_expired(self) -> Dict[str, Any]:
+        """找出所有数据库中都已空闲超过时限的会话，按所在数据库分组"""
+        now = time.time()
+        checkpoint_cutoff = checkpoint_id_at(now - self.timeout_seconds)
+        chainlit_cutoff = chainlit_time_at(now - self.timeout_seconds)
+
+        active, expired_by_saver, expired_chainlit = set(), {}, set()
+        for index, saver in enumerate(self.savers):
+            for thread_id, last in (await self._checkpoint_activity(saver)).items():
+                if last >= checkpoint_cutoff:
+                    active.add(thread_id)
+                else:
+                    expired_by_saver.setdefault(index, set()).add(thread_id)
+        if self.chainlit_db_path and os.path.exists(self.chainlit_db_path):
+            for thread_id, last in (await asyncio.to_thread(self._chainlit_activity)).items():
+                if last >= chainlit_cutoff:
+                    active.add(thread_id)
+                else:
+                    expired_chainlit.add(thread_id)
+
+        return {
+            "checkpoints": {index: sorted(ids - active) for index, ids in expired_by_saver.items()},
+            "chainlit": sorted(expired_chainlit - active),
+        }
+
+    def _notify_reaped(self, thread_ids: List[str]):
+        if self.on_reaped is not None:
+            self.on_reaped(thread_ids)
+
+    async def run_once(self) -> Dict[str, Any]:
+        """执行一轮清理，返回每张表删除的行数"""
+        start = time.perf_counter()
+        # 先把写回缓存中排队的检查点写入磁盘，避免把刚恢复的会话当作空闲
+        flush = getattr(self.checkpointer, "flush", None)
+        if flush is not None:
+            await flush()
+
+        expired = await self.find_expired()
+        report: Dict[str, Any] = {"threads": 0}
+        for table in CHECKPOINT_TABLES + CHAINLIT_TABLES + ("threads",):
+            report[f"{table}_deleted"] = 0
+        reaped = set()
+
+        for index, thread_ids in expired["checkpoints"].items():
+            saver = self.savers[index]
+            tables = await self._checkpoint_tables(saver)
+            for chunk in _chunks(thread_ids, THREADS_PER_BATCH):
+                for table in tables:
+                    await self._drain(lambda t, ids: self._delete_checkpoint_batch(saver, t, ids), table, chunk, report)
+                for thread_id in chunk:
+                    # 行已删除，这一步只清理写回缓存和已写入消息的记录
+                    await self.checkpointer.adelete_thread(thread_id)
+                self._notify_reaped(chunk)
+            reaped.update(thread_ids)
+
+        for chunk in _chunks(expired["chainlit"], THREADS_PER_BATCH):
+            for table in CHAINLIT_TABLES + ("threads",):
+                await self._drain(
+                    lambda t, ids: asyncio.to_thread(self._delete_chainlit_batch, t, ids), table, chunk, report
+                )
+            self._notify_reaped(chunk)
+            reaped.update(chunk)
+
+        report["threads"] = len(reaped)
+        report["rows_deleted"] = sum(v for k, v in report.items() if k.endswith("_deleted"))
+        report["seconds"] = time.perf_counter() - start
+        self.last_report = report
+        return report
+
+    @staticmethod
+    def print_report(report: Dict[str, Any]):
+        print(f"⏳ 过期会话清理: {report['threads']} 个会话, 共删除 {report['rows_deleted']} 行 "
+              f"(检查点 {report['checkpoints_deleted']}, writes {report['writes_deleted']}, "
+              f"消息 {report['checkpoint_messages_deleted']}, steps {report['steps_deleted']}, "
+              f"elements {report['elements_deleted']}, feedbacks {report['feedbacks_deleted']}, "
+              f"threads {report['threads_deleted']}), 耗时 {report['seconds']:.2f}s")
+
+    async def _run_forever(self):
+        while True:
+            try:
+                report = await self.run_once()
+                if report["threads"]:
+                    self.print_report(report)
+            except Exception as e:
+                print(f"⚠️ 过期会话清理任务出错: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        """启动后台清理任务"""
+        if self._task is None:
+            print(f"⏳ 过期会话清理已启用: 删除空闲超过 {self.timeout_seconds / 3600:g} 小时的会话")
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def aclose(self):
+        """停止后台清理任务"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
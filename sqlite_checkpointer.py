@@ -0,0 +1,359 @@
+# sqlite_checkpointer.py
+"""
+SQLite 检查点存储器的连接管理
+
+每个数据库文件在进程内只打开一个 aiosqlite 连接，由 SQLiteConnectionManager 统一管理：
+打开时应用 persistence_config.json 中 connection_options 的 PRAGMA（WAL、synchronous、
+busy_timeout、cache_size、mmap_size），进程退出时关闭。
+
+TunedAsyncSqliteSaver 使用管理器的连接和锁，统计锁等待次数，
+并在写入遇到 "database is locked" 时退避重试；aput_batch 在一个事务中写入多个检查点和 writes，
+根图检查点同时更新 thread_catalog 会话目录（见 thread_catalog.py）。
+"""
+
+import asyncio
+import copy
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+from langgraph.checkpoint.base import WRITES_IDX_MAP, get_checkpoint_metadata
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from message_history import MESSAGES_CHANNEL, slice_page
+from session_quota import ARCHIVED_SESSIONS_DDL
+from thread_catalog import BACKFILL_QUERY, CATALOG_DDL, CATALOG_UPSERT, backfill_row, catalog_row
+
+DEFAULT_DATABASE_PATH = "./data/agent_memory.db"
+
+# connection_options 的默认值；timeout 和 check_same_thread 传给 sqlite3.connect，其余作为 PRAGMA 执行
+DEFAULT_CONNECTION_OPTIONS: Dict[str, Any] = {
+    "timeout": 30,
+    "check_same_thread": False,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -16000,
+    "mmap_size": 67108864,
+}
+
+CONNECT_OPTION_KEYS = ("timeout", "check_same_thread")
+PRAGMA_OPTION_KEYS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")
+
+# 写入遇到数据库忙时的重试参数
+DEFAULT_MAX_BUSY_RETRIES = 3
+BUSY_RETRY_BACKOFF_SECONDS = 0.05
+
+CHECKPOINT_INSERT = (
+    "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+    "type, checkpoint, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+WRITES_REPLACE = (
+    "INSERT OR REPLACE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+WRITES_IGNORE = WRITES_REPLACE.replace("INSERT OR REPLACE", "INSERT OR IGNORE")
+LATEST_CHECKPOINT_QUERY = (
+    "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+    "ORDER BY checkpoint_id DESC LIMIT 1"
+)
+
+# 一条 SQL 语句及其参数行
+Statement = Tuple[str, List[tuple]]
+
+
+class _DeferredExt:
+    """分页读取时暂不还原的 msgpack 扩展值（消息等对象），只保留编码"""
+
+    __slots__ = ("code", "data")
+
+    def __init__(self, code: int, data: bytes):
+        self.code = code
+        self.data = data
+
+
+def _is_busy_error(error: BaseException) -> bool:
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class InstrumentedLock(asyncio.Lock):
+    """统计等待次数和等待时长的 asyncio.Lock"""
+
+    def __init__(self, metrics: Dict[str, Any]):
+        super().__init__()
+        self._metrics = metrics
+
+    async def acquire(self):
+        if not self.locked():
+            return await super().acquire()
+        self._metrics["lock_waits"] += 1
+        start = time.perf_counter()
+        try:
+            return await super().acquire()
+        finally:
+            self._metrics["lock_wait_seconds"] += time.perf_counter() - start
+
+
+class SQLiteConnectionManager:
+    """单个 SQLite 数据库文件的进程级连接"""
+
+    def __init__(self, db_path: str, options: Optional[Dict[str, Any]] = None):
+        self.db_path = db_path
+        self.options = {**DEFAULT_CONNECTION_OPTIONS, **(options or {})}
+        self.metrics = {
+            "connections_opened": 0,
+            "lock_waits": 0,
+            "lock_wait_seconds": 0.0,
+            "busy_retries": 0,
+            "busy_failures": 0,
+        }
+        # 所有使用该连接的存储器共享同一把锁，保证同一时刻只有一个事务
+        self.lock = InstrumentedLock(self.metrics)
+        self.conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+
+    async def get_connection(self) -> aiosqlite.Connection:
+        """获取连接，首次调用时打开并应用 PRAGMA"""
+        if self.conn is not None:
+            return self.conn
+        async with self._open_lock:
+            if self.conn is None:
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+                connect_kwargs = {k: self.options[k] for k in CONNECT_OPTION_KEYS if k in self.options}
+                conn = await aiosqlite.connect(self.db_path, **connect_kwargs)
+                for key in PRAGMA_OPTION_KEYS:
+                    value = self.options.get(key)
+                    if value is not None:
+                        await conn.execute(f"PRAGMA {key}={value}")
+                self.metrics["connections_opened"] += 1
+                self.conn = conn
+        return self.conn
+
+    def print_metrics(self):
+        m = self.metrics
+        print(f"📊 检查点数据库 {self.db_path}: 锁等待 {m['lock_waits']} 次 ({m['lock_wait_seconds']:.2f}s), "
+              f"忙重试 {m['busy_retries']} 次, 重试失败 {m['busy_failures']} 次")
+
+    async def aclose(self):
+        """关闭连接"""
+        _managers.pop(os.path.abspath(self.db_path), None)
+        if self.conn is not None:
+            self.print_metrics()
+            await self.conn.close()
+            self.conn = None
+            print(f"📝 检查点数据库连接已关闭: {self.db_path}")
+
+
+_managers: Dict[str, SQLiteConnectionManager] = {}
+
+
+def get_connection_manager(db_path: str, options: Optional[Dict[str, Any]] = None) -> SQLiteConnectionManager:
+    """获取数据库文件对应的进程级连接管理器（同一文件只创建一个）"""
+    key = os.path.abspath(db_path)
+    if key not in _managers:
+        _managers[key] = SQLiteConnectionManager(db_path, options)
+    return _managers[key]
+
+
+def find_connection_manager(db_path: str) -> Optional[SQLiteConnectionManager]:
+    """本进程中数据库文件已有的连接管理器，没有时返回 None（不创建）"""
+    return _managers.get(os.path.abspath(db_path))
+
+
+async def close_all_connection_managers():
+    """关闭进程内所有检查点数据库连接"""
+    for manager in list(_managers.values()):
+        await manager.aclose()
+
+
+class TunedAsyncSqliteSaver(AsyncSqliteSaver):
+    """使用共享连接管理器的 AsyncSqliteSaver，写入遇到数据库忙时退避重试"""
+
+    def __init__(self, conn: aiosqlite.Connection, manager: SQLiteConnectionManager,
+                 max_busy_retries: int = DEFAULT_MAX_BUSY_RETRIES, **kwargs):
+        super().__init__(conn, **kwargs)
+        self.manager = manager
+        self.lock = manager.lock
+        self.max_busy_retries = max_busy_retries
+        self._catalog_ready = False
+        self._page_serde = None
+
+    @classmethod
+    async def from_manager(cls, manager: SQLiteConnectionManager, **kwargs) -> "TunedAsyncSqliteSaver":
+        return cls(await manager.get_connection(), manager, **kwargs)
+
+    async def _with_busy_retry(self, operation, *args, **kwargs):
+        for attempt in range(self.max_busy_retries + 1):
+            try:
+                return await operation(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e):
+                    raise
+                if attempt == self.max_busy_retries:
+                    self.manager.metrics["busy_failures"] += 1
+                    raise
+                self.manager.metrics["busy_retries"] += 1
+                await asyncio.sleep(BUSY_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+    async def setup(self) -> None:
+        await super().setup()
+        if self._catalog_ready:
+            return
+        async with self.lock:
+            async with self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'thread_catalog'"
+            ) as cur:
+                exists = await cur.fetchone() is not None
+            # 会话目录查询时排除被配额归档的会话，两张表一起创建
+            for ddl in CATALOG_DDL + (ARCHIVED_SESSIONS_DDL,):
+                await self.conn.execute(ddl)
+            if not exists:
+                async with self.conn.execute(BACKFILL_QUERY) as cur:
+                    rows = [backfill_row(*row) for row in await cur.fetchall()]
+                await self.conn.executemany(CATALOG_UPSERT, rows)
+            await self.conn.commit()
+        self._catalog_ready = True
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        # 与批量写入相同的语句，检查点和会话目录在同一个事务中写入
+        await self.aput_batch([("put", config, checkpoint, metadata, new_versions)])
+        return {
+            "configurable": {
+                "thread_id": config["configurable"]["thread_id"],
+                "checkpoint_ns": config["configurable"]["checkpoint_ns"],
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = ""):
+        return await self._with_busy_retry(super().aput_writes, config, writes, task_id, task_path)
+
+    def _put_statements(self, config, checkpoint, metadata) -> List[Statement]:
+        """写入一个检查点的全部语句：检查点行和会话目录行"""
+        return self._checkpoint_statements(config, checkpoint, metadata) + self._catalog_statements(config, checkpoint)
+
+    def _catalog_statements(self, config, checkpoint) -> List[Statement]:
+        row = catalog_row(config, checkpoint)
+        return [(CATALOG_UPSERT, [row])] if row is not None else []
+
+    def _checkpoint_statements(self, config, checkpoint, metadata) -> List[Statement]:
+        """与 AsyncSqliteSaver.aput 相同的检查点写入语句"""
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        serialized_metadata = self.jsonplus_serde.dumps(get_checkpoint_metadata(config, metadata))
+        row = (
+            str(config["configurable"]["thread_id"]),
+            config["configurable"]["checkpoint_ns"],
+            checkpoint["id"],
+            config["configurable"].get("checkpoint_id"),
+            type_,
+            serialized,
+            serialized_metadata,
+        )
+        return [(CHECKPOINT_INSERT, [row])]
+
+    def _writes_statements(self, config, writes, task_id: str) -> List[Statement]:
+        """与 aput_writes 相同的 writes 写入语句"""
+        query = WRITES_REPLACE if all(w[0] in WRITES_IDX_MAP for w in writes) else WRITES_IGNORE
+        configurable = config["configurable"]
+        rows = [
+            (
+                str(configurable["thread_id"]),
+                str(configurable["checkpoint_ns"]),
+                str(configurable["checkpoint_id"]),
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                *self.serde.dumps_typed(value),
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ]
+        return [(query, rows)]
+
+    def _batch_statements(self, operations: Sequence[tuple]) -> List[Statement]:
+        statements: List[Statement] = []
+        for operation in operations:
+            if operation[0] == "put":
+                _, config, checkpoint, metadata, _ = operation
+                statements.extend(self._put_statements(config, checkpoint, metadata))
+            else:
+                _, config, writes, task_id, _ = operation
+                statements.extend(self._writes_statements(config, writes, task_id))
+        return statements
+
+    async def _apply_statements(self, statements: List[Statement]):
+        async with self.lock:
+            try:
+                for query, rows in statements:
+                    if rows:
+                        await self.conn.executemany(query, rows)
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                raise
+
+    async def aput_batch(self, operations: Sequence[tuple]):
+        """
+        在一个事务中按顺序写入多个操作，只提交一次。
+
+        operations 中的元素为 ("put", config, checkpoint, metadata, new_versions)
+        或 ("writes", config, writes, task_id, task_path)，参数与 aput / aput_writes 相同。
+        """
+        await self.setup()
+        statements = self._batch_statements(operations)
+        await self._with_busy_retry(self._apply_statements, statements)
+        return statements
+
+    async def aget_message_page(self, config, limit: int, offset: int = 0) -> Optional[Tuple[List[Any], int]]:
+        """
+        最新检查点末尾的一页消息（跳过最新的 offset 条，取前面的 limit 条），返回 (消息, 消息总数)
+
+        只读取最新检查点一行，不读取 writes；线程没有检查点时返回 None。
+        msgpack 格式的检查点解析时不构造消息对象，只还原这一页的消息。
+        """
+        await self.setup()
+        configurable = config["configurable"]
+        async with self.lock:
+            async with self.conn.execute(
+                LATEST_CHECKPOINT_QUERY,
+                (str(configurable["thread_id"]), configurable.get("checkpoint_ns", "")),
+            ) as cur:
+                row = await cur.fetchone()
+        if row is None:
+            return None
+        page_serde = self._deferred_serde()
+        checkpoint = (page_serde or self.serde).loads_typed(row)
+        messages = checkpoint["channel_values"].get(MESSAGES_CHANNEL)
+        page, total = await self._message_page(str(configurable["thread_id"]), messages, limit, offset)
+        if page_serde is not None:
+            page = [self.serde._unpack_ext_hook(item.code, item.data) if isinstance(item, _DeferredExt) else item
+                    for item in page]
+        return page, total
+
+    def _deferred_serde(self):
+        """
+        把扩展值保留为 _DeferredExt 的序列化器副本，序列化器不是 JsonPlusSerializer 时返回 None
+
+        消息在 msgpack 中是扩展类型，完整解析会为会话中的每条消息构造对象；
+        副本只解析检查点的结构，分页后再用原序列化器还原这一页的消息。
+        """
+        if self._page_serde is None and hasattr(self.serde, "_unpack_ext_hook"):
+            self._page_serde = copy.copy(self.serde)
+            self._page_serde._unpack_ext_hook = _DeferredExt
+        return self._page_serde
+
+    async def _message_page(self, thread_id: str, messages: Any, limit: int, offset: int):
+        return slice_page(messages, limit, offset)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await super().adelete_thread(thread_id)
+        await self.setup()
+        async with self.lock:
+            for table in ("thread_catalog", "archived_sessions"):
+                await self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+    async def aclose(self):
+        await self.manager.aclose()
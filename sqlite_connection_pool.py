@@ -0,0 +1,270 @@
+# sqlite_connection_pool.py
+"""
+Chainlit 数据层的 SQLite 连接池
+
+SQLiteDataLayer 的方法在线程池中同步执行，原先每次调用都新开一个 sqlite3 连接，
+并在构造时执行全部建表语句。SQLiteConnectionPool 为每个数据库文件在进程内保留长连接：
+
+- 一个写连接，由锁保证同一时刻只有一个写事务；
+- 若干读连接（按需打开，最多 reader_connections 个），WAL 模式下读取不阻塞写入；
+- 打开时应用 journal_mode、synchronous、busy_timeout、cache_size、mmap_size；
+- initialize() 在每个进程内只执行一次（用于建表和迁移）；
+- run() 在连接池专用的有界线程池中执行同步数据库函数，不占用事件循环的默认线程池，
+  并记录排队深度和排队等待时间，数据库饱和时在日志和指标中可见。
+
+同一文件通过 get_connection_pool 只创建一个连接池，进程退出时由 close_all_connection_pools 关闭。
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_READER_CONNECTIONS = 4
+# 排队任务数达到该值时记录警告，之后排队数每翻一倍再记录一次
+DEFAULT_QUEUE_WARNING_DEPTH = 32
+
+# 与检查点数据库的 connection_options 含义相同，可在 persistence_config.json 的 chainlit_data_layer 中覆盖
+DEFAULT_POOL_OPTIONS: Dict[str, Any] = {
+    "timeout": 30,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -8000,
+    "mmap_size": 67108864,
+}
+
+PRAGMA_OPTION_KEYS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size")
+
+
+class SQLiteConnectionPool:
+    """单个 SQLite 数据库文件的进程级连接池：一个写连接和若干读连接"""
+
+    def __init__(self, db_path: str, reader_connections: int = DEFAULT_READER_CONNECTIONS,
+                 options: Optional[Dict[str, Any]] = None, executor_workers: Optional[int] = None,
+                 queue_warning_depth: int = DEFAULT_QUEUE_WARNING_DEPTH):
+        self.db_path = db_path
+        self.reader_connections = max(int(reader_connections), 1)
+        self.options = {**DEFAULT_POOL_OPTIONS, **(options or {})}
+        # 默认每个读连接一个线程再加一个写线程，线程数超过连接数只会让多出的线程阻塞在 acquire 上
+        self.executor_workers = max(int(executor_workers or self.reader_connections + 1), 1)
+        self.queue_warning_depth = queue_warning_depth
+        self._next_warning_depth = queue_warning_depth
+        self.metrics = {
+            "connections_opened": 0,
+            "reads": 0,
+            "writes": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "write_waits": 0,
+            "write_wait_seconds": 0.0,
+            "tasks": 0,
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "queue_wait_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0,
+        }
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened_readers = 0
+        self._open_lock = threading.Lock()
+        self._initialized = False
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        # 连接在线程池的不同线程间复用，由写锁和读连接队列保证同一时刻只有一个线程使用
+        conn = sqlite3.connect(self.db_path, timeout=self.options.get("timeout", 30), check_same_thread=False)
+        for key in PRAGMA_OPTION_KEYS:
+            value = self.options.get(key)
+            if value is not None:
+                conn.execute(f"PRAGMA {key}={value}")
+        self.metrics["connections_opened"] += 1
+        return conn
+
+    def initialize(self, init: Callable[[sqlite3.Connection], None]):
+        """在写连接上执行一次初始化（建表、迁移），同一进程内后续调用直接返回"""
+        if self._initialized:
+            return
+        with self.connection(write=True) as conn:
+            if not self._initialized:
+                init(conn)
+                conn.commit()
+                self._initialized = True
+
+    def acquire(self, write: bool = False) -> sqlite3.Connection:
+        """取出一个连接，用完后必须调用 release；写连接在释放前独占"""
+        if self._closed:
+            raise RuntimeError(f"连接池已关闭: {self.db_path}")
+        start = time.perf_counter()
+        if write:
+            if not self._write_lock.acquire(blocking=False):
+                self._write_lock.acquire()
+                waited = time.perf_counter() - start
+                self.metrics["waits"] += 1
+                self.metrics["wait_seconds"] += waited
+                self.metrics["write_waits"] += 1
+                self.metrics["write_wait_seconds"] += waited
+            if self._writer is None:
+                try:
+                    self._writer = self._connect()
+                except Exception:
+                    self._write_lock.release()
+                    raise
+            self.metrics["writes"] += 1
+            return self._writer
+
+        self.metrics["reads"] += 1
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._open_lock:
+            can_open = self._opened_readers < self.reader_connections
+            if can_open:
+                self._opened_readers += 1
+        if can_open:
+            try:
+                return self._connect()
+            except Exception:
+                with self._open_lock:
+                    self._opened_readers -= 1
+                raise
+        self.metrics["waits"] += 1
+        conn = self._readers.get()
+        self.metrics["wait_seconds"] += time.perf_counter() - start
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接，未提交的事务回滚，避免长连接带着打开的事务被下一个调用者使用"""
+        if conn.in_transaction:
+            conn.rollback()
+        if conn is self._writer:
+            self._write_lock.release()
+        elif self._closed:
+            conn.close()
+        else:
+            self._readers.put(conn)
+
+    @contextmanager
+    def connection(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire(write)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.executor_workers,
+                        thread_name_prefix=f"sqlite-{os.path.basename(self.db_path)}",
+                    )
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """在连接池的专用线程池中执行同步数据库函数，统计排队深度和从提交到开始执行的等待时间"""
+        if self._closed:
+            raise RuntimeError(f"连接池已关闭: {self.db_path}")
+        submitted = time.perf_counter()
+        with self._executor_lock:
+            m = self.metrics
+            m["tasks"] += 1
+            m["queue_depth"] += 1
+            depth = m["queue_depth"]
+            m["max_queue_depth"] = max(m["max_queue_depth"], depth)
+            warn = depth >= self._next_warning_depth
+            if warn:
+                self._next_warning_depth = depth * 2
+        if warn:
+            logger.warning(f"⚠️ Chainlit 数据库 {self.db_path} 排队任务达到 {depth} 个"
+                           f"（线程池 {self.executor_workers} 个线程），数据库访问已饱和")
+
+        def job():
+            waited = time.perf_counter() - submitted
+            with self._executor_lock:
+                m = self.metrics
+                m["queue_depth"] -= 1
+                m["queue_wait_seconds"] += waited
+                m["max_queue_wait_seconds"] = max(m["max_queue_wait_seconds"], waited)
+            return func(*args)
+
+        try:
+            future = self._get_executor().submit(job)
+        except RuntimeError:
+            # 线程池已关闭，任务不会执行
+            with self._executor_lock:
+                self.metrics["queue_depth"] -= 1
+            raise
+        return await asyncio.wrap_future(future)
+
+    def print_metrics(self):
+        m = self.metrics
+        avg_wait_ms = m["queue_wait_seconds"] / m["tasks"] * 1000 if m["tasks"] else 0.0
+        print(f"📊 Chainlit 数据库 {self.db_path}: 读 {m['reads']} 次, 写 {m['writes']} 次, "
+              f"打开连接 {m['connections_opened']} 个, 等待连接 {m['waits']} 次 ({m['wait_seconds']:.2f}s)")
+        print(f"   🧵 数据库线程池 {self.executor_workers} 个线程: 任务 {m['tasks']} 个, "
+              f"最大排队 {m['max_queue_depth']} 个, 平均排队 {avg_wait_ms:.2f} ms, "
+              f"最长排队 {m['max_queue_wait_seconds'] * 1000:.1f} ms")
+
+    def close(self):
+        """等待线程池中的任务完成后关闭所有空闲连接；仍被借出的读连接在归还时关闭"""
+        _pools.pop(os.path.abspath(self.db_path), None)
+        self._closed = True
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.print_metrics()
+
+
+_pools: Dict[str, SQLiteConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(db_path: str, reader_connections: int = DEFAULT_READER_CONNECTIONS,
+                        options: Optional[Dict[str, Any]] = None, executor_workers: Optional[int] = None,
+                        queue_warning_depth: int = DEFAULT_QUEUE_WARNING_DEPTH) -> SQLiteConnectionPool:
+    """获取数据库文件对应的进程级连接池（同一文件只创建一个，参数以首次创建时为准）"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SQLiteConnectionPool(db_path, reader_connections, options,
+                                               executor_workers, queue_warning_depth)
+        return _pools[key]
+
+
+def find_connection_pool(db_path: str) -> Optional[SQLiteConnectionPool]:
+    """本进程中数据库文件已有的连接池，没有时返回 None（不创建）"""
+    with _pools_lock:
+        return _pools.get(os.path.abspath(db_path))
+
+
+def close_all_connection_pools():
+    """关闭进程内所有 Chainlit 数据库连接池"""
+    for pool in list(_pools.values()):
+        pool.close()
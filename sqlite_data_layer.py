@@ -1,18 +1,26 @@
 """
 SQLite 兼容的 Chainlit 数据层实现
 解决 SQLite 不支持数组类型的问题
+
+数据库连接来自 sqlite_connection_pool 的进程级连接池（一个写连接和若干读连接，WAL 模式），
+同步的数据库操作在连接池专用的有界线程池中执行（不占用事件循环的默认线程池），
+建表和迁移在每个进程中只执行一次；索引等结构变更见 chainlit_schema 的版本化迁移。
 """
 
+import base64
+import binascii
 import json
 import sqlite3
-import asyncio
 from typing import Dict, List, Optional, Any, TypedDict
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 import logging
 
 import chainlit as cl
 
+from chainlit_schema import SCHEMA_VERSION, apply_migrations, schema_version
+from sqlite_connection_pool import DEFAULT_QUEUE_WARNING_DEPTH, DEFAULT_READER_CONNECTIONS, get_connection_pool
+
 # 配置详细的日志记录
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,10 +29,92 @@ from chainlit.types import (
     ThreadDict,
     ThreadFilter,
     FeedbackDict,
+    PageInfo,
     PaginatedResponse,
     Pagination
 )
 
+DEFAULT_DATABASE_PATH = "./data/chainlit_history.db"
+
+# 按线程读取步骤和元素，使用 chainlit_schema 迁移中建立的 threadId 索引
+THREAD_STEPS_QUERY = """
+    SELECT id, name, type, threadId, parentId, disableFeedback, streaming,
+           waitForAnswer, isError, metadata, tags, input, output, createdAt,
+           start, end, generation, showInput, language, indent, defaultOpen, command
+    FROM steps WHERE threadId = ? ORDER BY createdAt ASC
+"""
+THREAD_ELEMENTS_QUERY = """
+    SELECT id, threadId, stepId, name, type, url, objectKey, size,
+           page, language, forId, mime, chainlitKey, display, props
+    FROM elements WHERE threadId = ?
+"""
+
+# 线程配额：超出 max_sessions_per_user 时归档（archive）或删除（delete）最久未活动的线程
+QUOTA_POLICIES = ("archive", "delete")
+
+# 每个用户未归档的线程数由触发器维护，创建线程时检查配额只需按主键读一行
+THREAD_QUOTA_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS user_thread_counts (
+        userId TEXT PRIMARY KEY,
+        activeThreads INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_threads_user_active ON threads (userId, archived, lastActiveAt)",
+    """
+    CREATE TRIGGER IF NOT EXISTS threads_count_insert AFTER INSERT ON threads
+    WHEN NEW.userId IS NOT NULL AND NEW.archived = 0
+    BEGIN
+        INSERT INTO user_thread_counts (userId, activeThreads) VALUES (NEW.userId, 1)
+        ON CONFLICT (userId) DO UPDATE SET activeThreads = activeThreads + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS threads_count_delete AFTER DELETE ON threads
+    WHEN OLD.userId IS NOT NULL AND OLD.archived = 0
+    BEGIN
+        UPDATE user_thread_counts SET activeThreads = activeThreads - 1 WHERE userId = OLD.userId;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS threads_count_update AFTER UPDATE OF userId, archived ON threads
+    BEGIN
+        UPDATE user_thread_counts SET activeThreads = activeThreads - 1
+        WHERE OLD.userId IS NOT NULL AND OLD.archived = 0 AND userId = OLD.userId;
+        INSERT INTO user_thread_counts (userId, activeThreads)
+        SELECT NEW.userId, 1 WHERE NEW.userId IS NOT NULL AND NEW.archived = 0
+        ON CONFLICT (userId) DO UPDATE SET activeThreads = activeThreads + 1;
+    END
+    """,
+    # 新步骤写入时更新线程的最后活动时间，配额按它选出最久未活动的线程
+    """
+    CREATE TRIGGER IF NOT EXISTS steps_touch_thread AFTER INSERT ON steps
+    BEGIN
+        UPDATE threads SET lastActiveAt = NEW.createdAt
+        WHERE id = NEW.threadId AND (lastActiveAt IS NULL OR lastActiveAt < NEW.createdAt);
+    END
+    """,
+]
+
+def _encode_thread_cursor(row) -> str:
+    """list_threads 的游标：上一页最后一个线程的 [createdAt, id]，JSON 编码后再做 URL 安全的 base64"""
+    payload = json.dumps([row[1] or "", row[0]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def _decode_thread_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """游标解析为 (createdAt, id)；没有游标或无法解析（如旧版本的数字偏移或被篡改的游标）时从第一页开始"""
+    if not cursor:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+    if not (isinstance(value, list) and len(value) == 2 and all(isinstance(v, str) for v in value)):
+        return None
+    return value[0], value[1]
+
+
 # Chainlit 类型定义
 class PersistedUserDict(dict):
     """模拟 Chainlit 的 PersistedUser 类型，继承自字典但具有属性访问"""
@@ -92,13 +182,28 @@ class UserDict(TypedDict):
 class SQLiteDataLayer(BaseDataLayer):
     """SQLite 兼容的数据层实现"""
     
-    def __init__(self, db_path: str = "./data/chainlit_history.db"):
+    def __init__(self, db_path: str = DEFAULT_DATABASE_PATH,
+                 max_threads_per_user: Optional[int] = None, quota_policy: str = "archive",
+                 reader_connections: int = DEFAULT_READER_CONNECTIONS,
+                 connection_options: Optional[Dict[str, Any]] = None,
+                 executor_workers: Optional[int] = None,
+                 queue_warning_depth: int = DEFAULT_QUEUE_WARNING_DEPTH):
         self.db_path = db_path
+        # 同一数据库文件的所有数据层实例共享一个进程级连接池（一个写连接、若干读连接和专用线程池）
+        self.pool = get_connection_pool(db_path, reader_connections, connection_options,
+                                        executor_workers, queue_warning_depth)
+        # 每个用户未归档线程数的上限，None 表示不限制
+        self.max_threads_per_user = max_threads_per_user
+        if quota_policy not in QUOTA_POLICIES:
+            raise ValueError(f"不支持的配额策略: {quota_policy}，可选 {', '.join(QUOTA_POLICIES)}")
+        self.quota_policy = quota_policy
         self.init_database()
     
     def init_database(self):
-        """初始化数据库表结构"""
-        conn = sqlite3.connect(self.db_path)
+        """初始化数据库表结构（每个进程中每个数据库文件只执行一次）"""
+        self.pool.initialize(self._create_schema)
+
+    def _create_schema(self, conn: sqlite3.Connection):
         cursor = conn.cursor()
         
         # 创建用户表
@@ -121,6 +226,8 @@ class SQLiteDataLayer(BaseDataLayer):
                 userIdentifier TEXT,
                 tags TEXT,
                 metadata TEXT,
+                lastActiveAt TEXT,
+                archived INTEGER NOT NULL DEFAULT 0,
                 FOREIGN KEY (userId) REFERENCES users(id) ON DELETE CASCADE
             )
         """)
@@ -159,6 +266,7 @@ class SQLiteDataLayer(BaseDataLayer):
             CREATE TABLE IF NOT EXISTS elements (
                 id TEXT PRIMARY KEY,
                 threadId TEXT,
+                stepId TEXT,
                 type TEXT,
                 url TEXT,
                 chainlitKey TEXT,
@@ -186,9 +294,54 @@ class SQLiteDataLayer(BaseDataLayer):
                 FOREIGN KEY (threadId) REFERENCES threads(id) ON DELETE CASCADE
             )
         """)
-        
+
+        # get_thread 按 stepId 读取元素，早期建表语句缺少这一列
+        if "stepId" not in {row[1] for row in cursor.execute("PRAGMA table_info(elements)")}:
+            cursor.execute("ALTER TABLE elements ADD COLUMN stepId TEXT")
+
         conn.commit()
-        conn.close()
+
+        # 结构变更（列、索引）按版本迁移，配额的触发器依赖迁移补齐的列
+        applied = apply_migrations(conn)
+        if applied:
+            logger.info(f"🗄️ Chainlit 数据库已迁移到版本 {SCHEMA_VERSION}（应用 {applied}）: {self.db_path}")
+        elif schema_version(conn) > SCHEMA_VERSION:
+            logger.warning(f"⚠️ Chainlit 数据库版本 {schema_version(conn)} 高于当前代码支持的 {SCHEMA_VERSION}: {self.db_path}")
+
+        self._init_thread_quota(conn.cursor())
+
+    def _init_thread_quota(self, cursor):
+        """线程配额的每用户线程计数表和触发器（所需的列由 chainlit_schema 的迁移补齐），首次创建时回填计数"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_thread_counts'")
+        counts_exist = cursor.fetchone() is not None
+        for statement in THREAD_QUOTA_SCHEMA:
+            cursor.execute(statement)
+        if not counts_exist:
+            cursor.execute("""
+                INSERT INTO user_thread_counts (userId, activeThreads)
+                SELECT userId, COUNT(*) FROM threads
+                WHERE userId IS NOT NULL AND archived = 0 GROUP BY userId
+            """)
+
+    @classmethod
+    def from_config(cls, persistence_config: Dict[str, Any],
+                    db_path: Optional[str] = None) -> "SQLiteDataLayer":
+        """
+        按配置创建数据层：session_management 的 max_sessions_per_user 和 quota_policy，
+        chainlit_data_layer 的 database_path、reader_connections、connection_options、
+        executor_workers 和 queue_warning_depth
+        """
+        session_config = persistence_config.get("session_management", {})
+        layer_config = persistence_config.get("chainlit_data_layer", {})
+        return cls(
+            db_path=db_path or layer_config.get("database_path", DEFAULT_DATABASE_PATH),
+            max_threads_per_user=session_config.get("max_sessions_per_user"),
+            quota_policy=session_config.get("quota_policy", "archive"),
+            reader_connections=layer_config.get("reader_connections", DEFAULT_READER_CONNECTIONS),
+            connection_options=layer_config.get("connection_options"),
+            executor_workers=layer_config.get("executor_workers"),
+            queue_warning_depth=layer_config.get("queue_warning_depth", DEFAULT_QUEUE_WARNING_DEPTH),
+        )
     
     def _serialize_data(self, data: Any) -> str:
         """序列化复杂数据为 JSON 字符串"""
@@ -210,7 +363,7 @@ class SQLiteDataLayer(BaseDataLayer):
     async def create_user(self, user) -> Optional[PersistedUserDict]:
         """创建用户"""
         def _create_user():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=True)
             cursor = conn.cursor()
             try:
                 # 处理输入参数（可能是字典或对象）
@@ -252,14 +405,14 @@ class SQLiteDataLayer(BaseDataLayer):
             except sqlite3.IntegrityError:
                 return None
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _create_user)
+        return await self.pool.run(_create_user)
     
     async def get_user(self, identifier: str) -> Optional[PersistedUserDict]:
         """获取用户"""
         def _get_user():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=False)
             cursor = conn.cursor()
             try:
                 cursor.execute("SELECT * FROM users WHERE identifier = ?", (identifier,))
@@ -280,9 +433,9 @@ class SQLiteDataLayer(BaseDataLayer):
                     )
                 return None
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _get_user)
+        return await self.pool.run(_get_user)
     
     async def create_thread(self, thread: ThreadDict) -> ThreadDict:
         """创建线程 - 带重试逻辑处理UNIQUE约束冲突"""
@@ -296,22 +449,14 @@ class SQLiteDataLayer(BaseDataLayer):
             current_thread = thread.copy()
 
             for attempt in range(max_retries):
-                conn = sqlite3.connect(self.db_path)
+                conn = self.pool.acquire(write=True)
                 cursor = conn.cursor()
                 try:
                     logger.info(f"🔥 正在插入线程到数据库: {current_thread['id']} (尝试 {attempt + 1}/{max_retries})")
-                    cursor.execute("""
-                        INSERT INTO threads (id, createdAt, name, userId, userIdentifier, tags, metadata)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        current_thread["id"],
-                        current_thread.get("createdAt"),
-                        current_thread.get("name"),
-                        current_thread.get("userId"),
-                        current_thread.get("userIdentifier"),
-                        self._serialize_data(current_thread.get("tags", [])),
-                        self._serialize_data(current_thread.get("metadata", {}))
-                    ))
+                    # 配额检查和插入在同一个写事务中，并发创建不会超出配额
+                    cursor.execute("BEGIN IMMEDIATE")
+                    self._enforce_thread_quota(cursor, current_thread.get("userId"))
+                    self._insert_thread(cursor, current_thread)
                     conn.commit()
                     logger.info(f"✅ 线程创建成功: {current_thread['id']}")
                     return current_thread
@@ -322,7 +467,7 @@ class SQLiteDataLayer(BaseDataLayer):
                         new_id = f"{old_id}_{uuid.uuid4().hex[:4]}"
                         current_thread["id"] = new_id
                         logger.warning(f"⚠️ 线程ID冲突，重试使用新ID: {old_id} -> {new_id}")
-                        conn.close()
+                        # finally 中归还连接（回滚未完成的事务）
                         continue
                     else:
                         logger.error(f"❌ 创建线程失败 (UNIQUE约束): {e}")
@@ -331,17 +476,60 @@ class SQLiteDataLayer(BaseDataLayer):
                     logger.error(f"❌ 创建线程失败: {e}")
                     raise
                 finally:
-                    conn.close()
+                    self.pool.release(conn)
 
             # 如果所有重试都失败了
             raise Exception(f"创建线程失败：经过{max_retries}次重试仍然存在ID冲突")
 
-        return await asyncio.get_event_loop().run_in_executor(None, _create_thread_with_retry)
+        return await self.pool.run(_create_thread_with_retry)
     
+    def _insert_thread(self, cursor, thread: Dict[str, Any]):
+        # 线程列表按 (createdAt, id) 分页，创建时间不能为空
+        created_at = thread.get("createdAt") or datetime.now(timezone.utc).isoformat()
+        cursor.execute("""
+            INSERT INTO threads (id, createdAt, name, userId, userIdentifier, tags, metadata, lastActiveAt)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            thread["id"],
+            created_at,
+            thread.get("name"),
+            thread.get("userId"),
+            thread.get("userIdentifier"),
+            self._serialize_data(thread.get("tags", [])),
+            self._serialize_data(thread.get("metadata", {})),
+            created_at
+        ))
+
+    def _enforce_thread_quota(self, cursor, user_id: Optional[str]) -> List[str]:
+        """为即将创建的线程腾出配额，返回被归档或删除的线程 ID（需在写事务中调用）"""
+        if not self.max_threads_per_user or not user_id:
+            return []
+        cursor.execute("SELECT activeThreads FROM user_thread_counts WHERE userId = ?", (user_id,))
+        row = cursor.fetchone()
+        excess = (row[0] if row else 0) - self.max_threads_per_user + 1
+        if excess <= 0:
+            return []
+
+        cursor.execute("""
+            SELECT id FROM threads WHERE userId = ? AND archived = 0
+            ORDER BY lastActiveAt ASC LIMIT ?
+        """, (user_id, excess))
+        victims = [r[0] for r in cursor.fetchall()]
+        placeholders = ",".join("?" * len(victims))
+        if self.quota_policy == "archive":
+            cursor.execute(f"UPDATE threads SET archived = 1 WHERE id IN ({placeholders})", victims)
+        else:
+            for table in ("steps", "elements", "feedbacks"):
+                cursor.execute(f"DELETE FROM {table} WHERE threadId IN ({placeholders})", victims)
+            cursor.execute(f"DELETE FROM threads WHERE id IN ({placeholders})", victims)
+        action = "归档" if self.quota_policy == "archive" else "删除"
+        logger.info(f"📦 用户 {user_id} 超出线程配额 {self.max_threads_per_user}，{action}最久未活动的线程: {victims}")
+        return victims
+
     async def get_thread(self, thread_id: str) -> Optional[ThreadDict]:
         """获取线程（包含完整的步骤和元素）"""
         def _get_thread():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=False)
             cursor = conn.cursor()
             try:
                 # 获取线程基本信息
@@ -360,12 +548,7 @@ class SQLiteDataLayer(BaseDataLayer):
                     row = (thread_id, None, "历史对话", None, "admin", "[]", "{}")
 
                 # 获取线程的所有步骤（按正确的列顺序）
-                cursor.execute("""
-                    SELECT id, name, type, threadId, parentId, disableFeedback, streaming,
-                           waitForAnswer, isError, metadata, tags, input, output, createdAt,
-                           start, end, generation, showInput, language, indent, defaultOpen, command
-                    FROM steps WHERE threadId = ? ORDER BY createdAt ASC
-                """, (thread_id,))
+                cursor.execute(THREAD_STEPS_QUERY, (thread_id,))
                 step_rows = cursor.fetchall()
 
                 steps = []
@@ -397,11 +580,7 @@ class SQLiteDataLayer(BaseDataLayer):
                     steps.append(step)
 
                 # 获取线程的所有元素（按正确的列顺序）
-                cursor.execute("""
-                    SELECT id, threadId, stepId, name, type, url, objectKey, size,
-                           page, language, forId, mime, chainlitKey, display, props
-                    FROM elements WHERE threadId = ?
-                """, (thread_id,))
+                cursor.execute(THREAD_ELEMENTS_QUERY, (thread_id,))
                 element_rows = cursor.fetchall()
 
                 elements = []
@@ -437,18 +616,40 @@ class SQLiteDataLayer(BaseDataLayer):
                     "elements": elements
                 }
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _get_thread)
+        return await self.pool.run(_get_thread)
     
     async def update_thread(self, thread_id: str, name: Optional[str] = None, 
                           user_id: Optional[str] = None, tags: Optional[List[str]] = None, 
                           metadata: Optional[Dict] = None) -> Optional[ThreadDict]:
         """更新线程"""
         def _update_thread():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=True)
             cursor = conn.cursor()
             try:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT 1 FROM threads WHERE id = ?", (thread_id,))
+                if cursor.fetchone() is None:
+                    # Chainlit 2.x 通过 update_thread 创建线程，与 create_thread 一样检查配额
+                    user_identifier = None
+                    if user_id is not None:
+                        cursor.execute("SELECT identifier FROM users WHERE id = ?", (user_id,))
+                        row = cursor.fetchone()
+                        user_identifier = row[0] if row else None
+                    self._enforce_thread_quota(cursor, user_id)
+                    self._insert_thread(cursor, {
+                        "id": thread_id,
+                        "createdAt": datetime.now(timezone.utc).isoformat(),
+                        "name": name,
+                        "userId": user_id,
+                        "userIdentifier": user_identifier,
+                        "tags": tags or [],
+                        "metadata": metadata or {}
+                    })
+                    conn.commit()
+                    return self._get_thread_sync(cursor, thread_id)
+
                 updates = []
                 params = []
                 
@@ -470,13 +671,13 @@ class SQLiteDataLayer(BaseDataLayer):
                     cursor.execute(f"""
                         UPDATE threads SET {', '.join(updates)} WHERE id = ?
                     """, params)
-                    conn.commit()
+                conn.commit()
                 
                 return self._get_thread_sync(cursor, thread_id)
             finally:
-                conn.close()
+                self.pool.release(conn)
         
-        return await asyncio.get_event_loop().run_in_executor(None, _update_thread)
+        return await self.pool.run(_update_thread)
     
     def _get_thread_sync(self, cursor, thread_id: str) -> Optional[ThreadDict]:
         """同步获取线程（内部使用）"""
@@ -497,38 +698,35 @@ class SQLiteDataLayer(BaseDataLayer):
     async def list_threads(self, pagination: Pagination, thread_filter: Optional[ThreadFilter] = None) -> PaginatedResponse[ThreadDict]:
         """列出线程"""
         def _list_threads():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=False)
             cursor = conn.cursor()
             try:
-                # 构建查询
-                where_clause = ""
+                # 超出配额被归档的线程不再出现在侧边栏
+                conditions = ["archived = 0"]
                 params = []
                 if thread_filter and thread_filter.userId:
-                    where_clause = "WHERE userId = ?"
+                    conditions.append("userId = ?")
                     params.append(thread_filter.userId)
 
-                # 获取总数
-                cursor.execute(f"SELECT COUNT(*) FROM threads {where_clause}", params)
-                total = cursor.fetchone()[0]
+                # 从游标之后继续（键集分页），深页与首页一样只读索引中的一段
+                after = _decode_thread_cursor(pagination.cursor)
+                if after is not None:
+                    conditions.append("(createdAt, id) < (?, ?)")
+                    params.extend(after)
 
-                # 计算偏移量（基于cursor）
-                offset = 0
-                if pagination.cursor:
-                    try:
-                        offset = int(pagination.cursor)
-                    except (ValueError, TypeError):
-                        offset = 0
-
-                # 获取分页数据
-                params.extend([pagination.first, offset])
+                # 多取一行判断是否还有下一页，不再统计总数
+                params.append(pagination.first + 1)
                 cursor.execute(f"""
-                    SELECT * FROM threads {where_clause}
-                    ORDER BY createdAt DESC
-                    LIMIT ? OFFSET ?
+                    SELECT * FROM threads WHERE {' AND '.join(conditions)}
+                    ORDER BY createdAt DESC, id DESC
+                    LIMIT ?
                 """, params)
+                rows = cursor.fetchall()
+                has_next_page = len(rows) > pagination.first
+                rows = rows[:pagination.first]
 
                 threads = []
-                for row in cursor.fetchall():
+                for row in rows:
                     threads.append({
                         "id": row[0],
                         "createdAt": row[1],
@@ -541,24 +739,23 @@ class SQLiteDataLayer(BaseDataLayer):
 
                 return PaginatedResponse(
                     data=threads,
-                    pageInfo={
-                        "hasNextPage": offset + pagination.first < total,
-                        "hasPreviousPage": offset > 0,
-                        "startCursor": str(offset),
-                        "endCursor": str(offset + len(threads))
-                    }
+                    pageInfo=PageInfo(
+                        hasNextPage=has_next_page,
+                        startCursor=_encode_thread_cursor(rows[0]) if rows else None,
+                        endCursor=_encode_thread_cursor(rows[-1]) if rows else None,
+                    )
                 )
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _list_threads)
+        return await self.pool.run(_list_threads)
 
     async def delete_thread(self, thread_id: str):
         """删除线程 - Chainlit已在API层面处理认证和授权"""
         logger.info(f"🗑️ DELETE_THREAD 被调用！线程ID: {thread_id}")
 
         def _delete_thread():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=True)
             cursor = conn.cursor()
             try:
                 # 首先检查线程是否存在
@@ -600,14 +797,14 @@ class SQLiteDataLayer(BaseDataLayer):
                 conn.rollback()
                 raise
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _delete_thread)
+        return await self.pool.run(_delete_thread)
 
     async def create_step(self, step_dict: StepDict) -> StepDict:
         """创建步骤"""
         def _create_step():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=True)
             cursor = conn.cursor()
             try:
                 cursor.execute("""
@@ -643,14 +840,14 @@ class SQLiteDataLayer(BaseDataLayer):
                 conn.commit()
                 return step_dict
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _create_step)
+        return await self.pool.run(_create_step)
 
     async def get_steps(self, thread_id: str) -> List[StepDict]:
         """获取线程的所有步骤"""
         def _get_steps():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=False)
             cursor = conn.cursor()
             try:
                 cursor.execute("""
@@ -685,22 +882,22 @@ class SQLiteDataLayer(BaseDataLayer):
                     })
                 return steps
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _get_steps)
+        return await self.pool.run(_get_steps)
 
     async def delete_step(self, step_id: str):
         """删除步骤"""
         def _delete_step():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=True)
             cursor = conn.cursor()
             try:
                 cursor.execute("DELETE FROM steps WHERE id = ?", (step_id,))
                 conn.commit()
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _delete_step)
+        return await self.pool.run(_delete_step)
 
     # 简化实现，其他方法返回空或默认值
     async def create_element(self, element: ElementDict) -> ElementDict:
@@ -728,7 +925,7 @@ class SQLiteDataLayer(BaseDataLayer):
         logger.info(f"🔍 GET_THREAD_AUTHOR 被调用！线程ID: {thread_id}")
 
         def _get_thread_author():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=False)
             cursor = conn.cursor()
             try:
                 # 查询线程的 userIdentifier（用户名）而不是 userId（UUID）
@@ -752,16 +949,16 @@ class SQLiteDataLayer(BaseDataLayer):
                 logger.error(f"❌ 获取线程作者失败: {e}")
                 return ""
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        result = await asyncio.get_event_loop().run_in_executor(None, _get_thread_author)
+        result = await self.pool.run(_get_thread_author)
         logger.info(f"🎯 GET_THREAD_AUTHOR 返回结果: '{result}'")
         return result
 
     async def update_step(self, step_dict: StepDict):
         """更新步骤"""
         def _update_step():
-            conn = sqlite3.connect(self.db_path)
+            conn = self.pool.acquire(write=True)
             cursor = conn.cursor()
             try:
                 cursor.execute("""
@@ -801,6 +998,6 @@ class SQLiteDataLayer(BaseDataLayer):
                 print(f"更新步骤失败: {e}")
                 raise
             finally:
-                conn.close()
+                self.pool.release(conn)
 
-        return await asyncio.get_event_loop().run_in_executor(None, _update_step)
+        return await self.pool.run(_update_step)
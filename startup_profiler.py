@@ -0,0 +1,73 @@
+# startup_profiler.py
+"""
+启动耗时分析
+
+通过 `--profile-startup` 命令行参数或环境变量 AGENT_PROFILE_STARTUP=1 启用，
+按阶段（导入、配置、LLM 构建、MCP 启动、图编译、检查点存储器）记录耗时并打印汇总。
+未启用时 profile_phase 不做任何事情。
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+PROFILE_FLAG = "--profile-startup"
+PROFILE_ENV = "AGENT_PROFILE_STARTUP"
+
+
+class StartupProfiler:
+    """按阶段记录启动耗时"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.reported = False
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def report(self):
+        """打印各阶段耗时及占比"""
+        total = time.perf_counter() - self.started_at
+        print("\n⏱️ 启动耗时分析:")
+        for name, seconds in self.phases:
+            share = seconds / total * 100 if total else 0.0
+            print(f"  {name:<24} {seconds * 1000:>9.1f} ms  {share:>5.1f}%")
+        accounted = sum(seconds for _, seconds in self.phases)
+        print(f"  {'其他':<24} {(total - accounted) * 1000:>9.1f} ms")
+        print(f"  {'总计':<24} {total * 1000:>9.1f} ms")
+        self.reported = True
+
+
+_profiler: Optional[StartupProfiler] = None
+
+
+def enable_startup_profiling() -> bool:
+    """根据命令行参数或环境变量启用启动耗时分析"""
+    global _profiler
+    if _profiler is None and (PROFILE_FLAG in sys.argv or os.environ.get(PROFILE_ENV) == "1"):
+        _profiler = StartupProfiler()
+    return _profiler is not None
+
+
+@contextmanager
+def profile_phase(name: str):
+    """记录一个启动阶段的耗时（未启用分析时为空操作）"""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.phase(name):
+        yield
+
+
+def print_startup_profile():
+    """打印启动耗时汇总（每个进程只打印一次）"""
+    if _profiler is not None and not _profiler.reported:
+        _profiler.report()
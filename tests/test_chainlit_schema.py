@@ -0,0 +1,117 @@
+"""
+Chainlit 历史数据库迁移和查询计划测试
+
+用 EXPLAIN QUERY PLAN 确认数据层和过期会话清理的常用查询都走 chainlit_schema 迁移建立的索引，
+不出现全表扫描或额外的排序；并在仓库自带的旧版数据库（user_version 为 0）的临时副本上验证原地迁移。
+"""
+
+import shutil
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from chainlit_schema import SCHEMA_VERSION, apply_migrations, schema_version
+from sqlite_connection_pool import close_all_connection_pools
+from sqlite_data_layer import THREAD_ELEMENTS_QUERY, THREAD_STEPS_QUERY, SQLiteDataLayer
+
+# 迁移前的 Chainlit 历史数据库（没有 lastActiveAt、archived 列和迁移建立的索引）
+BASELINE_DATABASE = PROJECT_ROOT / "data" / "chainlit_history.db"
+
+# (名称, SQL, 计划中必须出现的内容, 计划中不能出现的内容)
+PLAN_CHECKS = [
+    ("get_thread 步骤", THREAD_STEPS_QUERY,
+     ["SEARCH steps USING INDEX idx_steps_thread (threadId=?)"], ["SCAN", "TEMP B-TREE"]),
+    ("get_thread 元素", THREAD_ELEMENTS_QUERY,
+     ["SEARCH elements USING INDEX idx_elements_thread (threadId=?)"], ["SCAN"]),
+    ("get_thread 无线程行时的步骤计数", "SELECT COUNT(*) FROM steps WHERE threadId = ?",
+     ["USING COVERING INDEX idx_steps_thread (threadId=?)"], ["SCAN"]),
+    ("get_steps", "SELECT * FROM steps WHERE threadId = ? ORDER BY createdAt ASC",
+     ["SEARCH steps USING INDEX idx_steps_thread (threadId=?)"], ["SCAN", "TEMP B-TREE"]),
+    ("delete_thread 步骤", "DELETE FROM steps WHERE threadId = ?",
+     ["idx_steps_thread (threadId=?)"], ["SCAN"]),
+    ("delete_thread 元素", "DELETE FROM elements WHERE threadId = ?",
+     ["idx_elements_thread (threadId=?)"], ["SCAN"]),
+    ("delete_thread 反馈", "DELETE FROM feedbacks WHERE threadId = ?",
+     ["idx_feedbacks_thread (threadId=?)"], ["SCAN"]),
+    ("list_threads 首页", "SELECT * FROM threads WHERE archived = 0 AND userId = ? ORDER BY createdAt DESC, id DESC LIMIT ?",
+     ["SEARCH threads USING INDEX idx_threads_user_page (userId=? AND archived=?)"], ["SCAN", "TEMP B-TREE"]),
+    ("list_threads 游标翻页",
+     "SELECT * FROM threads WHERE archived = 0 AND userId = ? AND (createdAt, id) < (?, ?) "
+     "ORDER BY createdAt DESC, id DESC LIMIT ?",
+     ["SEARCH threads USING INDEX idx_threads_user_page (userId=? AND archived=? AND (createdAt,id)<(?,?))"],
+     ["SCAN", "TEMP B-TREE"]),
+    ("配额淘汰", "SELECT id FROM threads WHERE userId = ? AND archived = 0 ORDER BY lastActiveAt ASC LIMIT ?",
+     ["idx_threads_user_active (userId=? AND archived=?)"], ["SCAN", "TEMP B-TREE"]),
+    ("过期清理 步骤活动时间", "SELECT threadId, MAX(SUBSTR(createdAt, 1, 19)) FROM steps GROUP BY threadId",
+     ["COVERING INDEX idx_steps_thread"], ["TEMP B-TREE"]),
+    ("过期清理 分批删除", "DELETE FROM steps WHERE rowid IN (SELECT rowid FROM steps WHERE threadId IN (?, ?) LIMIT ?)",
+     ["idx_steps_thread (threadId=?)"], ["SCAN steps"]),
+]
+
+
+def query_plan(conn: sqlite3.Connection, sql: str) -> str:
+    params = (None,) * sql.count("?")
+    return "\n".join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def index_names(conn: sqlite3.Connection) -> set:
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """仓库自带旧版数据库的临时副本，不修改原文件"""
+    db_path = tmp_path / "chainlit_history.db"
+    shutil.copy2(BASELINE_DATABASE, db_path)
+    return db_path
+
+
+@pytest.fixture(params=["new", "baseline"])
+def migrated_db(request, tmp_path):
+    """数据层新建的数据库，以及在原地迁移后由数据层打开的旧版数据库"""
+    db_path = tmp_path / "chainlit_history.db"
+    if request.param == "baseline":
+        shutil.copy2(BASELINE_DATABASE, db_path)
+        with sqlite3.connect(db_path) as conn:
+            apply_migrations(conn)
+    SQLiteDataLayer(str(db_path))
+    close_all_connection_pools()
+    return db_path
+
+
+@pytest.mark.parametrize("name, sql, required, forbidden", PLAN_CHECKS, ids=[check[0] for check in PLAN_CHECKS])
+def test_query_plan_uses_indexes(migrated_db, name, sql, required, forbidden):
+    with sqlite3.connect(migrated_db) as conn:
+        plan = query_plan(conn, sql)
+    assert [r for r in required if r not in plan] == [], plan
+    assert [f for f in forbidden if f in plan] == [], plan
+
+
+def test_migrate_baseline_database(baseline_db):
+    with sqlite3.connect(baseline_db) as conn:
+        assert schema_version(conn) == 0
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("users", "threads", "steps")}
+
+        assert apply_migrations(conn) == [version for version in range(1, SCHEMA_VERSION + 1)]
+        assert schema_version(conn) == SCHEMA_VERSION
+        # 已是当前版本时不再执行任何迁移
+        assert apply_migrations(conn) == []
+
+        for table, count in counts.items():
+            assert conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == count
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(threads)")}
+        assert {"lastActiveAt", "archived"} <= columns
+        assert conn.execute("SELECT COUNT(*) FROM threads WHERE lastActiveAt IS NULL OR createdAt IS NULL").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM threads WHERE archived != 0").fetchone()[0] == 0
+
+        indexes = index_names(conn)
+        assert {"idx_steps_thread", "idx_elements_thread", "idx_feedbacks_thread", "idx_threads_user_page"} <= indexes
+        # 版本 2 用包含 id 的索引代替版本 1 的线程列表索引
+        assert "idx_threads_user_created" not in indexes
+
@@ -0,0 +1,155 @@
+# thread_catalog.py
+"""
+会话目录
+
+thread_catalog 表与检查点保存在同一个数据库中，每个会话一行：会话 ID、用户 ID、创建和最后活动时间、
+消息数和标题（第一条用户消息）。TunedAsyncSqliteSaver 写入根图检查点时在同一个事务中更新这一行，
+因此目录始终与检查点一致。
+
+按 (user_id, last_active_at) 建索引，列出用户最近的会话、恢复会话时查找所属用户都只读索引，
+与检查点表的大小无关。分片存储器的每个分片各有一张目录表，查询时合并结果。
+
+被配额归档的 CLI 会话（session_quota.py 中的 archived_sessions 表）不再列出；
+启动时会话配额索引也从目录读取会话，不再按线程聚合检查点表。
+"""
+
+import re
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+# CLI 会话 ID 的格式为 <user_id>_<8 位十六进制>，补充旧会话时据此得到所属用户
+CLI_THREAD_ID = re.compile(r"^(?P<user_id>.+)_[0-9a-f]{8}$")
+
+CATALOG_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS thread_catalog (
+        thread_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        created_at TEXT NOT NULL,
+        last_active_at TEXT NOT NULL,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        title TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_thread_catalog_user ON thread_catalog (user_id, last_active_at)",
+)
+
+# 已有的行保留创建时间、标题和用户；消息数未知（None）时保留原值
+CATALOG_UPSERT = """
+INSERT INTO thread_catalog (thread_id, user_id, created_at, last_active_at, message_count, title)
+VALUES (?, ?, ?, ?, COALESCE(?, 0), ?)
+ON CONFLICT (thread_id) DO UPDATE SET
+    user_id = COALESCE(thread_catalog.user_id, excluded.user_id),
+    last_active_at = MAX(thread_catalog.last_active_at, excluded.last_active_at),
+    message_count = COALESCE(?, thread_catalog.message_count),
+    title = COALESCE(thread_catalog.title, excluded.title)
+"""
+
+# 目录表首次创建时，为已有会话补充目录行（只有 ID、时间和 CLI 会话的用户，消息数和标题在下次对话时更新）
+BACKFILL_QUERY = (
+    "SELECT thread_id, MIN(checkpoint_id), MAX(checkpoint_id) FROM checkpoints "
+    "WHERE checkpoint_ns = '' GROUP BY thread_id"
+)
+
+NOT_ARCHIVED = "thread_id NOT IN (SELECT thread_id FROM archived_sessions)"
+
+CATALOG_COLUMNS = ("thread_id", "user_id", "created_at", "last_active_at", "message_count", "title")
+
+TITLE_MAX_CHARS = 50
+
+
+def _title(messages: List[Any]) -> Optional[str]:
+    for message in messages:
+        if getattr(message, "type", None) == "human" and isinstance(message.content, str):
+            title = re.sub(r"\s+", " ", message.content).strip()
+            if title:
+                return title[:TITLE_MAX_CHARS]
+    return None
+
+
+def catalog_row(config: Dict[str, Any], checkpoint: Dict[str, Any]) -> Optional[tuple]:
+    """检查点对应的目录行（CATALOG_UPSERT 的参数），子图检查点返回 None"""
+    configurable = config["configurable"]
+    if configurable.get("checkpoint_ns"):
+        return None
+    messages = checkpoint.get("channel_values", {}).get("messages")
+    count = len(messages) if isinstance(messages, list) else None
+    title = _title(messages) if isinstance(messages, list) else None
+    ts = checkpoint["ts"]
+    return (str(configurable["thread_id"]), configurable.get("user_id"), ts, ts, count, title, count)
+
+
+def backfill_row(thread_id: str, first_checkpoint_id: str, last_checkpoint_id: str) -> tuple:
+    match = CLI_THREAD_ID.match(str(thread_id))
+    user_id = match.group("user_id") if match else None
+    return (str(thread_id), user_id, _uuid6_iso(first_checkpoint_id), _uuid6_iso(last_checkpoint_id),
+            None, None, None)
+
+
+class ThreadCatalog:
+    """查询检查点存储器中的会话目录"""
+
+    def __init__(self, checkpointer):
+        self.checkpointer = checkpointer
+        inner = getattr(checkpointer, "inner", checkpointer)
+        self.savers = list(getattr(inner, "shards", None) or [inner])
+
+    @classmethod
+    def from_checkpointer(cls, checkpointer) -> Optional["ThreadCatalog"]:
+        """只有 SQLite 存储器维护会话目录，其他存储器返回 None"""
+        inner = getattr(checkpointer, "inner", checkpointer)
+        savers = getattr(inner, "shards", None) or [inner]
+        if not all(hasattr(s, "_catalog_statements") for s in savers):
+            return None
+        return cls(checkpointer)
+
+    async def _query(self, saver, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        await saver.setup()
+        async with saver.lock:
+            async with saver.conn.execute(sql, params) as cur:
+                return [dict(zip(CATALOG_COLUMNS, row)) for row in await cur.fetchall()]
+
+    async def _flush(self):
+        # 写回缓存中排队的检查点尚未写入目录
+        flush = getattr(self.checkpointer, "flush", None)
+        if flush is not None:
+            await flush()
+
+    async def list_sessions(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """用户最近活动的未归档会话，最近的在前"""
+        await self._flush()
+        sql = (f"SELECT {', '.join(CATALOG_COLUMNS)} FROM thread_catalog WHERE user_id = ? "
+               f"AND {NOT_ARCHIVED} ORDER BY last_active_at DESC LIMIT ?")
+        sessions = []
+        for saver in self.savers:
+            sessions.extend(await self._query(saver, sql, (user_id, limit)))
+        sessions.sort(key=lambda s: s["last_active_at"], reverse=True)
+        return sessions[:limit]
+
+    async def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """按会话 ID 查找目录行"""
+        await self._flush()
+        sql = f"SELECT {', '.join(CATALOG_COLUMNS)} FROM thread_catalog WHERE thread_id = ?"
+        for saver in self.savers:
+            rows = await self._query(saver, sql, (thread_id,))
+            if rows:
+                return rows[0]
+        return None
+
+    async def active_sessions(self) -> List[Dict[str, Any]]:
+        """全部未归档的会话，最久未活动的在前（启动时载入会话配额索引）"""
+        await self._flush()
+        sql = f"SELECT {', '.join(CATALOG_COLUMNS)} FROM thread_catalog WHERE {NOT_ARCHIVED}"
+        sessions = []
+        for saver in self.savers:
+            sessions.extend(await self._query(saver, sql, ()))
+        sessions.sort(key=lambda s: s["last_active_at"])
+        return sessions
+
+
+def _uuid6_iso(checkpoint_id: str) -> str:
+    """checkpoint_id（uuid6）中的时间戳，格式与检查点的 ts 字段一致"""
+    high = UUID(checkpoint_id).int >> 64
+    timestamp = ((high >> 16) << 12) | (high & 0xFFF)
+    return datetime.fromtimestamp((timestamp - 0x01B21DD213814000) / 10_000_000, timezone.utc).isoformat()
@@ -0,0 +1,91 @@
+# tool_executor.py
+"""
+工具执行节点
+
+并发执行同一条 AIMessage 中的多个工具调用。每个 MCP 服务器有独立的并发上限（信号量），
+每次调用有独立的截止时间，超时的调用返回一条超时 ToolMessage，而不会拖住整个回合。
+"""
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+
+# 默认值，可在 mcp_config.json 的 toolExecution 中覆盖，或按服务器设置 max_concurrency / call_timeout
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_CALL_TIMEOUT = 60.0
+
+# 不属于任何 MCP 服务器的本地工具共用的信号量名称
+LOCAL_TOOLS_KEY = "__local__"
+
+
+class ToolExecutor:
+    """并发工具执行器，作为 LangGraph 的 tools 节点使用"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        options = getattr(registry, "execution_options", None) or {}
+        self.default_max_concurrency = int(options.get("default_max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        self.default_call_timeout = float(options.get("default_call_timeout", DEFAULT_CALL_TIMEOUT))
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.metrics = {"calls": 0, "timeouts": 0, "errors": 0}
+
+    def _server_option(self, server_name: Optional[str], key: str, default):
+        server_configs = getattr(self.registry, "server_configs", {})
+        if server_name in server_configs:
+            return server_configs[server_name].get(key, default)
+        return default
+
+    def _semaphore(self, server_name: Optional[str]) -> asyncio.Semaphore:
+        key = server_name or LOCAL_TOOLS_KEY
+        if key not in self._semaphores:
+            limit = int(self._server_option(server_name, "max_concurrency", self.default_max_concurrency))
+            self._semaphores[key] = asyncio.Semaphore(max(limit, 1))
+        return self._semaphores[key]
+
+    async def _run_call(self, tool_call: Dict[str, Any], tools_by_name: Dict[str, BaseTool],
+                        config: RunnableConfig) -> ToolMessage:
+        name = tool_call["name"]
+        tool = tools_by_name.get(name)
+        if tool is None:
+            return ToolMessage(
+                content=f"Error: 工具 '{name}' 不存在，可用工具: {', '.join(tools_by_name)}",
+                name=name, tool_call_id=tool_call["id"], status="error",
+            )
+
+        server_name = self.registry.server_of(name)
+        timeout = float(self._server_option(server_name, "call_timeout", self.default_call_timeout))
+        self.metrics["calls"] += 1
+        start = time.perf_counter()
+        try:
+            # 截止时间包含排队等待信号量的时间
+            async with asyncio.timeout(timeout):
+                async with self._semaphore(server_name):
+                    return await tool.ainvoke({**tool_call, "type": "tool_call"}, config)
+        except TimeoutError:
+            self.metrics["timeouts"] += 1
+            print(f"⏱️ 工具 {name} 超时 ({time.perf_counter() - start:.1f}s)")
+            return ToolMessage(
+                content=f"Error: 工具 '{name}' 在 {timeout:g} 秒内未返回结果，调用已超时。",
+                name=name, tool_call_id=tool_call["id"], status="error",
+            )
+        except Exception as e:
+            self.metrics["errors"] += 1
+            return ToolMessage(
+                content=f"Error: {e!r}\n Please fix your mistakes.",
+                name=name, tool_call_id=tool_call["id"], status="error",
+            )
+
+    async def __call__(self, state: Dict[str, Any], config: RunnableConfig) -> Dict[str, List[ToolMessage]]:
+        last_message = state["messages"][-1]
+        if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
+            return {"messages": []}
+
+        tools_by_name = {tool.name: tool for tool in self.registry.tools}
+        results = await asyncio.gather(*(
+            self._run_call(tool_call, tools_by_name, config) for tool_call in last_message.tool_calls
+        ))
+        return {"messages": list(results)}
@@ -0,0 +1,121 @@
+# tool_result_cache.py
+"""
+MCP 工具调用结果缓存
+
+按 工具名称 + 规范化参数 缓存工具返回值。每个工具有独立的 TTL、容量上限和 LRU 淘汰，
+非幂等工具可以在 mcp_config.json 中关闭缓存。工具返回错误（ToolException）时不缓存。
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# 默认参数，可在 mcp_config.json 中按服务器的 result_cache 或按工具覆盖
+DEFAULT_TTL_SECONDS = 300.0
+DEFAULT_MAX_ENTRIES = 128
+
+
+def canonical_arguments(arguments: Dict[str, Any]) -> str:
+    """把调用参数规范化为稳定的字符串：键排序，去掉多余空白"""
+    return json.dumps(arguments, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class ToolResultCache:
+    """单个工具的结果缓存（TTL + LRU）"""
+
+    def __init__(self, tool_name: str, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.tool_name = tool_name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(int(max_entries), 1)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, arguments: Dict[str, Any]) -> Tuple[bool, Any]:
+        """查找缓存，返回 (是否命中, 结果)"""
+        key = canonical_arguments(arguments)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return True, value
+            del self._entries[key]
+            self.metrics["expirations"] += 1
+        self.metrics["misses"] += 1
+        return False, None
+
+    def put(self, arguments: Dict[str, Any], value: Any):
+        key = canonical_arguments(arguments)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ToolResultCacheSet:
+    """
+    按工具管理结果缓存
+
+    配置来自 mcp_config.json 中每个服务器的 result_cache 字段，例如：
+
+        "result_cache": {
+            "ttl_seconds": 600,
+            "max_entries": 256,
+            "tools": {"some_write_tool": {"enabled": false}}
+        }
+
+    未配置 result_cache 的服务器不缓存；"enabled": false 可以在服务器或单个工具上关闭缓存。
+    """
+
+    def __init__(self, server_configs: Dict[str, Dict[str, Any]]):
+        self.server_configs = server_configs
+        self._caches: Dict[str, Optional[ToolResultCache]] = {}
+
+    def _tool_options(self, server_name: str, tool_name: str) -> Optional[Dict[str, Any]]:
+        server_options = self.server_configs.get(server_name, {}).get("result_cache")
+        if not server_options or not server_options.get("enabled", True):
+            return None
+        options = {k: v for k, v in server_options.items() if k != "tools"}
+        options.update(server_options.get("tools", {}).get(tool_name, {}))
+        return options if options.get("enabled", True) else None
+
+    def for_tool(self, server_name: str, tool_name: str) -> Optional[ToolResultCache]:
+        """获取工具的缓存，未启用缓存时返回 None"""
+        key = f"{server_name}/{tool_name}"
+        if key not in self._caches:
+            options = self._tool_options(server_name, tool_name)
+            self._caches[key] = None if options is None else ToolResultCache(
+                tool_name,
+                ttl_seconds=float(options.get("ttl_seconds", DEFAULT_TTL_SECONDS)),
+                max_entries=int(options.get("max_entries", DEFAULT_MAX_ENTRIES)),
+            )
+        return self._caches[key]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各工具的命中统计"""
+        return {
+            key: {**cache.metrics, "size": len(cache)}
+            for key, cache in self._caches.items() if cache is not None
+        }
+
+    def print_metrics(self):
+        """打印各工具的缓存命中率"""
+        stats = self.stats()
+        if not stats:
+            return
+        print("📊 MCP 工具结果缓存:")
+        for key, m in stats.items():
+            lookups = m["hits"] + m["misses"]
+            hit_rate = m["hits"] / lookups * 100 if lookups else 0.0
+            print(f"  {key}: 命中 {m['hits']}, 未命中 {m['misses']} ({hit_rate:.1f}%), "
+                  f"淘汰 {m['evictions']}, 过期 {m['expirations']}, 当前 {m['size']} 条")
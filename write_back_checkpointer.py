@@ -0,0 +1,433 @@
+# write_back_checkpointer.py
+"""
+检查点的内存写回缓存
+
+活跃会话的每一轮都要先从 SQLite 读回最新检查点，每个 superstep 再写入新检查点和 writes。
+WriteBackCheckpointSaver 包在 create_checkpointer 返回的存储器外面：
+
+1. 最近活跃的线程按 LRU 保存在内存中，读取最新检查点（或缓存中的某个检查点）不再访问数据库；
+2. aput / aput_writes 只更新内存并进入写入队列，后台任务按 flush_interval_seconds 把队列
+   批量写入底层存储器（SQLite 存储器在一个事务中提交一批）；
+3. 内存上限由 max_threads 和 max_bytes 控制，只淘汰已经写入数据库的线程；超过上限时提前写入；
+4. aclose 时让后台任务写完当前批次后退出（不取消正在进行的写入），再写完队列、关闭底层存储器。
+
+缓存中保存的是检查点对象本身而不是序列化结果：LangGraph 每步都生成新的通道值，
+读取时返回 copy_checkpoint 副本，避免图执行时原地修改版本信息影响缓存。
+缓存假设只有当前进程在写这些线程（与共享连接的设计一致）；
+alist、未命中缓存的读取和 adelete_thread 会先写入队列，保证读到的数据与内存一致。
+进程异常退出时，最多丢失最后一个写入间隔内的检查点。
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    copy_checkpoint,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from message_history import MESSAGES_CHANNEL, slice_page
+
+# 默认参数，可在 persistence_config.json 的 write_back_cache 中覆盖
+DEFAULT_MAX_THREADS = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_CHECKPOINTS_PER_THREAD = 4
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.0
+DEFAULT_MAX_PENDING_OPERATIONS = 500
+DEFAULT_FLUSH_BATCH_SIZE = 100
+
+# 估算内存占用时每个对象的固定开销
+OBJECT_OVERHEAD_BYTES = 64
+MESSAGE_OVERHEAD_BYTES = 512
+
+ThreadKey = Tuple[str, str]
+
+
+def estimate_size(value: Any) -> int:
+    """粗略估算检查点值占用的内存字节数（只统计文本和容器，不做序列化）"""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, BaseMessage):
+        return (MESSAGE_OVERHEAD_BYTES + estimate_size(value.content)
+                + estimate_size(value.additional_kwargs) + estimate_size(getattr(value, "tool_calls", None)))
+    if isinstance(value, dict):
+        return OBJECT_OVERHEAD_BYTES + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return OBJECT_OVERHEAD_BYTES + sum(estimate_size(v) for v in value)
+    return OBJECT_OVERHEAD_BYTES
+
+
+class _CachedThread:
+    """一个 (thread_id, checkpoint_ns) 在内存中的最近检查点"""
+
+    def __init__(self):
+        # checkpoint_id -> {"checkpoint", "metadata", "parent_id", "size",
+        #                   "writes": {(task_id, idx): (channel, value)}, "writes_size"}
+        self.checkpoints: Dict[str, Dict[str, Any]] = {}
+        self.size = 0
+
+    def latest_id(self) -> Optional[str]:
+        # checkpoint_id 是 uuid6，按时间有序，与 SQLite 中 ORDER BY checkpoint_id DESC 一致
+        return max(self.checkpoints) if self.checkpoints else None
+
+    def measure(self) -> int:
+        # 同一线程的检查点共享同一批消息对象，检查点只按最新的一个计算
+        latest = self.checkpoints.get(self.latest_id())
+        self.size = (latest["size"] if latest else 0) + sum(r["writes_size"] for r in self.checkpoints.values())
+        return self.size
+
+
+class WriteBackCheckpointSaver(BaseCheckpointSaver[str]):
+    """在任意检查点存储器前面的 LRU 内存缓存，写入异步批量落盘"""
+
+    def __init__(self, inner: BaseCheckpointSaver,
+                 max_threads: int = DEFAULT_MAX_THREADS,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_checkpoints_per_thread: int = DEFAULT_MAX_CHECKPOINTS_PER_THREAD,
+                 flush_interval_seconds: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 max_pending_operations: int = DEFAULT_MAX_PENDING_OPERATIONS,
+                 flush_batch_size: int = DEFAULT_FLUSH_BATCH_SIZE):
+        super().__init__()
+        self.inner = inner
+        self.max_threads = max(int(max_threads), 1)
+        self.max_bytes = int(max_bytes)
+        self.max_checkpoints_per_thread = max(int(max_checkpoints_per_thread), 1)
+        self.flush_interval_seconds = float(flush_interval_seconds)
+        self.max_pending_operations = max(int(max_pending_operations), 1)
+        self.flush_batch_size = max(int(flush_batch_size), 1)
+
+        self._threads: "OrderedDict[ThreadKey, _CachedThread]" = OrderedDict()
+        self._size = 0
+        # 待写入的操作: (线程, 操作)，操作格式与 TunedAsyncSqliteSaver.aput_batch 相同
+        self._queue: List[Tuple[ThreadKey, tuple]] = []
+        self._pending: Dict[ThreadKey, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "flushes": 0,
+            "flushed_operations": 0,
+            "max_batch": 0,
+            "flush_seconds": 0.0,
+            "flush_failures": 0,
+            "evictions": 0,
+        }
+
+    @classmethod
+    def from_config(cls, checkpointer, persistence_config: Dict[str, Any]):
+        """根据 write_back_cache 配置包装存储器；未启用或是内存存储器时原样返回"""
+        options = persistence_config.get("write_back_cache", {})
+        if not options.get("enabled", False):
+            return checkpointer
+        from langgraph.checkpoint.memory import InMemorySaver
+        if isinstance(checkpointer, InMemorySaver):
+            return checkpointer
+        saver = cls(
+            checkpointer,
+            max_threads=options.get("max_threads", DEFAULT_MAX_THREADS),
+            max_bytes=options.get("max_bytes", DEFAULT_MAX_BYTES),
+            max_checkpoints_per_thread=options.get("max_checkpoints_per_thread", DEFAULT_MAX_CHECKPOINTS_PER_THREAD),
+            flush_interval_seconds=options.get("flush_interval_seconds", DEFAULT_FLUSH_INTERVAL_SECONDS),
+            max_pending_operations=options.get("max_pending_operations", DEFAULT_MAX_PENDING_OPERATIONS),
+            flush_batch_size=options.get("flush_batch_size", DEFAULT_FLUSH_BATCH_SIZE),
+        )
+        print(f"🧠 检查点写回缓存: 最多 {saver.max_threads} 个线程 / {saver.max_bytes // (1024 * 1024)} MB, "
+              f"每 {saver.flush_interval_seconds:g}s 批量写入")
+        return saver
+
+    @staticmethod
+    def _key(config: RunnableConfig) -> ThreadKey:
+        configurable = config["configurable"]
+        return str(configurable["thread_id"]), configurable.get("checkpoint_ns", "")
+
+    # ---- 读取 ----
+
+    def _to_tuple(self, key: ThreadKey, checkpoint_id: str, record: Dict[str, Any]) -> CheckpointTuple:
+        thread_id, checkpoint_ns = key
+        parent_id = record["parent_id"]
+        # 图执行时会原地修改检查点中的版本信息，返回副本，缓存中的对象保持不变
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}},
+            copy_checkpoint(record["checkpoint"]),
+            dict(record["metadata"]),
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+            if parent_id else None,
+            # 与 SQLite 的 ORDER BY task_id, idx 一致
+            [(task_id, channel, value) for (task_id, _), (channel, value) in sorted(record["writes"].items())],
+        )
+
+    def _cached(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        key = self._key(config)
+        entry = self._threads.get(key)
+        if entry is None:
+            return None
+        checkpoint_id = get_checkpoint_id(config) or entry.latest_id()
+        record = entry.checkpoints.get(checkpoint_id)
+        if record is None:
+            return None
+        self._threads.move_to_end(key)
+        return self._to_tuple(key, checkpoint_id, record)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        cached = self._cached(config)
+        if cached is not None:
+            self.metrics["hits"] += 1
+            return cached
+
+        self.metrics["misses"] += 1
+        key = self._key(config)
+        if self._pending.get(key):
+            await self.flush()
+        result = await self.inner.aget_tuple(config)
+        # 只缓存读取到的最新检查点，读取期间有新写入时以内存为准
+        if result is not None and not get_checkpoint_id(config) and key not in self._threads:
+            self._store(key, copy_checkpoint(result.checkpoint), dict(result.metadata),
+                        (result.parent_config or {}).get("configurable", {}).get("checkpoint_id"))
+            # idx 在每个任务内单独编号
+            by_task: Dict[str, List[tuple]] = {}
+            for write in result.pending_writes or []:
+                by_task.setdefault(write[0], []).append(write)
+            for task_writes in by_task.values():
+                self._add_writes(key, result.checkpoint["id"], task_writes)
+            self._evict()
+        return result
+
+    async def aget_message_page(self, config: RunnableConfig, limit: int, offset: int = 0):
+        """会话末尾的一页消息，命中缓存时直接切片最新检查点的消息列表，不复制检查点"""
+        key = self._key(config)
+        entry = self._threads.get(key)
+        if entry is not None and entry.checkpoints:
+            self.metrics["hits"] += 1
+            self._threads.move_to_end(key)
+            checkpoint = entry.checkpoints[entry.latest_id()]["checkpoint"]
+            return slice_page(checkpoint["channel_values"].get(MESSAGES_CHANNEL), limit, offset)
+
+        self.metrics["misses"] += 1
+        if self._pending.get(key):
+            await self.flush()
+        reader = getattr(self.inner, "aget_message_page", None)
+        if reader is not None:
+            return await reader(config, limit, offset)
+        result = await self.inner.aget_tuple(config)
+        if result is None:
+            return None
+        return slice_page(result.checkpoint["channel_values"].get(MESSAGES_CHANNEL), limit, offset)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        # 历史查询不走缓存，先把队列写入底层存储器
+        await self.flush()
+        async for item in self.inner.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    # ---- 写入 ----
+
+    def _store(self, key: ThreadKey, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+               parent_id: Optional[str]):
+        entry = self._threads.get(key)
+        if entry is None:
+            entry = self._threads[key] = _CachedThread()
+        self._threads.move_to_end(key)
+        entry.checkpoints[checkpoint["id"]] = {
+            "checkpoint": checkpoint,
+            "metadata": metadata,
+            "parent_id": parent_id,
+            "size": estimate_size(checkpoint["channel_values"]),
+            "writes": {},
+            "writes_size": 0,
+        }
+        # 每个线程只保留最近几个检查点，更早的检查点从底层存储器读取
+        while len(entry.checkpoints) > self.max_checkpoints_per_thread:
+            del entry.checkpoints[min(entry.checkpoints)]
+        self._remeasure(entry)
+
+    def _remeasure(self, entry: _CachedThread):
+        before = entry.size
+        self._size += entry.measure() - before
+
+    def _add_writes(self, key: ThreadKey, checkpoint_id: str, writes: Sequence[tuple]):
+        """把 (task_id, channel, value) 加入缓存中的检查点，规则与 aput_writes 相同"""
+        entry = self._threads.get(key)
+        record = entry.checkpoints.get(checkpoint_id) if entry is not None else None
+        if record is None:
+            return
+        for task_id, channel, value, idx, replace in writes_with_index(writes):
+            write_key = (task_id, idx)
+            if replace or write_key not in record["writes"]:
+                record["writes"][write_key] = (channel, value)
+        record["writes_size"] = sum(estimate_size(value) for _, value in record["writes"].values())
+        self._remeasure(entry)
+
+    def _enqueue(self, key: ThreadKey, operation: tuple):
+        self._queue.append((key, operation))
+        self._pending[key] = self._pending.get(key, 0) + 1
+        self._ensure_flush_task()
+        if len(self._queue) >= self.max_pending_operations or self._size > self.max_bytes:
+            self._flush_requested.set()
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        key = self._key(config)
+        checkpoint = copy_checkpoint(checkpoint)
+        # 与 SQLite 存储器一样把 config 中的元数据合并进检查点元数据
+        self._store(key, checkpoint, get_checkpoint_metadata(config, metadata),
+                    config["configurable"].get("checkpoint_id"))
+        self._enqueue(key, ("put", config, checkpoint, metadata, new_versions))
+        self._evict()
+        return {"configurable": {"thread_id": key[0], "checkpoint_ns": key[1], "checkpoint_id": checkpoint["id"]}}
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        key = self._key(config)
+        self._add_writes(key, config["configurable"]["checkpoint_id"],
+                         [(task_id, channel, value) for channel, value in writes])
+        self._enqueue(key, ("writes", config, list(writes), task_id, task_path))
+
+    # ---- 写入底层存储器 ----
+
+    async def _write(self, operations: List[tuple]):
+        aput_batch = getattr(self.inner, "aput_batch", None)
+        if aput_batch is not None:
+            await aput_batch(operations)
+            return
+        for operation in operations:
+            if operation[0] == "put":
+                await self.inner.aput(*operation[1:])
+            else:
+                await self.inner.aput_writes(*operation[1:])
+
+    async def flush(self) -> int:
+        """
+        把调用时队列中的操作写入底层存储器，返回写入的操作数
+
+        每一批提交成功后才从队列头部移除，写入失败或被取消时未提交的操作留在队列中等待下次写入。
+        被取消的批次可能已经在底层提交，重写同一检查点和 writes 会覆盖为相同内容
+        """
+        async with self._flush_lock:
+            # 写入期间新加入的操作排在后面，留给下一次写入
+            remaining = len(self._queue)
+            written = 0
+            # 按 flush_batch_size 分批提交，批次之间让出事件循环，避免一次序列化过多检查点阻塞对话
+            while remaining:
+                batch = self._queue[:min(self.flush_batch_size, remaining)]
+                start = time.perf_counter()
+                try:
+                    await self._write([operation for _, operation in batch])
+                except Exception:
+                    self.metrics["flush_failures"] += 1
+                    raise
+                del self._queue[:len(batch)]
+                for key, _ in batch:
+                    self._pending[key] -= 1
+                    if not self._pending[key]:
+                        del self._pending[key]
+                remaining -= len(batch)
+                written += len(batch)
+                self.metrics["flushes"] += 1
+                self.metrics["flushed_operations"] += len(batch)
+                self.metrics["max_batch"] = max(self.metrics["max_batch"], len(batch))
+                self.metrics["flush_seconds"] += time.perf_counter() - start
+                await asyncio.sleep(0)
+        self._evict()
+        return written
+
+    def _evict(self):
+        """按 LRU 淘汰已写入数据库的线程，直到线程数和字节数回到上限以内"""
+        while len(self._threads) > self.max_threads or self._size > self.max_bytes:
+            victim = next((key for key in self._threads if not self._pending.get(key)), None)
+            if victim is None:
+                # 剩下的线程都有未写入的数据，等待下一次写入后再淘汰
+                self._flush_requested.set()
+                return
+            entry = self._threads.pop(victim)
+            self._size -= entry.size
+            self.metrics["evictions"] += 1
+
+    def _ensure_flush_task(self):
+        if self._task is None and not self._closed:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            if self._closed:
+                # aclose 负责最后一次写入
+                return
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ 检查点写回失败，{len(self._queue)} 个操作将在下次重试: {e}")
+
+    # ---- 其他 ----
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        async with self._flush_lock:
+            thread_id = str(thread_id)
+            self._queue = [(key, op) for key, op in self._queue if key[0] != thread_id]
+            for key in [key for key in self._pending if key[0] == thread_id]:
+                del self._pending[key]
+            for key in [key for key in self._threads if key[0] == thread_id]:
+                self._size -= self._threads.pop(key).size
+            await self.inner.adelete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return self.inner.get_next_version(current, channel)
+
+    def print_metrics(self):
+        m = self.metrics
+        lookups = m["hits"] + m["misses"]
+        hit_rate = m["hits"] / lookups * 100 if lookups else 0.0
+        print(f"📊 检查点写回缓存: 命中 {m['hits']}/{lookups} ({hit_rate:.1f}%), "
+              f"批量写入 {m['flushes']} 次 / {m['flushed_operations']} 个操作 (最大批次 {m['max_batch']}, "
+              f"{m['flush_seconds']:.2f}s), 失败 {m['flush_failures']} 次, 淘汰 {m['evictions']} 个线程, "
+              f"缓存 {len(self._threads)} 个线程 / {self._size / 1024:.1f} KB")
+
+    async def aclose(self):
+        """停止后台写入，写完队列后关闭底层存储器"""
+        self._closed = True
+        if self._task is not None:
+            # 唤醒后台任务并等待它结束；正在进行的写入不取消，避免中途放弃已取出的批次
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+        pending = len(self._queue)
+        try:
+            await self.flush()
+            if pending:
+                print(f"💾 关闭前写入 {pending} 个检查点操作")
+        finally:
+            self.print_metrics()
+            aclose_inner = getattr(self.inner, "aclose", None)
+            if aclose_inner is not None:
+                await aclose_inner()
+
+
+def writes_with_index(writes: Sequence[tuple]):
+    """为 (task_id, channel, value) 计算与 SQLite 存储器相同的 idx 和覆盖规则"""
+    replace = all(channel in WRITES_IDX_MAP for _, channel, _ in writes)
+    for idx, (task_id, channel, value) in enumerate(writes):
+        yield task_id, channel, value, WRITES_IDX_MAP.get(channel, idx), replace